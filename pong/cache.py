@@ -0,0 +1,232 @@
+"""
+Caches that live for the lifetime of an export.
+
+Polarion round trips are the dominant cost of an export, and a lot of them are spent fetching the same
+WorkItem or TestRun more than once (for example, a query returns a TestCase, and then a TestCase(uri=...)
+is created from it which does a full fetch all over again).  The IdentityMap in this module makes sure
+that each uri is fetched at most once, and that every part of pong sees the same pylarion object for it.
+
+Some things are worth remembering between exports too.  The JsonStore types here keep small bits of state
+in CACHE_DIR (~/.pong by default, or the PONG_CACHE_DIR env var).
+"""
+
+import json
+import os
+import re
+import threading
+import time
+
+from pong.logger import log
+
+CACHE_DIR = os.environ.get("PONG_CACHE_DIR", os.path.expanduser("~/.pong"))
+
+
+class IdentityMap(object):
+    """
+    A uri -> pylarion object map.  Objects are either registered (eg from a query that already requested
+    all the needed fields) or fetched on first use via a factory function
+
+    The map is meant to live for one export only (a long running process like daemon.py clears it between
+    exports), since the objects in it are not refreshed when they change in Polarion
+    """
+    def __init__(self):
+        self._items = {}
+        self._pending = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, uri):
+        return uri in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def register(self, obj):
+        """
+        Adds an already fully populated pylarion object to the map.  If an object for the same uri is
+        already known, the known object wins so that everyone keeps sharing the same instance
+
+        :param obj: a pylarion object with a uri
+        :return: the object that is now in the map for obj.uri
+        """
+        with self._lock:
+            return self._items.setdefault(obj.uri, obj)
+
+    def get(self, uri, factory):
+        """
+        Returns the object for uri, calling factory(uri) only if it has not been seen before
+
+        The fetch is done without holding the lock of the map, so that threads fetching different uris don't
+        wait for each other.  Threads asking for a uri that is already being fetched wait for that fetch instead
+        of doing their own
+
+        :param uri: the uri of the object
+        :param factory: a function that takes the uri and returns a pylarion object
+        :return:
+        """
+        while True:
+            with self._lock:
+                if uri in self._items:
+                    self.hits += 1
+                    return self._items[uri]
+                fetching = self._pending.get(uri)
+                if fetching is None:
+                    fetching = self._pending[uri] = threading.Event()
+                    self.misses += 1
+                    break
+            # Someone else is fetching it.  If their fetch fails, try again ourselves
+            fetching.wait()
+
+        try:
+            obj = factory(uri)
+            with self._lock:
+                return self._items.setdefault(uri, obj)
+        finally:
+            with self._lock:
+                self._pending.pop(uri, None)
+            fetching.set()
+
+    def evict(self, uri):
+        with self._lock:
+            self._items.pop(uri, None)
+
+    def clear(self):
+        with self._lock:
+            log.debug("Clearing identity map (hits={}, misses={})".format(self.hits, self.misses))
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# The identity map shared by everything in one export (see IdentityMap)
+WORK_ITEMS = IdentityMap()
+
+
+class JsonStore(object):
+    """
+    A small dict that is persisted as a json file in the cache dir.  Failing to read or write the file is
+    never fatal, since everything in here can be recomputed from Polarion
+    """
+    def __init__(self, name, cache_dir=None):
+        self.path = os.path.join(CACHE_DIR if cache_dir is None else cache_dir, name)
+        self._lock = threading.RLock()
+        self._data = None
+
+    @property
+    def data(self):
+        with self._lock:
+            if self._data is None:
+                self._data = self._load()
+            return self._data
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r") as store:
+                return json.load(store)
+        except (IOError, ValueError) as ex:
+            log.warning("Ignoring unreadable cache {}: {}".format(self.path, ex))
+            return {}
+
+    def save(self):
+        """
+        Writes the store atomically (write to a temp file, then rename), readable only by the user
+        """
+        with self._lock:
+            tmp = self.path + ".tmp"
+            try:
+                cache_dir = os.path.dirname(self.path)
+                if not os.path.exists(cache_dir):
+                    os.makedirs(cache_dir, 0o700)
+                fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "w") as store:
+                    json.dump(self.data, store, sort_keys=True)
+                os.rename(tmp, self.path)
+            except (IOError, OSError) as ex:
+                log.warning("Could not write cache {}: {}".format(self.path, ex))
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, val):
+        with self._lock:
+            self.data[key] = val
+            self.save()
+
+    def pop(self, key):
+        with self._lock:
+            val = self.data.pop(key, None)
+            self.save()
+            return val
+
+    def clear(self):
+        with self._lock:
+            self._data = {}
+            self.save()
+
+
+class TTLStore(JsonStore):
+    """
+    A JsonStore whose entries expire ttl seconds after they were stored.  A ttl of 0 (or less) disables
+    the store entirely, which is handy to force a refresh
+    """
+    def __init__(self, name, ttl, cache_dir=None):
+        super(TTLStore, self).__init__(name, cache_dir=cache_dir)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        entry = super(TTLStore, self).get(key)
+        if entry is None or self.ttl <= 0:
+            return default
+        if time.time() - entry["stored"] > self.ttl:
+            log.debug("Cache entry for {} in {} has expired".format(key, self.path))
+            return default
+        return entry["value"]
+
+    def set(self, key, val):
+        if self.ttl > 0:
+            super(TTLStore, self).set(key, {"stored": time.time(), "value": val})
+
+
+class RunNumbers(JsonStore):
+    """
+    Remembers the last TestRun number handed out per base name (eg 12 for "RHSM Server x86_64 Run 12")
+
+    Polarion's search index can lag behind a TestRun that was just created, so the next number is always
+    max(last number on the server, last number handed out locally) + 1
+    """
+    def __init__(self, name="run_numbers.json", cache_dir=None):
+        super(RunNumbers, self).__init__(name, cache_dir=cache_dir)
+
+    def next(self, base_name, server_number=0):
+        """
+        Allocates the next run number for base_name and remembers it
+
+        :param base_name: the TestRun id without the "Run N" part
+        :param server_number: the number of the newest TestRun on the server (0 if there is none)
+        :return: int
+        """
+        with self._lock:
+            number = max(int(self.get(base_name, 0)), server_number) + 1
+            self.set(base_name, number)
+            return number
+
+
+def run_number(test_run_id):
+    """
+    Gets the trailing number out of a TestRun id
+
+    :param test_run_id: str (eg "RHSM Server x86_64 Run 12")
+    :return: int (0 if there is no number)
+    """
+    m = re.search(r"\s(\d+)$", test_run_id.strip())
+    return int(m.groups()[0]) if m else 0
+
+
+RUN_NUMBERS = RunNumbers()
+
+# TestRun templates rarely change, so remember what we need from them for a day by default
+DEFAULT_TEMPLATE_TTL = 24 * 60 * 60
+TEMPLATES = TTLStore("templates.json", DEFAULT_TEMPLATE_TTL)
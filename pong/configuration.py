@@ -24,9 +24,9 @@ from pong.logger import log
 import shutil
 import os
 import sys
+import time
 import logging
 
-import yaml
 from collections import Sequence
 
 from toolz.functoolz import partial, compose
@@ -205,6 +205,25 @@ class Configurator(object):
         """Takes in a PMap and returns a transformed map"""
         pass
 
+    def log_stage(self, before, after, log_lvl=None):
+        """
+        Logs what this Configurator changed in the map.  Only the changed keys are rendered, and only if
+        log_lvl is enabled
+
+        :param before: the map given to __call__
+        :param after: the map __call__ returns
+        :param log_lvl: defaults to DEFAULT_LOG_LEVEL
+        :return:
+        """
+        log_lvl = DEFAULT_LOG_LEVEL if log_lvl is None else log_lvl
+        if not log.isEnabledFor(log_lvl):
+            return
+        log.log(log_lvl, "=================== {} ====================".format(self.__class__))
+        changed, removed = map_diff(before, after)
+        dprint(changed, log_lvl=log_lvl)
+        for k in removed:
+            log.log(log_lvl, "{} removed".format(k))
+
     def __iter__(self):
         for x in dir(self):
             if not x.startswith("_") and not callable(x):
@@ -249,6 +268,23 @@ class ConfigRecord(PRecord):
     testrun_assignee = field()
     testrun_plannedin = field()
     testrun_group_id = field()
+    preload_full_fields = field()
+    template_cache_ttl = field()
+    pipeline = field()
+    testrun_workers = field()
+    incremental = field()
+    duplicate_action = field()
+    config_report = field()
+    testrecord_comment_limit = field()
+    pooled_transport = field()
+    wsdl_cache_days = field()
+    session_cache_ttl = field()
+    query_page_size = field()
+    targeted_query = field()
+    write_workers = field()
+    write_rate = field()
+    mirror = field()
+    mirror_full_sync_days = field()
 
     # These are "functions"
     update_run = field()
@@ -313,8 +349,7 @@ class JenkinsConfigurator(Configurator):
     def __call__(self, omap):
         self.original_map = omap
         updated = omap.update(self.jenkins_record)
-        log.log(DEFAULT_LOG_LEVEL, "=================== {} ====================".format(self.__class__))
-        dprint(updated)
+        self.log_stage(omap, updated)
         return updated
 
 
@@ -337,8 +372,7 @@ class OSEnvironmentConfigurator(Configurator):
     def __call__(self, config_map):
         self.original_map = config_map
         updated = config_map.update(self._make_record())
-        log.log(DEFAULT_LOG_LEVEL, "=================== {} ====================".format(self.__class__))
-        dprint(updated)
+        self.log_stage(config_map, updated)
         return updated
 
     def _make_record(self):
@@ -453,6 +487,62 @@ class CLIConfigRecord(PRecord):
                                        " it will override the value from the TestRun Template for Planned In")
     testrun_group_id = add_field("--testrun-group-id", default="",
                                 help="Actually used as a build id (for example the package version)")
+    preload_full_fields = add_field("--preload-full-fields", default=False,
+                                    help="When True, the testcases_query preload requests every TestCase field the"
+                                         " exporter needs, so matched TestCases are not fetched a second time")
+    template_cache_ttl = add_field("--template-cache-ttl",
+                                   help="Seconds to remember the plannedin and assignee of a TestRun template "
+                                        "(default is a day).  Use 0 to always look the template up")
+    pipeline = add_field("--pipeline", default=False,
+                         help="When True, create each TestRun first and add its TestRecords while the TestCases are"
+                              " still being created/updated, instead of after all of them are done")
+    testrun_workers = add_field("--testrun-workers", default=1,
+                                help="How many <suite> TestRuns may be created at the same time (default is 1)")
+    incremental = add_field("--incremental", default=False,
+                            help="When True, don't sync the TestCases of test methods whose status, iterations, "
+                                 "params and requirement are the same as in the last export of the suite. "
+                                 "TestRecords are still created for all of them")
+    duplicate_action = add_field("--duplicate-action", choices=["update", "skip", "force"],
+                                 help="What to do when the exact same results were already exported: update the "
+                                      "TestRuns created back then (the default), skip the export, or force a new "
+                                      "export")
+    config_report = add_field("--config-report", default=False,
+                              help="When True, log how long each configuration stage took and which values it set")
+    testrecord_comment_limit = add_field("--testrecord-comment-limit",
+                                         help="Max characters of a TestRecord comment.  Repeated exceptions are "
+                                              "only written once, and iterations past the limit are only counted "
+                                              "(default is 65536)")
+    pooled_transport = add_field("--pooled-transport", default=True,
+                                 help="When True, the SOAP calls to Polarion reuse a pool of keep-alive connections "
+                                      "(one per worker) instead of opening a new connection for every call")
+    wsdl_cache_days = add_field("--wsdl-cache-days",
+                                help="Days to keep the parsed Polarion WSDLs in ~/.pong/wsdl (default is 7).  "
+                                     "Use 0 to always download them")
+    session_cache_ttl = add_field("--session-cache-ttl",
+                                  help="Seconds a Polarion session id is remembered in ~/.pong/sessions.json and "
+                                       "reused instead of logging in (default is 600).  Use 0 to always log in")
+    query_page_size = add_field("--query-page-size", default=500,
+                                help="The testcases_query and requirements_query results are fetched this many "
+                                     "WorkItems at a time, while the results file is parsed.  Use 0 to fetch each "
+                                     "query in one go")
+    targeted_query = add_field("--targeted-query", default=False,
+                               help="When True, ignore testcases_query and only query for the titles of the tests "
+                                    "in the results file (in parallel chunks)")
+    write_workers = add_field("--write-workers", default=1,
+                              help="The most Polarion writes (TestCases, TestRecords, TestRun updates) to run at the "
+                                   "same time.  The actual number adapts between 1 and this to how well Polarion "
+                                   "keeps up")
+    write_rate = add_field("--write-rate",
+                           help="The most Polarion writes per second for the project (in the yaml config, this can "
+                                "also be a map of project id to rate)")
+    mirror = add_field("--mirror", default=False,
+                       help="When True, keep a local mirror of the project's TestCases and Requirements in ~/.pong, "
+                            "fetch only what changed since the last export, and answer testcases_query, "
+                            "requirements_query and --query-testcase from it (queries using Lucene syntax beyond "
+                            "title:, type:, id:, author.id:, AND and OR still go to Polarion)")
+    mirror_full_sync_days = add_field("--mirror-full-sync-days",
+                                      help="Days between full syncs of the mirror, which also drop the WorkItems "
+                                           "that were deleted in Polarion (default is 7)")
 
     # These are "functions"
     update_run = add_field("--update-run", default=False,
@@ -483,10 +573,10 @@ class CLIConfigRecord(PRecord):
 
 
 class CLIConfigurator(Configurator):
-    def __init__(self, parser=ArgumentParser(), args="", jnk_cfg=None):
+    def __init__(self, parser=None, args="", jnk_cfg=None):
         super(CLIConfigurator, self).__init__()
         self.jnk_cfg = jnk_cfg
-        self.parser = parser
+        self.parser = parser if parser else CLIConfigRecord.factory.parser
         self.args = CLIConfigRecord.parse_args(args=args)
         self.dict_args = vars(self.args)
         self.reset_project_id = False
@@ -514,8 +604,6 @@ class CLIConfigurator(Configurator):
 
     def __call__(self, omap):
         self.original_map = omap
-        log.log(DEFAULT_LOG_LEVEL, "------------------- BEFORE: {} -----------------------".format(self.__class__))
-        dprint(omap)
 
         distro_record = self._make_distro_record()
         if self.args.distro:
@@ -545,8 +633,7 @@ class CLIConfigurator(Configurator):
         # Trim any args from self.dict_args that are None
         final_args = {k: v for k, v in self.dict_args.items() if v is not None}
         updated = omap.update(final_args)
-        log.log(DEFAULT_LOG_LEVEL, "=================== {} ====================".format(self.__class__))
-        dprint(updated)
+        self.log_stage(omap, updated)
         return updated
 
     # This doesn't belong to this class
@@ -598,6 +685,7 @@ class YAMLRecord(PRecord):
     build_url = field()
     requirement_prefix = field()
     testcase_prefix = field()
+    write_rate = field()  # writes per second, or a map of project id -> writes per second
 
 
 class YAMLConfigurator(Configurator):
@@ -618,6 +706,7 @@ class YAMLConfigurator(Configurator):
             self.cfg_path = cfg_path
 
         if self.cfg_path is not None:
+            import yaml
             with open(self.cfg_path, "r") as cfg:
                 cfg_dict = yaml.load(cfg)
 
@@ -652,8 +741,7 @@ class YAMLConfigurator(Configurator):
         """
         self.original_map = omap
         updated = omap.update(self.record)
-        log.log(DEFAULT_LOG_LEVEL, "=================== {} ====================".format(self.__class__))
-        dprint(updated)
+        self.log_stage(omap, updated)
         return updated
 
 
@@ -667,8 +755,7 @@ class PylarionConfigurator(Configurator):
         super(PylarionConfigurator, self).__init__()
         self.path = path
 
-        cfg = ConfigParser.ConfigParser()
-        cfg.read(self.path)
+        cfg = read_config(self.path)
         get = partial(cfg.get, "webservice")
         # pyl = {k: get(k) for k in ["user", "password", "default_project"]}
         # pyl["project_id"] = pyl.pop("default_project")
@@ -679,8 +766,7 @@ class PylarionConfigurator(Configurator):
     def __call__(self, omap):
         self.original_map = omap
         updated = omap.update(self.pylarion_record)
-        log.log(DEFAULT_LOG_LEVEL, "=================== {} ====================".format(self.__class__))
-        dprint(updated)
+        self.log_stage(omap, updated)
         return updated
 
     @staticmethod
@@ -770,11 +856,63 @@ def create_backup(orig, backup=None):
 
 
 def dprint(m, log_lvl=DEFAULT_LOG_LEVEL):
+    if not log.isEnabledFor(log_lvl):
+        return
     for k, v in m.items():
         kv = "{}={}".format(str(k), str(v))
         log.log(log_lvl, kv)
 
 
+def map_diff(before, after):
+    """
+    Compares two maps
+
+    :param before: a map
+    :param after: a map
+    :return: (a dict of the keys in after that are new or changed, a list of the keys removed from before)
+    """
+    changed = {k: v for k, v in after.items() if k not in before or before[k] != v}
+    removed = [k for k in before.keys() if k not in after]
+    return changed, removed
+
+
+class Pipeline(object):
+    """
+    A configuration pipeline: a sequence of Configurators, applied in the order given (unlike compose, which
+    applies the last function first).  Each stage is timed, and what it changed is kept so report() can tell
+    where a config value came from
+    """
+    def __init__(self, *stages):
+        self.stages = [stage for stage in stages if stage is not None]
+        self.timings = []
+
+    def __call__(self, config_map):
+        self.timings = []
+        for stage in self.stages:
+            start = time.time()
+            updated = stage(config_map)
+            self.timings.append((stage, time.time() - start, config_map, updated))
+            config_map = updated
+        return config_map
+
+    def report(self):
+        """
+        Renders the time each stage took and the keys it set, changed or removed
+
+        :return: str
+        """
+        lines = []
+        for stage, elapsed, before, after in self.timings:
+            lines.append("{}: {:.4f}s".format(stage.__class__.__name__, elapsed))
+            changed, removed = map_diff(before, after)
+            for k in sorted(changed):
+                action = "changed" if k in before else "set"
+                lines.append("    {} {}={}".format(action, k, changed[k]))
+            for k in sorted(removed):
+                lines.append("    removed {}".format(k))
+        return "\n".join(lines)
+
+
 def kickstart(yaml_path=None, args=None):
     """
     Kicks everything off by creating the configuration function pipeline
@@ -785,12 +923,13 @@ def kickstart(yaml_path=None, args=None):
     # default location of pylarion_path or exporter_config, which are needed by PylarionConfigurator
     # and YAMLConfigurator)
 
-    cli_cfg = CLIConfigurator()
+    # The args are only parsed once: the paths are read straight from them rather than by running cli_cfg on
+    # its own first
+    cli_cfg = CLIConfigurator(args=args)
     start_map = pyr.m()
-    init_map = cli_cfg(start_map)
-    pyl_path = init_map.get("pylarion_path")
-    yaml_path = init_map.get("exporter_config")
-    env_path = init_map.get("environment_file")
+    pyl_path = cli_cfg.args.pylarion_path
+    yaml_path = cli_cfg.args.exporter_config
+    env_path = cli_cfg.args.environment_file
 
     pyl_cfg = PylarionConfigurator(path=pyl_path)
     env_cfg = OSEnvironmentConfigurator()
@@ -798,12 +937,8 @@ def kickstart(yaml_path=None, args=None):
     jnk_cfg = None
     if env_path:
         jnk_cfg = JenkinsConfigurator(env_path)
-    cli_cfg = CLIConfigurator(args=args)
 
-    if env_path:
-        pipeline = compose(cli_cfg, jnk_cfg, yml_cfg, env_cfg, pyl_cfg)
-    else:
-        pipeline = compose(cli_cfg, yml_cfg, env_cfg, pyl_cfg)
+    pipeline = Pipeline(pyl_cfg, env_cfg, yml_cfg, jnk_cfg, cli_cfg)
     end_map = pipeline(start_map)
 
     log.log(DEFAULT_LOG_LEVEL, "================ end_map ===================")
@@ -822,11 +957,14 @@ def kickstart(yaml_path=None, args=None):
     log.log(logging.INFO, "================= final ====================")
     dprint(final, log_lvl=logging.INFO)
     log.log(logging.INFO, "============================================\n")
+    if as_bool(final.get("config_report")):
+        log.info("Configuration pipeline report:\n" + pipeline.report())
 
     result = {"pyl_cfg": pyl_cfg,
               "env_cfg": env_cfg,
               "yml_cfg": yml_cfg,
               "cli_cfg": cli_cfg,
+              "pipeline": pipeline,
               "config": final}
     return result
 
@@ -2,7 +2,9 @@ from pong.utils import *
 
 from pong.logger import log
 import datetime
+import hashlib
 from pong.decorators import profile
+from pong.throttle import throttled
 
 
 class TestIterationResult(object):
@@ -18,6 +20,121 @@ class TestIterationResult(object):
         self.args = {"Arg{}".format(i): v for i, v in enumerate(self.params)}
 
 
+def to_unicode(val):
+    if isinstance(val, unicode):
+        return val
+    return unicode(str(val), encoding="utf-8", errors="replace")
+
+
+# About 64KB of comment is already far more than anyone reads in the Polarion UI
+DEFAULT_COMMENT_LIMIT = 65536
+# At most this much of the limit is kept for the summary at the end of a truncated comment
+SUMMARY_SIZE = 2048
+
+
+def cut_html(text, size):
+    """
+    :return: at most size characters of text, without cutting a tag (eg <br>) in half
+    """
+    text = text[:size]
+    start = text.rfind(u"<")
+    if start != -1 and text.find(u">", start) == -1:
+        text = text[:start]
+    return text
+
+
+class CommentBuilder(object):
+    """
+    Builds the html comment of a TestRecord from its iterations.
+
+    A data-provider test can have thousands of iterations failing with the same exception, so the message and
+    stack trace of an exception are only written the first time they are seen.  Later iterations refer back to
+    it, and the comment ends with how often each exception happened.  Once the comment reaches its size limit,
+    the remaining iterations are only counted.  The whole comment, summary included, stays within limit
+    characters, and only hashes of the exceptions are kept in memory
+    """
+    def __init__(self, limit=None):
+        self.limit = DEFAULT_COMMENT_LIMIT if limit is None else int(limit)
+        self.body_limit = self.limit - min(SUMMARY_SIZE, self.limit // 2)
+        self._parts = []
+        self._size = 0
+        self._exceptions = {}  # sha1 of (message, stack_trace) -> [first iteration, count, fully shown]
+        self.truncated = 0
+        self.statuses = {}
+
+    def _append(self, text):
+        """
+        :return: True if all of text made it into the comment
+        """
+        if self.truncated:
+            self.truncated += 1
+            return False
+        if self._size + len(text) > self.body_limit:
+            # cut the iteration that crosses the limit, so that a single huge stack trace still shows something
+            text = cut_html(text, self.body_limit - self._size)
+            self._parts.append(text)
+            self._size += len(text)
+            self.truncated = 1
+            return False
+        self._parts.append(text)
+        self._size += len(text)
+        return True
+
+    def add(self, i, step):
+        """
+        Adds the status (and exception) of iteration i
+
+        :param i: the iteration number
+        :param step: a TestIterationResult
+        """
+        self.statuses[step.status] = self.statuses.get(step.status, 0) + 1
+        text = u"{} {}\t".format(i, step.status)
+        first = None
+        if step.exception:
+            message = to_unicode(step.exception.get("message", ""))
+            stack_trace = to_unicode(step.exception.get("stack_trace", ""))
+            digest = hashlib.sha1(u"{}\0{}".format(message, stack_trace).encode("utf-8")).digest()
+            seen = self._exceptions.get(digest)
+            if seen is None:
+                self._exceptions[digest] = seen = first = [i, 0, False]
+                text += u"<br>" + message + u"<br>" + stack_trace + u"<br>"
+            else:
+                text += u"<br>same exception as iteration {}<br>".format(seen[0])
+            seen[1] += 1
+        if self._parts:
+            text = u"<br>" + text
+        shown = self._append(text)
+        if first is not None:
+            first[2] = shown
+
+    def build(self):
+        """
+        :return: the comment as unicode
+        """
+        parts = list(self._parts)
+        size = self._size
+        if self.truncated:
+            counts = ", ".join("{}: {}".format(k, v) for k, v in sorted(self.statuses.items()))
+            note = u"<br>... {} iterations not (fully) shown (all iterations: {})".format(self.truncated, counts)
+            note = cut_html(note, self.limit - size)
+            parts.append(note)
+            size += len(note)
+
+        # Only the exceptions whose text is in the comment are summed up
+        repeated = sorted(v[:2] for v in self._exceptions.values() if v[1] > 1 and v[2])
+        for n, (first, count) in enumerate(repeated):
+            line = u"<br>The exception of iteration {} happened {} times".format(first, count)
+            rest = u"<br>... and {} more exceptions happened more than once".format(len(repeated) - n)
+            last = n == len(repeated) - 1
+            if size + len(line) + (0 if last else len(rest)) > self.limit:
+                if size + len(rest) <= self.limit:
+                    parts.append(rest)
+                break
+            parts.append(line)
+            size += len(line)
+        return u"".join(parts)
+
+
 # An array of TestNGToPolarion objects will be the container that represents Polarion "test iterations"
 # The index in the array will be the test iteration number, and this object will know the parameterized
 # fields (self.params).  The TestIterationResult object (self.step_result) will contain the values of the
@@ -51,10 +168,16 @@ class TestNGToPolarion(object):
         self.data_provider = "data-provider" in attrs
         self.params = [] if params is None else params
         self.args = self.args = {"Arg{}".format(i):v for i,v in enumerate(self.params)}
-        self.step_results = [result] if result is not None else []
-        self._status = None
+        self.step_results = []
+        self._failed_steps = 0
+        self._first_started = None
+        self._last_started = None
+        self._last_duration = 0.0
+        if result is not None:
+            self.add_result(result)
         self.project = get_default_project() if project is None else project
         self._author = None
+        self.step_count = None  # the number of TestSteps of the Polarion TestCase, once create_polarion_tc ran
         self.requirement = requirement  # PylRequirement(project_id=self.project, work_item_id=requirement)
         self.testng_test = testng_test
 
@@ -67,6 +190,24 @@ class TestNGToPolarion(object):
                 raw = attrs["description"].encode("utf-8")
                 self.description = unicode(raw, encoding="utf-8", errors="replace")
 
+    def add_result(self, result):
+        """
+        Adds the result of an iteration.  The status and timing of the TestRecord are worked out here as the
+        iterations come in, so that reading them later is cheap
+
+        :param result: a TestIterationResult (None is ignored)
+        """
+        if result is None:
+            return
+        self.step_results.append(result)
+        if result.status != "PASS" and result.status != "SKIP":
+            self._failed_steps += 1
+        started = parse_timestamp(result.started)
+        if self._first_started is None:
+            self._first_started = started
+        self._last_started = started
+        self._last_duration = float(result.duration)
+
     @property
     def status(self):
         """
@@ -74,15 +215,7 @@ class TestNGToPolarion(object):
 
         :return:
         """
-        if self._status is None:
-            result = self.attributes["status"]
-            log.debug("Checking step_results of {}: {}".format(self.title, self.step_results))
-            no_nones = filter(lambda x: x is not None, self.step_results)
-            self.step_results = no_nones
-            if any(filter(lambda ti: ti.status != "PASS" and ti.status != "SKIP", self.step_results)):
-                result = FAIL
-            self._status = result
-        return self._status
+        return FAIL if self._failed_steps else self.attributes["status"]
 
     @status.setter
     def status(self, val):
@@ -91,9 +224,7 @@ class TestNGToPolarion(object):
     @property
     def author(self):
         if self._author is None:
-            config = ConfigParser.ConfigParser()
-            config.read(PYLARION_CONFIG)
-            self._author = config.get("webservice", "user")
+            self._author = read_config(PYLARION_CONFIG).get("webservice", "user")
         return self._author
 
     @author.setter
@@ -119,56 +250,51 @@ class TestNGToPolarion(object):
         steps = PylTestSteps()
         steps.keys = ["args", "expectedResult"]
 
-    def create_test_record(self, test_run, run_by="stoner"):
+    def create_test_record(self, test_run, run_by="stoner", comment_limit=None, throttle=None):
         """
         Adds a TestRecord to a TestRun and associates it with the TestCase
 
         :param test_run: a pylarion TestRun object
         :param run_by: (str) identifies who executed the test
+        :param comment_limit: max characters of the TestRecord comment (None for DEFAULT_COMMENT_LIMIT)
+        :param throttle: the WriteThrottle of the export, if any
         """
         tc_id = self.polarion_tc.work_item_id
         result = self.status
         executed_by = run_by
 
-        def comment_string(i, s):
-            base = "{} {}\t".format(i, s.status)
-            if s.exception:
-                exc_info = s.exception.get("message", "") + "<br>" + \
-                           s.exception.get("stack_trace", "") + "<br>"
-                base += "<br>" + exc_info
-            return base
-
-        comment = "<br>".join(comment_string(i, step) for i,step in enumerate(self.step_results))
-
-        # Get the first step for our start time, and the last for our finish
-        formatter = "%Y-%m-%dT%H:%M:%SZ"
-        strptime = datetime.datetime.strptime
-
-        if self.step_results:
-            last_step = itz.last(self.step_results)
-            dt_start = strptime(self.step_results[0].started, formatter)
-            dt_finish = strptime(last_step.started, formatter)
-            time_delta = dt_finish - dt_start
-            duration = time_delta.seconds + float(last_step.duration)
-        else:
-            duration = float(self.attributes["duration-ms"])
-            dt_start = strptime(self.attributes["started-at"], formatter)
+        dt_start, duration = self.timing()
 
         result = convert_status(result)
         if result == "waiting":
             log.info("Skipping TestRecord for {} due to status of SKIP".format(tc_id))
             return
 
-        comment = unicode(comment, encoding='utf-8')
+        builder = CommentBuilder(limit=comment_limit)
+        for i, step in enumerate(self.step_results):
+            builder.add(i, step)
+        comment = builder.build()
         kwds = {"test_comment": comment, "test_case_id": tc_id, "test_result": result,
                 "executed": dt_start, "duration": duration, "executed_by": executed_by}
 
         log.info("Creating TestRecord for {}".format(self.title))
-        self.add_test_record(test_run, **kwds)
+        self.add_test_record(test_run, throttle=throttle, **kwds)
+
+    def timing(self):
+        """
+        The start of the first iteration, and the time from there to the end of the last iteration
+
+        :return: (datetime, float seconds)
+        """
+        if self.step_results:
+            time_delta = self._last_started - self._first_started
+            return self._first_started, time_delta.seconds + self._last_duration
+        return parse_timestamp(self.attributes["started-at"]), float(self.attributes["duration-ms"])
 
     @profile
-    def add_test_record(self, test_run, **kwargs):
-        test_run.add_test_record_by_fields(**kwargs)
+    def add_test_record(self, test_run, throttle=None, **kwargs):
+        with throttled(throttle, test_run=True):
+            test_run.add_test_record_by_fields(**kwargs)
 
     @profile
     def add_test_record_obj(self, test_run, test_record):
@@ -183,10 +309,11 @@ class TestNGToPolarion(object):
             if not current:  # set to default
                 setattr(tc, key, val)
 
-    def link_requirements(self, tc_obj):
+    def link_requirements(self, tc_obj, throttle=None):
         """
 
         :param tc_obj:
+        :param throttle: the WriteThrottle of the export, if any
         :return:
         """
         linked_items = tc_obj.linked_work_items
@@ -197,20 +324,24 @@ class TestNGToPolarion(object):
             num_duplicates = len(duplicates)
             if num_duplicates == 0:
                 log.info("Linking requirement {} to TestCase {}".format(self.requirement, tc_obj.work_item_id))
-                tc_obj.add_linked_item(self.requirement, "verifies")
+                with throttled(throttle):
+                    tc_obj.add_linked_item(self.requirement, "verifies")
             elif num_duplicates > 1:
                 msg = "Found duplicate linked Requirements {} for TestCase {}.  Cleaning...."
                 log.warning(msg.format(itz.first(duplicates), tc_obj.work_item_id))
                 for _ in range(len(duplicates) - 1):
-                    tc_obj.remove_linked_item(self.requirement, "verifies")
+                    with throttled(throttle):
+                        tc_obj.remove_linked_item(self.requirement, "verifies")
             else:
                 msg = "Requirement {} already linked to TestCase {}"
                 log.info(msg.format(itz.first(duplicates), tc_obj.work_item_id))
 
     @profile
-    def create_polarion_tc(self):
+    def create_polarion_tc(self, throttle=None):
         """
         Given the pong.TestCase, convert it to the equivalent pylarion.work_item.TestCase
+
+        :param throttle: the WriteThrottle of the export, if any.  Only the writes wait for it, not the reads
         """
         t = lambda x: unicode.encode(x, encoding="utf-8", errors="ignore") if isinstance(x, unicode) else x
         desc, title = [t(x) for x in [self.description, self.title]]
@@ -235,10 +366,16 @@ class TestNGToPolarion(object):
             # If this TestCase has more than 1 TestStep, it's the older workaround where a TestStep was a row
             # of data in the 2d array.  Moving to the SR2 2015 release with parameterized testing instead
             if len(steps) > 1:
-                tc.set_test_steps()  # Empty the TestSteps
-            if len(steps) == 0:
+                with throttled(throttle):
+                    tc.set_test_steps()  # Empty the TestSteps
+                self.step_count = 0
+            elif len(steps) == 0:
                 step = self.make_polarion_test_step()
-                tc.set_test_steps([step])
+                with throttled(throttle):
+                    tc.set_test_steps([step])
+                self.step_count = 1
+            else:
+                self.step_count = 1
         else:
             log.info("Generating new TestCase for {} : {}".format(title, desc))
             WORKAROUND_949 = False
@@ -256,20 +393,25 @@ class TestNGToPolarion(object):
                 self.description = unicode("", encoding="utf-8")
 
             from pylarion.work_item import TestCase as PylTestCase
-            tc = PylTestCase.create(self.project, self.title, self.description, **TC_KEYS)
+            with throttled(throttle):
+                tc = PylTestCase.create(self.project, self.title, self.description, **TC_KEYS)
 
             # Create PylTestSteps if needed and add it
+            self.step_count = 0
             if self.step_results:
                 step = self.make_polarion_test_step()
-                tc.set_test_steps([step])
+                with throttled(throttle):
+                    tc.set_test_steps([step])
+                self.step_count = 1
 
             if not tc:
                 raise Exception("Could not create TestCase for {}".format(self.title))
             else:
                 self.polarion_tc = tc
 
-        self.link_requirements(tc)
-        self.polarion_tc.update()
+        self.link_requirements(tc, throttle=throttle)
+        with throttled(throttle):
+            self.polarion_tc.update()
         return tc
 
     def make_polarion_test_step(self):
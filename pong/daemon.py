@@ -0,0 +1,391 @@
+"""
+A long running exporter that takes export jobs over a unix socket
+
+Every run of ``python -m pong.exporter`` imports pylarion, downloads the WSDLs, logs in, queries for the
+TestCases and builds its indexes before it can export anything.  The daemon keeps some of that warm for every
+job: the pylarion session and its pooled connections (see transport.py and session.py), the TestRun template
+and fingerprint caches (see cache.py and fingerprint.py) and, with --mirror, the project's mirror and its Lucene
+index (see mirror.py).  Without --mirror, every job runs its testcases_query again and builds a new TitleIndex,
+since others may have added or edited TestCases in the meantime.  For the same reason, the WorkItem identity map
+is cleared between jobs.
+
+pylarion has one session per process, which is opened with the .pylarion of the first job, and keeps the
+default_project it was opened with.  Jobs for another .pylarion, server, user or project are rejected (see
+check_session), and the .pylarion file is put back the way it was after every job, since an export may change its
+default_project.
+
+    python -m pong.daemon serve
+    python -m pong.daemon submit -- -r testng-results.xml -p RedHatEnterpriseLinux7 ...
+    python -m pong.daemon status 3
+    python -m pong.daemon stop
+
+The args after ``--`` are the same as for pong.exporter.  The jobs are run one at a time, in the order they were
+submitted.
+
+Each connection sends one json request (one line) and gets one json response (one line):
+
+- {"cmd": "export", "args": [...], "result_path": "...", "wait": true} runs an export.  It returns the job
+  (see Job.as_dict), once it is finished, or right away with "wait": false
+- {"cmd": "status", "id": 3} returns that job, and {"cmd": "status"} returns all of them
+- {"cmd": "stop"} stops the daemon once the current job is done
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from pong.cache import CACHE_DIR, WORK_ITEMS
+from pong.logger import log
+
+DEFAULT_SOCKET = os.path.join(CACHE_DIR, "exporter.sock")
+MAX_JOBS_KEPT = 100
+
+
+class SessionMismatch(Exception):
+    pass
+
+
+# What the pylarion session of this process was opened with (see check_session)
+_session = {}
+
+
+def session_key(config):
+    """
+    :param config: the ConfigRecord of a job
+    :return: (pylarion_path, server url, user, project id) of the pylarion session the job needs
+    """
+    from pong.configuration import PylarionConfigurator
+
+    path = os.path.abspath(os.path.expanduser(config.pylarion_path or "~/.pylarion"))
+    try:
+        url = PylarionConfigurator.create_cfg_parser(path).get("webservice", "url")
+    except Exception:
+        url = None
+    return path, url, config.get("pylarion_user"), config.get("project_id")
+
+
+def check_session(config, session=_session):
+    """
+    The first job decides what the session is opened with.  Later jobs would silently go on using that session,
+    so a job for another .pylarion, server, user or project raises SessionMismatch instead.  The project counts
+    too, since pylarion only reads the default_project of the .pylarion when the session is opened
+
+    :param config: the ConfigRecord of a job
+    :param session: where the key of the open session is kept
+    :return: the session_key of the job
+    """
+    key = session_key(config)
+    warm = session.setdefault("key", key)
+    if key != warm:
+        msg = "This daemon's pylarion session is for {3} on {1} as {2} (from {0}), not {7} on {5} as {6} (from " \
+              "{4}).  Run the export with pong.exporter, or start a daemon for it"
+        raise SessionMismatch(msg.format(*(warm + key)))
+    return key
+
+
+@contextmanager
+def restored(path):
+    """
+    Puts the file at path back the way it was once the block is done, whether it failed or not
+    """
+    with open(path, "rb") as orig:
+        original = orig.read()
+    try:
+        yield
+    finally:
+        with open(path, "rb") as current:
+            changed = current.read() != original
+        if changed:
+            log.info("Restoring {}".format(path))
+            with open(path, "wb") as restore:
+                restore.write(original)
+
+
+def run_export(args):
+    """
+    Runs one export, like ``python -m pong.exporter <args>``
+
+    :return: the Exporter
+    """
+    from pong.configuration import kickstart
+    from pong.exporter import Exporter
+
+    result = kickstart(args=args)
+    pylarion_path = check_session(result["config"])[0]
+    # The export changes the default_project of the .pylarion when it is given another project
+    with restored(pylarion_path):
+        return Exporter.export(result)
+
+
+def native_str(val):
+    # json gives unicode on python 2, where the exporter's argparse and config expect str
+    return val if isinstance(val, str) else val.encode("utf-8")
+
+
+def warm_up():
+    """
+    Imports everything an export needs (most of all pylarion) before the first job comes in
+    """
+    try:
+        import pong.exporter
+        import pong.parsing
+    except ImportError as ex:
+        log.warning("Could not import the exporter ahead of the first job: {}".format(ex))
+
+
+class Job(object):
+    def __init__(self, job_id, args):
+        self.id = job_id
+        self.args = args
+        self.status = "queued"
+        self.test_runs = {}
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    def as_dict(self):
+        """
+        :return: dict with the id, args, status ("queued", "running", "done" or "failed"), test_runs (suite name ->
+                 the id of the TestRun that was created), error and the times it was submitted, started and finished
+        """
+        return {"id": self.id, "args": self.args, "status": self.status, "test_runs": self.test_runs,
+                "error": self.error, "submitted": self.submitted, "started": self.started,
+                "finished": self.finished}
+
+
+class JobRunner(object):
+    """
+    Runs the submitted Jobs one at a time in a background thread.  pong keeps per export state in module globals
+    and files (the WorkItem identity map, the project id in .pylarion...), so exports can't overlap
+    """
+    def __init__(self, export=run_export, keep=MAX_JOBS_KEPT):
+        """
+        :param export: function (args) -> Exporter
+        :param keep: how many finished Jobs to remember
+        """
+        self.export = export
+        self.keep = keep
+        self.jobs = OrderedDict()
+        self._ids = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._work, name="ExportJobs")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, args):
+        with self._lock:
+            self._ids += 1
+            job = Job(self._ids, args)
+            self.jobs[job.id] = job
+        log.info("Queued export job {}: {}".format(job.id, " ".join(args)))
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def all(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def stop(self, wait=True):
+        """
+        Stops the runner after the Jobs that were already submitted
+        """
+        self._queue.put(None)
+        if wait:
+            self._thread.join()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            self.run(job)
+
+    def run(self, job):
+        # The TestCases and TestRuns may have been edited since the last job, so they have to be fetched again
+        WORK_ITEMS.clear()
+        job.status = "running"
+        job.started = time.time()
+        log.info("Starting export job {}".format(job.id))
+        try:
+            suite = self.export(job.args)
+            job.test_runs = dict(getattr(suite, "created_runs", None) or {})
+            job.status = "done"
+        except SystemExit as ex:
+            # kickstart and argparse exit on bad configurations, and the query only actions exit when done
+            if ex.code in (None, 0):
+                job.status = "done"
+            else:
+                job.status = "failed"
+                job.error = "exited with {}".format(ex.code)
+        except Exception as ex:
+            log.exception("Export job {} failed".format(job.id))
+            job.status = "failed"
+            job.error = "{}: {}".format(ex.__class__.__name__, ex)
+        finally:
+            job.finished = time.time()
+            log.info("Export job {} {} in {:.1f}s {}".format(job.id, job.status, job.finished - job.started,
+                                                              job.test_runs or job.error or ""))
+            job.done.set()
+            self._forget_old()
+
+    def _forget_old(self):
+        with self._lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job.done.is_set()]
+            for job_id in finished[:max(0, len(finished) - self.keep)]:
+                del self.jobs[job_id]
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            response = self.server.daemon.handle(json.loads(line))
+        except ValueError as ex:
+            response = {"error": "Not a json request: {}".format(ex)}
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Daemon(object):
+    def __init__(self, socket_path=DEFAULT_SOCKET, export=run_export):
+        self.socket_path = socket_path
+        self.runner = JobRunner(export=export)
+        self.server = None
+
+    def handle(self, request):
+        """
+        :param request: a request dict (see the module docstring)
+        :return: the response dict
+        """
+        cmd = request.get("cmd")
+        if cmd == "export":
+            args = [native_str(arg) for arg in request.get("args") or []]
+            if request.get("result_path"):
+                args += ["-r", native_str(request["result_path"])]
+            job = self.runner.submit(args)
+            if request.get("wait", True):
+                job.done.wait()
+            return job.as_dict()
+        if cmd == "status":
+            if request.get("id") is None:
+                return {"jobs": [job.as_dict() for job in self.runner.all()], "pid": os.getpid()}
+            job = self.runner.get(request["id"])
+            return job.as_dict() if job else {"error": "No job {}".format(request["id"])}
+        if cmd == "stop":
+            if self.server is not None:
+                threading.Thread(target=self.server.shutdown).start()
+            return {"status": "stopping"}
+        return {"error": "Unknown cmd {}".format(cmd)}
+
+    def bind(self):
+        if os.path.exists(self.socket_path):
+            try:
+                request({"cmd": "status"}, socket_path=self.socket_path)
+            except socket.error:
+                os.remove(self.socket_path)  # left over from a daemon that didn't stop cleanly
+            else:
+                raise Exception("A daemon is already listening on {}".format(self.socket_path))
+        directory = os.path.dirname(self.socket_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, 0o700)
+        self.server = UnixServer(self.socket_path, RequestHandler)
+        self.server.daemon = self
+        # Anyone who can connect can export with our Polarion credentials
+        os.chmod(self.socket_path, 0o600)
+
+    def serve_forever(self):
+        if self.server is None:
+            self.bind()
+        log.info("Exporter daemon listening on {}".format(self.socket_path))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.runner.stop()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            log.info("Exporter daemon stopped")
+
+
+def request(req, socket_path=DEFAULT_SOCKET):
+    """
+    Sends one request to the daemon
+
+    :param req: a request dict (see the module docstring)
+    :return: the response dict
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(req) + "\n").encode("utf-8"))
+        return json.loads(sock.makefile("rb").readline())
+    finally:
+        sock.close()
+
+
+def submit(args, result_path=None, wait=True, socket_path=DEFAULT_SOCKET):
+    """
+    :param args: the pong.exporter args
+    :return: the job dict
+    """
+    return request({"cmd": "export", "args": args, "result_path": result_path, "wait": wait},
+                   socket_path=socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--socket", default=DEFAULT_SOCKET)
+    commands = parser.add_subparsers(dest="cmd")
+    commands.add_parser("serve", help="run the daemon")
+    export = commands.add_parser("submit", help="run an export (pong.exporter args after --)")
+    export.add_argument("-n", "--no-wait", action="store_true", help="return once the job is queued")
+    export.add_argument("args", nargs=argparse.REMAINDER)
+    status = commands.add_parser("status", help="show one job, or all of them")
+    status.add_argument("id", nargs="?", type=int)
+    commands.add_parser("stop", help="stop the daemon once the current job is done")
+    opts = parser.parse_args()
+
+    if opts.cmd == "serve":
+        warm_up()
+        Daemon(socket_path=opts.socket).serve_forever()
+        return
+    if opts.cmd == "submit":
+        args = opts.args[1:] if opts.args[:1] == ["--"] else opts.args
+        response = submit(args, wait=not opts.no_wait, socket_path=opts.socket)
+    elif opts.cmd == "status":
+        response = request({"cmd": "status", "id": opts.id}, socket_path=opts.socket)
+    else:
+        response = request({"cmd": "stop"}, socket_path=opts.socket)
+    print(json.dumps(response, indent=2, sort_keys=True))
+    if response.get("error") or response.get("status") == "failed":
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
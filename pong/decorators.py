@@ -47,6 +47,28 @@ def profile(fn):
     return inner
 
 
+# Functions called with (fn, exception) every time a @retry function fails (eg to back off, see throttle.py)
+RETRY_LISTENERS = []
+
+
+def add_retry_listener(listener):
+    if listener not in RETRY_LISTENERS:
+        RETRY_LISTENERS.append(listener)
+
+
+def remove_retry_listener(listener):
+    if listener in RETRY_LISTENERS:
+        RETRY_LISTENERS.remove(listener)
+
+
+def _notify_retry(fn, ex):
+    for listener in list(RETRY_LISTENERS):
+        try:
+            listener(fn, ex)
+        except Exception as lex:
+            log.warning("Retry listener {} failed: {}".format(listener, lex))
+
+
 def retry(fn):
     """
     Decorator to handle ssl timeouts
@@ -64,9 +86,11 @@ def retry(fn):
             except ssl.SSLError as se:
                 result = se
                 retries -= 1
+                _notify_retry(fn, se)
             except Exception as ex:
                 result = ex
                 retries -= 1
+                _notify_retry(fn, ex)
         if isinstance(result, Exception):
             raise result
         else:
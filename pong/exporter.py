@@ -16,14 +16,21 @@ Parses a testng-results.xml file and
 
 """
 import sys
+import threading
+from collections import namedtuple
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 from pong.logger import log
 from pong.utils import *
 from pong.decorators import retry, profile
-from pong.parsing import Transformer
-from pong.configuration import kickstart, CLIConfigurator, cli_print
-
-from pylarion.enum_option_id import EnumOptionId
+from pong.cache import TEMPLATES
+from pong.fingerprint import FINGERPRINTS, EXPORTS
+from pong.throttle import WriteThrottle, throttled
+from pong.mirror import get_mirror, TESTCASE
 
 POLARION_925 = True
 OLD_EXPORTER = 0
@@ -34,6 +41,10 @@ def print_tr(obj, fld):
     print fld, "=", getattr(obj, fld)
 
 
+# The parts of a TestRun template that create_test_run needs
+TemplateInfo = namedtuple("TemplateInfo", ["uri", "plannedin", "assignee"])
+
+
 class PlannedinException(Exception):
     pass
 
@@ -42,45 +53,321 @@ class AssigneeException(Exception):
     pass
 
 
+class RecordSubmitter(threading.Thread):
+    """
+    A background thread that adds TestRecords to a TestRun as TestNGToPolarion objects are submitted to it.
+
+    Errors don't stop the thread (so the producer never blocks on a dead queue), but once there was one,
+    submit() raises it so that the producer stops, and close() raises it again
+    """
+    _DONE = object()
+
+    def __init__(self, test_run, runner, maxsize=0, comment_limit=None, throttle=None):
+        super(RecordSubmitter, self).__init__(name="RecordSubmitter")
+        self.daemon = True
+        self.test_run = test_run
+        self.runner = runner
+        self.comment_limit = comment_limit
+        self.throttle = throttle
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.errors = []
+
+    def submit(self, testng):
+        if self.errors:
+            raise self.errors[0]
+        self.queue.put(testng)
+
+    def run(self):
+        while True:
+            testng = self.queue.get()
+            if testng is self._DONE:
+                break
+            try:
+                testng.create_test_record(self.test_run, run_by=self.runner, comment_limit=self.comment_limit,
+                                          throttle=self.throttle)
+            except Exception as ex:
+                log.error("Could not create TestRecord for {}: {}".format(testng.title, ex))
+                self.errors.append(ex)
+
+    def close(self, raise_errors=True):
+        """
+        Waits for all the submitted TestRecords to be added
+
+        :param raise_errors: if False, the errors are only logged (eg when another error is already propagating)
+        """
+        if self.is_alive():
+            self.queue.put(self._DONE)
+            self.join()
+        if raise_errors and self.errors:
+            raise self.errors[0]
+
+
+def write_rate(rate, project_id):
+    """
+    :param rate: the write_rate config: writes per second, or (from the yaml config) a map of project -> rate
+    :param project_id: the project being exported to
+    :return: float or None
+    """
+    if isinstance(rate, dict):
+        rate = rate.get(project_id)
+    return None if rate in (None, "") else float(rate)
+
+
+def write_throttle(config, project_id):
+    """
+    The WriteThrottle of an export.  Up to testrun_workers suites are exported at the same time, each syncing
+    up to write_workers TestCases at a time, and adding its TestRecords from one thread
+
+    :param config: the ConfigRecord
+    :param project_id: the project being exported to
+    :return: WriteThrottle
+    """
+    testrun_workers = max(1, int(config.get("testrun_workers") or 1))
+    write_workers = max(1, int(config.get("write_workers") or 1))
+    return WriteThrottle(project_id, test_case_workers=max(testrun_workers, write_workers),
+                         test_run_workers=testrun_workers, rate=write_rate(config.get("write_rate"), project_id))
+
+
+def connection_pool_size(config):
+    """
+    How many threads may talk to Polarion at the same time: the preload queries (each with the thread that
+    prefetches its pages), and for each concurrently exported suite its TestCase write workers and its
+    RecordSubmitter, plus the main thread.  Connections are only opened when needed, so a pool that is a bit too
+    big costs nothing, while one that is too small makes threads wait for a connection
+
+    :param config: the ConfigRecord
+    :return: int
+    """
+    testrun_workers = max(1, int(config.get("testrun_workers") or 1))
+    write_workers = max(1, int(config.get("write_workers") or 1))
+    return 2 * MAX_QUERY_WORKERS + testrun_workers * (write_workers + 1) + 1
+
+
+QUERY_ONLY_ACTIONS = ["--query-testcase", "--get-default-project-id", "--get-latest-testrun"]
+
+
+def run_query_actions(args, config=None):
+    """
+    Runs the query only actions (--query-testcase, --get-default-project-id and --get-latest-testrun)
+
+    :param args: the parsed args
+    :param config: the ConfigRecord, if the configuration pipeline was run (only needed for --mirror)
+    :return: True if any of them were given
+    """
+    if args.query_testcase:
+        if config is not None and as_bool(config.get("mirror")):
+            mirror = get_mirror(config.project_id)
+            mirror.sync(full_sync_days=config.get("mirror_full_sync_days"))
+            tests = mirror.query(TESTCASE, args.query_testcase, query_test_case)
+        else:
+            tests = query_test_case(args.query_testcase)
+        for test in tests:
+            msg = test.work_item_id + " " + test.title
+            log.info(msg)
+    if args.get_default_project_id:
+        log.info(get_default_project())
+    if args.get_latest_testrun:
+        tr = get_latest_test_run(args.get_latest_testrun)
+        for k, v in make_iterable(tr):
+            print "{}={}".format(k, v)
+    return any([args.query_testcase, args.get_default_project_id, args.get_latest_testrun])
+
+
+def query_only(argv):
+    """
+    When the command line has nothing but query only actions, they are run without the configuration pipeline
+    (so without loading pyrsistent, building the config records and reading the config files)
+
+    :param argv: the command line args
+    :return: True if argv was handled here
+    """
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(add_help=False)
+    for action in QUERY_ONLY_ACTIONS:
+        parser.add_argument(action)
+    args, rest = parser.parse_known_args(argv)
+    if rest or not any(vars(args).values()):
+        return False
+    install_session_caches({})
+    return run_query_actions(args)
+
+
+def install_session_caches(config):
+    """
+    Sets up the WSDL and login session caches (see pong.session) before pylarion starts its session
+    """
+    from pong import session
+
+    days = config.get("wsdl_cache_days")
+    session.install_wsdl_cache(days=session.DEFAULT_WSDL_CACHE_DAYS if days in (None, "") else float(days))
+    ttl = config.get("session_cache_ttl")
+    session.SESSIONS.ttl = session.DEFAULT_SESSION_TTL if ttl in (None, "") else float(ttl)
+    session.install_session_cache(session.SESSIONS)
+
+
 class Exporter(object):
     """
     A collection of TestCase objects.
     """
-    def __init__(self, transformer):
+    def __init__(self, transformer, collect=True):
         self.tests = None
         self.transformer = transformer
         self._project = transformer.project_id
-        self.collect()
+        self.created_runs = {}
+        self.throttle = write_throttle(transformer.config, transformer.project_id)
+        # TestCases created by this export, by title (see sync_test_case)
+        self._created_tcs = {}
+        self._title_locks = {}
+        self._title_locks_lock = threading.Lock()
+        if collect:
+            self.collect()
+
+    def parse(self):
+        """
+        Parses the testng-results.xml (only once) into a dict of suite name -> [TestNGToPolarion]
 
-    def collect(self):
+        :return:
+        """
+        if self.tests is None:
+            self.tests = self.transformer.parse_suite()
+        return self.tests
+
+    def export_key(self):
+        """
+        The key of the parsed result set in the ExportLedger
+
+        :return: str
         """
+        config = self.transformer.config
+        self.parse()
+        return EXPORTS.export_key(self.transformer.results_hash.hexdigest(), self.project,
+                                  config.testrun_template, config.testrun_prefix, config.testrun_suffix,
+                                  config.get("testrun_base"))
 
+    def record_run(self, suite_name, test_run_id):
+        """
+        Remembers that test_run_id was created for suite_name, so that exporting the same results again can
+        be detected
+
+        :param suite_name:
+        :param test_run_id:
         :return:
         """
-        testng_suites = self.transformer.parse_suite()
-        self.tests = testng_suites
-
-        for k, tests in testng_suites.items():
-            not_skipped = tests
-            if not self.transformer.config.test_case_skips:
-                not_skipped = filter(lambda x: x.status != SKIP, tests)
-            # TODO: It would be nice to have show which Tests got skipped due to dependency on another
-            # test that failed, or because of a BZ blocker
-            if TESTING:
-                import random
-                random.shuffle(not_skipped)
-                not_skipped = itz.take(5, not_skipped)
-
-            total = len(not_skipped) - 1
-            updated = []
-            for i, test_case in enumerate(not_skipped, start=0):
-                log.info("Getting TestCase: {} out of {}".format(i, total))
-                pyl_tc = test_case.create_polarion_tc()
-
-                test_case.polarion_tc = pyl_tc
+        self.created_runs[suite_name] = test_run_id
+        EXPORTS.add_run(self.export_key(), suite_name, test_run_id)
+
+    def not_skipped(self, tests):
+        """
+        Filters out the skipped tests, unless the test_case_skips config says to keep them
+
+        :param tests: list of TestNGToPolarion
+        :return:
+        """
+        not_skipped = tests
+        if not self.transformer.config.test_case_skips:
+            not_skipped = filter(lambda x: x.status != SKIP, tests)
+        # TODO: It would be nice to have show which Tests got skipped due to dependency on another
+        # test that failed, or because of a BZ blocker
+        if TESTING:
+            import random
+            random.shuffle(not_skipped)
+            not_skipped = itz.take(5, not_skipped)
+        return not_skipped
+
+    def sync_test_cases(self, tests, on_synced=None, suite_name=None):
+        """
+        Creates or updates the Polarion TestCase of each test
+
+        In incremental mode, the TestCase of a test that has the same fingerprint as the last time this suite
+        was exported is not synced again (its TestRecord is still created as usual)
+
+        :param tests: list of TestNGToPolarion
+        :param on_synced: optional function called with each TestNGToPolarion as soon as its TestCase is done
+        :param suite_name: the <suite name=> the tests belong to
+        :return: the list of synced TestNGToPolarion
+        """
+        incremental = as_bool(self.transformer.config.get("incremental"))
+        not_skipped = self.not_skipped(tests)
+        total = len(not_skipped) - 1
+        updated = []
+        unchanged = 0
+
+        def sync(job):
+            i, test_case = job
+            if incremental and FINGERPRINTS.unchanged(self.project, suite_name, test_case):
+                return False
+            log.info("Getting TestCase: {} out of {}".format(i, total))
+            test_case.polarion_tc = self.sync_test_case(test_case)
+            return True
+
+        # With more than one write worker, the TestCases are synced concurrently (their writes as many at a time
+        # as self.throttle allows).  The results are still handled here, in order
+        from pong import transport
+        workers = transport.thread_safe_workers(self.write_workers, "the TestCase syncs")
+        if workers > 1:
+            from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(workers) if workers > 1 and len(not_skipped) > 1 else None
+        jobs = list(enumerate(not_skipped))
+        finished = False
+        try:
+            results = pool.imap(sync, jobs) if pool is not None else (sync(job) for job in jobs)
+            mirror = self.transformer.mirror
+            for test_case, synced in zip(not_skipped, results):
+                if not synced:
+                    unchanged += 1
+                elif mirror is not None:
+                    mirror.record(TESTCASE, test_case.polarion_tc, steps=test_case.step_count)
+                FINGERPRINTS.record(self.project, suite_name, test_case)
+
                 updated.append(test_case)
+                if on_synced is not None:
+                    on_synced(test_case)
+            finished = True
+        finally:
+            if pool is not None:
+                if finished:
+                    pool.close()
+                else:
+                    pool.terminate()  # don't go on syncing the rest after an error
+                pool.join()
+        FINGERPRINTS.commit()
+        if incremental:
+            log.info("Skipped syncing {} unchanged TestCases of {}".format(unchanged, suite_name))
+        return updated
+
+    def _title_lock(self, title):
+        with self._title_locks_lock:
+            return self._title_locks.setdefault(title, threading.Lock())
+
+    def sync_test_case(self, test_case):
+        """
+        Creates or updates the Polarion TestCase of one test
+
+        Several suites can have the same test method, and they may be synced concurrently (see for_each_suite).
+        Their TestNGToPolarion objects were all matched against Polarion before any TestCase was created, so a
+        new test method would get a TestCase for every suite.  Instead, the TestCases are synced one title at a
+        time, and a TestCase that one suite created is then just updated by the others
+
+        :param test_case: TestNGToPolarion
+        :return: the pylarion TestCase
+        """
+        with self._title_lock(test_case.title):
+            if test_case.polarion_tc is None:
+                test_case.polarion_tc = self._created_tcs.get(test_case.title)
+            created = test_case.polarion_tc is None
+            tc = test_case.polarion_tc = test_case.create_polarion_tc(throttle=self.throttle)
+            if created:
+                self._created_tcs[test_case.title] = tc
+            return tc
 
-            self.tests[k] = updated
+    def collect(self):
+        """
+
+        :return:
+        """
+        for k, tests in self.parse().items():
+            self.tests[k] = self.sync_test_cases(tests, suite_name=k)
 
         for k, tests in self.tests.items():
             for tc in tests:
@@ -99,11 +386,22 @@ class Exporter(object):
 
     @retry
     def _update_tr(self, test_run):
-        test_run.update()
+        with throttled(self.throttle, test_run=True):
+            test_run.update()
 
     @retry
     def _update_tc(self, test_case):
-        test_case.update()
+        with throttled(self.throttle):
+            test_case.update()
+
+    @property
+    def write_workers(self):
+        return max(1, int(self.transformer.config.get("write_workers") or 1))
+
+    @property
+    def comment_limit(self):
+        limit = self.transformer.config.get("testrecord_comment_limit")
+        return None if limit in (None, "") else int(limit)
 
     def get_runner(self, runner):
         if runner is None:
@@ -131,7 +429,7 @@ class Exporter(object):
         from pylarion.exceptions import PylarionLibException
         tr = None
         for t in t_runs:
-            tr = TestRun(uri=t.uri)
+            tr = fetch_test_run(t.uri)
             try:
                 if tr.plannedin is not None:
                     break
@@ -142,9 +440,35 @@ class Exporter(object):
 
         return tr
 
+    def get_template_info(self, temp_id):
+        """
+        Gets the uri, plannedin and assignee of a TestRun template.  These are kept in the template cache
+        (for --template-cache-ttl seconds), so the search in get_template is only done when it has expired
+
+        :param temp_id: id of the template
+        :return: TemplateInfo
+        """
+        def as_str(val):
+            return val if val is None or isinstance(val, basestring) else str(val)
+
+        ttl = self.transformer.config.get("template_cache_ttl")
+        if ttl is not None:
+            TEMPLATES.ttl = int(ttl)
+        key = "{}:{}".format(self.project, temp_id)
+        cached = TEMPLATES.get(key)
+        if cached is not None:
+            log.info("Using cached TestRun template {}".format(temp_id))
+            return TemplateInfo(**cached)
+
+        tr = self.get_template(temp_id)
+        info = TemplateInfo(uri=tr.uri,
+                            plannedin=as_str(getattr(tr, "plannedin", None)),
+                            assignee=as_str(getattr(tr, "assignee", None)))
+        TEMPLATES.set(key, info._asdict())
+        return info
 
     @profile
-    def create_test_run(self, template_id, test_run_base=None, runner=None):
+    def create_test_run(self, template_id, test_run_base=None, runner=None, suite_names=None):
         """
         Creates a new Polarion TestRun
 
@@ -152,92 +476,224 @@ class Exporter(object):
         :param test_run_base: a str to look up most recent TestRuns (eg "Jenkins Run" if
                               the full name of TestRuns is "Jenkins Run 200"
         :param runner: str of the user id (eg stoner, not "Sean Toner")
+        :param suite_names: if given, only these suites get a TestRun
         :return: None
         """
-        from pylarion.test_run import TestRun
         runner = self.get_runner(runner)
 
-        tr_temp = self.get_template(template_id)
+        tr_temp = self.get_template_info(template_id)
         log.info(tr_temp.plannedin)
 
-        for s, testngs in self.tests.items():
-            if not testngs:
-                continue
-            if test_run_base is None:
-                base_name = self.transformer.generate_base_testrun_id(s)
-            else:
-                base_name = test_run_base
+        suites = [s for s, testngs in self.tests.items()
+                  if testngs and (suite_names is None or s in suite_names)]
+        run_ids = self.allocate_test_run_ids(suites, test_run_base=test_run_base)
 
-            # Find our latest run.  If it doesn't exist, we'll generate one
-            tr = get_latest_test_run(base_name)
-            if tr:
-                new_id = make_test_run_id_from_latest(tr)
+        def create(s):
+            test_run = self.start_test_run(template_id, tr_temp, run_ids[s])
+            self.record_run(s, run_ids[s])
+
+            for tc in self.tests[s]:
+                tc.create_test_record(test_run, run_by=runner, comment_limit=self.comment_limit,
+                                      throttle=self.throttle)
+
+            self.finish_test_run(test_run, run_ids[s])
+        self.for_each_suite(create, suites)
+
+    @profile
+    def create_test_run_pipelined(self, template_id, test_run_base=None, runner=None):
+        """
+        Like create_test_run, but the TestRun of each suite is created before its TestCases are synced, and
+        each TestRecord is submitted (by a RecordSubmitter thread) as soon as its TestCase is done.  This
+        overlaps the TestCase sync and the TestRecord creation instead of doing one after the other.
+
+        Unlike create_test_run, this does not need collect() to have been run first
+
+        :param template_id: id of the template to use for TestRun
+        :param test_run_base: see create_test_run
+        :param runner: str of the user id (eg stoner, not "Sean Toner")
+        :return: None
+        """
+        runner = self.get_runner(runner)
+
+        tr_temp = self.get_template_info(template_id)
+        log.info(tr_temp.plannedin)
+
+        suites = []
+        for s, testngs in self.parse().items():
+            if self.not_skipped(testngs):
+                suites.append(s)
             else:
-                base_name = remove_run(base_name)
-                new_id = base_name + " Run 1"
-            log.info("Creating new Test Run ID: {}".format(new_id))
-
-            plannedin = self.transformer.config.testrun_plannedin
-            assignee = self.transformer.config.testrun_assignee
-
-            retries = 3
-            while retries > 0:
-                retries -= 1
-                if not plannedin:
-                    if hasattr(tr_temp, "plannedin") and tr_temp.plannedin:
-                        plannedin = tr_temp.plannedin
-                    else:
-                        raise PlannedinException("No plannedin value in template or from config")
-                if not assignee:
-                    if hasattr(tr_temp, "assignee") and tr_temp.assignee:
-                        assignee = tr_temp.assignee
-                    else:
-                        raise AssigneeException("No assignee value in template or from config")
+                self.tests[s] = []
+        run_ids = self.allocate_test_run_ids(suites, test_run_base=test_run_base)
+
+        def create(s):
+            test_run = self.start_test_run(template_id, tr_temp, run_ids[s])
+            self.record_run(s, run_ids[s])
+
+            submitter = RecordSubmitter(test_run, runner, comment_limit=self.comment_limit, throttle=self.throttle)
+            submitter.start()
+            try:
+                self.tests[s] = self.sync_test_cases(self.tests[s], on_synced=submitter.submit, suite_name=s)
+                submitter.close()
+            except Exception:
+                # The TestRun is finished anyway, rather than left in progress.  The first error is the one that
+                # is raised (the submitter's own errors have been logged already)
+                exc_info = sys.exc_info()
+                submitter.close(raise_errors=False)
+                log.error("TestRun {} is missing TestRecords: {}".format(run_ids[s], exc_info[1]))
                 try:
-                    test_run = TestRun.create(self.project, new_id, template_id, plannedin=plannedin,
-                                              assignee=assignee)
-                    break
-                except PlannedinException as pex:
-                    log.error(pex.message)
-                    raise pex
-                except AssigneeException as aex:
-                    log.error(aex.message)
-                    raise aex
+                    self.finish_test_run(test_run, run_ids[s])
                 except Exception as ex:
-                    log.warning("Retrying {} more times".format(retries))
+                    log.error("Could not finish TestRun {}: {}".format(run_ids[s], ex))
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+            self.finish_test_run(test_run, run_ids[s])
+        self.for_each_suite(create, suites)
+
+    def allocate_test_run_ids(self, suite_names, test_run_base=None):
+        """
+        Generates the ids of the new TestRuns for the suites up front, one suite at a time in sorted order.
+        This way, suites that share a base name get consecutive run numbers no matter in what order (or how
+        concurrently) their TestRuns get created
+
+        :param suite_names: the <suite name=> of each suite that needs a TestRun
+        :param test_run_base: a str to look up most recent TestRuns (by default it is generated from the suite)
+        :return: dict of suite name -> TestRun id
+        """
+        run_ids = {}
+        for suite_name in sorted(suite_names):
+            if test_run_base is None:
+                base_name = self.transformer.generate_base_testrun_id(suite_name)
             else:
-                raise Exception("Could not create a new TestRun")
-            test_run.status = "inprogress"
+                base_name = test_run_base
 
-            test_run.variant = EnumOptionId(enum_id=self.transformer.config.distro.variant.lower())
-            test_run.jenkinsjobs = self.transformer.config.testrun_jenkinsjobs
-            test_run.notes = self.transformer.config.testrun_notes
-            test_run.arch = EnumOptionId(enum_id=self.transformer.config.distro.arch.replace("_", ""))
-            test_run.group_id = self.transformer.config.testrun_group_id
+            # Find our latest run.  If it doesn't exist, we'll generate one
+            run_ids[suite_name] = next_test_run_id(base_name, project_id=self.project)
+            log.info("Creating new Test Run ID: {}".format(run_ids[suite_name]))
+        return run_ids
 
-            for tc in testngs:
-                tc.create_test_record(test_run, run_by=runner)
+    def for_each_suite(self, fn, suite_names):
+        """
+        Calls fn on each suite name, running up to testrun_workers of them concurrently
 
-            test_run.status = "finished"
-            test_run.update()
-            log.info("Created test run for {}".format(new_id))
+        The suites share pylarion's session, and so its suds Clients.  A suds Client builds a new request for every
+        call (it only remembers the last messages, for debugging), but it shares its transport: the default urllib2
+        transport is not safe to share between threads, so the suites are only run concurrently with the
+        pooled_transport (see transport.thread_safe_workers), whose connection pool is.  Two suites creating the
+        same TestCase is prevented by sync_test_case
 
-    def update_test_run(self, test_run, runner="stoner"):
+        :param fn: function that takes a suite name
+        :param suite_names: list of suite names
+        :return: list of the results of fn
+        """
+        from pong import transport
+
+        workers = transport.thread_safe_workers(int(self.transformer.config.get("testrun_workers") or 1),
+                                                "the suites")
+        if workers <= 1 or len(suite_names) <= 1:
+            return map(fn, suite_names)
+
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(workers, len(suite_names)))
+        try:
+            return pool.map(fn, suite_names)
+        finally:
+            pool.close()
+            pool.join()
+
+    def start_test_run(self, template_id, tr_temp, new_id):
+        """
+        Creates a new TestRun and fills in its fields
+
+        :param template_id: id of the template to use for TestRun
+        :param tr_temp: the TemplateInfo of template_id
+        :param new_id: the id for the TestRun (see allocate_test_run_ids)
+        :return: pylarion TestRun
+        """
+        from pylarion.test_run import TestRun
+        from pylarion.enum_option_id import EnumOptionId
+
+        plannedin = self.transformer.config.testrun_plannedin
+        assignee = self.transformer.config.testrun_assignee
+
+        retries = 3
+        while retries > 0:
+            retries -= 1
+            if not plannedin:
+                if tr_temp.plannedin:
+                    plannedin = tr_temp.plannedin
+                else:
+                    raise PlannedinException("No plannedin value in template or from config")
+            if not assignee:
+                if tr_temp.assignee:
+                    assignee = tr_temp.assignee
+                else:
+                    raise AssigneeException("No assignee value in template or from config")
+            try:
+                test_run = TestRun.create(self.project, new_id, template_id, plannedin=plannedin,
+                                          assignee=assignee)
+                break
+            except PlannedinException as pex:
+                log.error(pex.message)
+                raise pex
+            except AssigneeException as aex:
+                log.error(aex.message)
+                raise aex
+            except Exception as ex:
+                log.warning("Retrying {} more times".format(retries))
+        else:
+            raise Exception("Could not create a new TestRun")
+        test_run.status = "inprogress"
+
+        test_run.variant = EnumOptionId(enum_id=self.transformer.config.distro.variant.lower())
+        test_run.jenkinsjobs = self.transformer.config.testrun_jenkinsjobs
+        test_run.notes = self.transformer.config.testrun_notes
+        test_run.arch = EnumOptionId(enum_id=self.transformer.config.distro.arch.replace("_", ""))
+        test_run.group_id = self.transformer.config.testrun_group_id
+        return test_run
+
+    def finish_test_run(self, test_run, new_id):
+        test_run.status = "finished"
+        self._update_tr(test_run)
+        log.info("Created test run for {}".format(new_id))
+
+    def update_previous_runs(self, template_id, previous_runs):
+        """
+        Adds the tests to the TestRuns that an earlier export of the same results created.  If that export failed
+        partway, some suites never got a TestRun, so they get a new one now
+
+        :param template_id: id of the template to use for the new TestRuns
+        :param previous_runs: dict of suite name -> TestRun id (see ExportLedger.runs)
+        :return: None
+        """
+        for s, update_id in previous_runs.items():
+            log.info("Updating test run {}".format(update_id))
+            self.update_test_run(self.get_test_run(update_id), suite_names=[s])
+        missing = sorted(s for s, testngs in self.tests.items() if testngs and s not in previous_runs)
+        if missing:
+            log.info("Creating the TestRuns the earlier export did not get to: {}".format(", ".join(missing)))
+            self.create_test_run(template_id, suite_names=missing)
+
+    def update_test_run(self, test_run, runner="stoner", suite_names=None):
         """
         Given a TestRun object, update it given the TestCases contained in self
 
         :param test_run: pylarion TestRun object
         :param runner: the user who ran the tests
+        :param suite_names: if given, only the tests of these suites are added to the TestRun
         :return: None
         """
-        for _, testngs in self.tests.items():
+        for s, testngs in self.tests.items():
+            if suite_names is not None and s not in suite_names:
+                continue
             # Check to see if the test case is already part of the test run
             for tc in testngs:
                 if tc.polarion_tc is None:
                     raise Exception("How did this happen?  {} has no TestCase".format(tc.title))
                 if check_test_case_in_test_run(test_run, tc.polarion_tc.work_item_id):
                     continue
-                tc.create_test_record(test_run, run_by=runner)
+                tc.create_test_record(test_run, run_by=runner, comment_limit=self.comment_limit,
+                                      throttle=self.throttle)
 
     @staticmethod
     def get_test_run(test_run_id):
@@ -252,7 +708,7 @@ class Exporter(object):
                             sort="created")
         tr = itz.first(tr)
         if tr:
-            tr = TestRun(uri=tr.uri)
+            tr = fetch_test_run(tr.uri)
         return tr
 
     def create_test_run_template(self, template_id, case_type="automatedProcess", query=None):
@@ -287,6 +743,8 @@ class Exporter(object):
         :param result:
         :return:
         """
+        from pong.configuration import kickstart, CLIConfigurator, cli_print
+
         if result is None:
             result = kickstart()
 
@@ -297,29 +755,23 @@ class Exporter(object):
         args = cli_cfg.args
         config = result["config"]
 
+        # This has to happen before pylarion opens its session
+        pooled = as_bool(config.get("pooled_transport", True))
+        if pooled:
+            from pong import transport
+            transport.install(maxsize=connection_pool_size(config))
+        install_session_caches(config)
+
         # Save off our original .pylarion in case the user passes in a project-id that is different
         # If the user selects --set-project-id, changes from -p are permanent
         reset_project_id = False
         using_pylarion_path = config.pylarion_path
         original_project_id = cli_cfg.original_project_id
 
-        # FIXME:  Turn these into functions and decorate them
-        if args.query_testcase:
-            tests = query_test_case(args.query_testcase)
-            for test in tests:
-                msg = test.work_item_id + " " + test.title
-                log.info(msg)
-        if args.get_default_project_id:
-            log.info(get_default_project())
         if args.set_project:
             reset_project_id = True
             CLIConfigurator.set_project_id(config.pylarion_path, config.set_project)
-        if args.get_latest_testrun:
-            tr = get_latest_test_run(args.get_latest_testrun)
-            for k, v in make_iterable(tr):
-                print "{}={}".format(k, v)
-
-        if any([args.query_testcase, args.get_default_project_id, args.get_latest_testrun]):
+        if run_query_actions(args, config):
             sys.exit(0)
 
         # Get the project_id.  If the passed in value is different, we need to edit the .pylarion file
@@ -327,20 +779,49 @@ class Exporter(object):
         if config.project_id != default_project_id:
             CLIConfigurator.set_project_id(using_pylarion_path, config.project_id)
 
+        # Only now do we need the parsing machinery (and pylarion), so that the query only actions above
+        # start up quickly
+        from pong.parsing import Transformer
+
         default_queries = [] if args.testcases_query is None else args.testcases_query
         transformer = Transformer(config)
-        suite = Exporter(transformer)
-
-        # Once the suite object has been initialized, generate a test run with associated test records
-        if not config.generate_only:
-            if config.update_run:
-                update_id = config.update_run
-                log.info("Updating test run {}".format(update_id))
-                tr = Exporter.get_test_run(update_id)
-                suite.update_test_run(tr)
-            else:
-                suite.create_test_run(config.testrun_template)
-        log.info("TestRun information completed to Polarion")
+        suite = Exporter(transformer, collect=False)
+
+        # The throttle backs off when decorators.retry sees an overloaded server
+        with suite.throttle:
+            # If these exact results were exported before, skip them or update the TestRuns created back then
+            previous_runs = {}
+            duplicate_action = config.get("duplicate_action") or "update"
+            if not config.generate_only and not config.update_run and duplicate_action != "force":
+                previous_runs = EXPORTS.runs(suite.export_key())
+                if previous_runs:
+                    log.info("These results were already exported to {}".format(", ".join(previous_runs.values())))
+            skip = previous_runs and duplicate_action == "skip"
+
+            pipelined = as_bool(config.pipeline) and not config.generate_only and not config.update_run
+            if not skip and (not pipelined or previous_runs):
+                suite.collect()
+
+            # Once the suite object has been initialized, generate a test run with associated test records
+            if skip:
+                log.info("Skipping the export (use --duplicate-action force to export anyway)")
+            elif previous_runs:
+                suite.update_previous_runs(config.testrun_template, previous_runs)
+            elif pipelined:
+                suite.create_test_run_pipelined(config.testrun_template)
+            elif not config.generate_only:
+                if config.update_run:
+                    update_id = config.update_run
+                    log.info("Updating test run {}".format(update_id))
+                    tr = Exporter.get_test_run(update_id)
+                    suite.update_test_run(tr)
+                else:
+                    suite.create_test_run(config.testrun_template)
+            log.info("TestRun information completed to Polarion")
+        log.info("Polarion write concurrency ended at {} for TestCases and {} for TestRuns".format(
+            int(suite.throttle.test_cases.limit), int(suite.throttle.test_runs.limit)))
+        if pooled:
+            transport.log_stats()
 
         if reset_project_id:
             try:
@@ -349,9 +830,11 @@ class Exporter(object):
                 shutil.move(backup, using_pylarion_path)
             except Exception as ex:
                 CLIConfigurator.set_project_id(using_pylarion_path, original_project_id)
+        return suite
 
 
 if __name__ == "__main__":
-    config_map = kickstart()
-    Exporter.export(config_map)
+    if not query_only(sys.argv[1:]):
+        from pong.configuration import kickstart
+        Exporter.export(kickstart())
 
@@ -0,0 +1,145 @@
+"""
+Fingerprints of exported results.
+
+Nightly exports of the same suite mostly contain test methods whose status, iterations, parameters and
+Requirement are the same as last time.  Their TestCases don't need to be synced again, since nothing that
+create_polarion_tc sets on them has changed.  The FingerprintStore remembers what was last exported for each
+(project, suite, class.method) so that Exporter can skip syncing those TestCases in incremental mode.
+
+The whole result set gets a fingerprint too.  ResultsHasher is fed each <test-method> while the
+testng-results.xml is parsed, and the ExportLedger remembers which TestRuns were created for a result set.  If
+the same results get exported again (a Jenkins job retriggered, or a rerun after a partial failure) the
+exporter can skip the export or update the TestRuns it already created.
+"""
+
+import hashlib
+import json
+import time
+
+from pong.cache import JsonStore
+
+
+def _digest(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def method_fingerprint(testng):
+    """
+    Creates a fingerprint of the parts of a TestNGToPolarion that affect its TestCase
+
+    :param testng: a TestNGToPolarion object
+    :return: dict
+    """
+    iterations = [step for step in testng.step_results if step is not None]
+    params = [step.params for step in iterations] if iterations else testng.params
+    return {"status": testng.status,
+            "iterations": len(iterations),
+            "params": _digest(params),
+            "requirement": testng.requirement}
+
+
+class FingerprintStore(JsonStore):
+    """
+    Keeps the fingerprint (and TestCase id) of every exported test method.  Changes are kept in memory until
+    commit() is called, so a large suite only writes the file once
+    """
+    def __init__(self, name="fingerprints.json", cache_dir=None):
+        super(FingerprintStore, self).__init__(name, cache_dir=cache_dir)
+        self._pending = {}
+
+    @staticmethod
+    def key(project, suite, testng):
+        return "{}|{}|{}".format(project, suite, testng.class_method)
+
+    def unchanged(self, project, suite, testng):
+        """
+        Checks if testng was exported before with the same fingerprint, and its TestCase is still the same
+
+        :param project: the project id
+        :param suite: the <suite name=>
+        :param testng: a TestNGToPolarion object
+        :return: bool
+        """
+        if testng.polarion_tc is None:
+            return False
+        last = self.get(self.key(project, suite, testng))
+        if last is None:
+            return False
+        return last["testcase"] == testng.polarion_tc.work_item_id and \
+            last["fingerprint"] == method_fingerprint(testng)
+
+    def record(self, project, suite, testng):
+        with self._lock:
+            self._pending[self.key(project, suite, testng)] = {"testcase": testng.polarion_tc.work_item_id,
+                                                                "fingerprint": method_fingerprint(testng)}
+
+    def commit(self):
+        with self._lock:
+            if self._pending:
+                self.data.update(self._pending)
+                self._pending = {}
+                self.save()
+
+
+FINGERPRINTS = FingerprintStore()
+
+
+class ResultsHasher(object):
+    """
+    Incrementally hashes a normalized stream of the parsed results: each suite name, and the class.method,
+    status, start/finish times and parameters of each <test-method>.  The start times make sure that two
+    builds with the same outcome still get different hashes
+    """
+    METHOD_KEYS = ["name", "status", "started-at", "finished-at"]
+
+    def __init__(self):
+        self._sha = hashlib.sha1()
+
+    def _update(self, *parts):
+        self._sha.update(json.dumps(parts).encode("utf-8"))
+
+    def add_suite(self, suite_name):
+        self._update("suite", suite_name)
+
+    def add_method(self, class_name, attribs, params=None):
+        self._update("method", class_name, [attribs.get(k) for k in self.METHOD_KEYS], params or [])
+
+    def hexdigest(self):
+        return self._sha.hexdigest()
+
+
+class ExportLedger(JsonStore):
+    """
+    Remembers the TestRun ids created for each exported result set, keyed by export_key()
+    """
+    def __init__(self, name="exports.json", cache_dir=None):
+        super(ExportLedger, self).__init__(name, cache_dir=cache_dir)
+
+    @staticmethod
+    def export_key(results_digest, *settings):
+        """
+        Combines the results hash with the settings that decide where the results go (eg project and TestRun
+        prefix), so the same results exported somewhere else are not considered duplicates
+
+        :param results_digest: ResultsHasher.hexdigest()
+        :param settings: strs
+        :return: str
+        """
+        return hashlib.sha1(json.dumps([results_digest] + list(settings)).encode("utf-8")).hexdigest()
+
+    def add_run(self, key, suite_name, test_run_id):
+        with self._lock:
+            entry = self.get(key, {"runs": {}})
+            entry["runs"][suite_name] = test_run_id
+            entry["exported"] = time.time()
+            self.set(key, entry)
+
+    def runs(self, key):
+        """
+        :param key: an export_key()
+        :return: dict of suite name -> TestRun id (empty if this result set was never exported)
+        """
+        return self.get(key, {}).get("runs", {})
+
+
+EXPORTS = ExportLedger()
@@ -0,0 +1,135 @@
+"""
+Indexes over the WorkItems that were queried from Polarion up front
+"""
+
+import threading
+
+
+def plain_str(val):
+    # suds hands out its own str/unicode subclasses (eg suds.sax.text.Text), which carry extra attributes
+    if val is None or type(val) in (str, unicode):
+        return val
+    return unicode(val)
+
+
+class WorkItemRef(object):
+    """
+    Just enough of a WorkItem to match it by title and to fetch it later (see utils.fetch_test_case).  Holding
+    these instead of the pylarion objects (and their suds data) keeps a preload of tens of thousands of
+    TestCases small
+    """
+    __slots__ = ("title", "work_item_id", "uri")
+
+    def __init__(self, title, work_item_id, uri):
+        self.title = title
+        self.work_item_id = work_item_id
+        self.uri = uri
+
+    @classmethod
+    def of(cls, work_item):
+        if isinstance(work_item, cls):
+            return work_item
+        return cls(plain_str(work_item.title), plain_str(work_item.work_item_id), plain_str(work_item.uri))
+
+    def __eq__(self, other):
+        return isinstance(other, WorkItemRef) and self.uri == other.uri
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.uri)
+
+    def __repr__(self):
+        return "WorkItemRef({!r}, {!r})".format(self.work_item_id, self.title)
+
+
+class TitleIndex(object):
+    """
+    The TestCases from the testcases_query, keyed by their title without the TestCase prefix (ie, the
+    class.method name of the test).  Each WorkItem is only added once, even if several queries returned it, and
+    only as a WorkItemRef
+
+    The index can be used while it is still being filled (see start_loading).  A lookup that finds nothing
+    then waits for the loading to finish before deciding that there is no such TestCase
+    """
+    def __init__(self, prefix=""):
+        self.prefix = prefix or ""
+        self._by_title = {}
+        self._by_id = {}
+        self._order = []
+        self._lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._loaded.set()
+        self._error = None
+
+    def start_loading(self):
+        self._error = None
+        self._loaded.clear()
+
+    def finish_loading(self, error=None):
+        """
+        :param error: the exception that stopped the loading, if any.  It is raised to whoever waits on the index
+        """
+        self._error = error
+        self._loaded.set()
+
+    def wait(self):
+        """
+        Blocks until the index is completely loaded
+        """
+        while not self._loaded.wait(1):
+            pass
+        if self._error is not None:
+            raise self._error
+
+    def key(self, title):
+        return title.replace(self.prefix, "") if self.prefix else title
+
+    def add(self, work_item):
+        """
+        :param work_item: a pylarion WorkItem (or WorkItemRef) with at least a work_item_id, title and uri
+        :return: True if it was added, False if a WorkItem with the same work_item_id is already in the index
+        """
+        work_item = WorkItemRef.of(work_item)
+        with self._lock:
+            if work_item.work_item_id in self._by_id:
+                return False
+            self._by_id[work_item.work_item_id] = work_item
+            self._by_title.setdefault(self.key(work_item.title), []).append(work_item)
+            self._order.append(work_item)
+            return True
+
+    def extend(self, work_items):
+        """
+        :return: how many of work_items were new
+        """
+        return len([wi for wi in work_items if self.add(wi)])
+
+    def lookup(self, class_method):
+        """
+        :param class_method: the class.method name of a test
+        :return: the list of WorkItemRefs whose title (without the prefix) is class_method
+        """
+        matches = self._by_title.get(class_method)
+        if not matches:
+            # also raises the error of a failed load, rather than claiming that there is no such TestCase
+            self.wait()
+            matches = self._by_title.get(class_method)
+        return list(matches or [])
+
+    def get(self, work_item_id):
+        if work_item_id not in self._by_id:
+            self.wait()
+        return self._by_id.get(work_item_id)
+
+    def __contains__(self, work_item_id):
+        return self.get(work_item_id) is not None
+
+    def __len__(self):
+        self.wait()
+        return len(self._order)
+
+    def __iter__(self):
+        self.wait()
+        return iter(list(self._order))
@@ -1,7 +1,15 @@
+import atexit
 import logging
+import os
 import sys
+import threading
 import time
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 DEFAULT_LOG_FILE = "/tmp/pong"
 
 
@@ -86,4 +94,140 @@ def get_simple_logger(logname, filename=DEFAULT_LOG_FILE, loglvl=logging.DEBUG):
     # logr.setLevel(loglvl)
     return logr
 
+
+class QueueHandler(logging.Handler):
+    """
+    A handler that only puts records on a queue, so that logging never blocks on the console or the disk.  A
+    QueueWriter thread formats and writes them.  The message (msg % args) and the exception text are rendered
+    right away though (like the stdlib QueueHandler.prepare), since the args may change and the traceback is
+    gone once the caller moves on
+    """
+    def __init__(self, record_queue):
+        logging.Handler.__init__(self)
+        self.queue = record_queue
+        self._exc_formatter = logging.Formatter()
+
+    def emit(self, record):
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = self._exc_formatter.formatException(record.exc_info)
+                record.exc_info = None
+            self.queue.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+
+class QueueWriter(threading.Thread):
+    """
+    Takes the records off a queue and passes them to the real handlers
+    """
+    _STOP = None
+
+    def __init__(self, record_queue, handlers):
+        super(QueueWriter, self).__init__(name="pong-log-writer")
+        self.daemon = True
+        self.queue = record_queue
+        self.handlers = list(handlers)
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is self._STOP:
+                break
+            for hdlr in self.handlers:
+                if record.levelno >= hdlr.level:
+                    hdlr.handle(record)
+
+    def stop(self):
+        """
+        Writes out everything that is still queued, then ends the thread
+        """
+        self.queue.put(self._STOP)
+        self.join()
+        for hdlr in self.handlers:
+            hdlr.flush()
+
+
+_writers = {}
+
+
+def enable_async(logr):
+    """
+    Replaces the handlers of logr with a QueueHandler, and moves the original handlers to a background
+    QueueWriter thread.  Everything still queued is written out at exit (or by disable_async)
+
+    :param logr: a logging.Logger
+    :return: the QueueWriter
+    """
+    if logr.name in _writers:
+        return _writers[logr.name]
+    record_queue = queue.Queue()
+    handlers = list(logr.handlers)
+    writer = QueueWriter(record_queue, handlers)
+    for hdlr in handlers:
+        logr.removeHandler(hdlr)
+    logr.addHandler(QueueHandler(record_queue))
+    writer.start()
+    _writers[logr.name] = writer
+    return writer
+
+
+def disable_async(logr):
+    """
+    Flushes the queue of logr and puts its original handlers back
+    """
+    writer = _writers.pop(logr.name, None)
+    if writer is None:
+        return
+    for hdlr in [h for h in logr.handlers if isinstance(h, QueueHandler)]:
+        logr.removeHandler(hdlr)
+    writer.stop()
+    for hdlr in writer.handlers:
+        logr.addHandler(hdlr)
+
+
+@atexit.register
+def _flush_writers():
+    for writer in list(_writers.values()):
+        writer.stop()
+    _writers.clear()
+
+
+class RateLimitedLog(object):
+    """
+    For messages logged once per iteration of a big loop.  At most one message every interval seconds goes
+    out at the requested level, and the rest are sent at DEBUG (so they only end up in the log file).  The
+    message is a %-style format string, and is only formatted if some handler is going to write it
+    """
+    def __init__(self, logr, interval=1.0, clock=time.time):
+        self.logr = logr
+        self.interval = interval
+        self.clock = clock
+        self._last = None
+        self.suppressed = 0
+
+    def log(self, level, msg, *args):
+        now = self.clock()
+        if self._last is None or now - self._last >= self.interval:
+            if self.suppressed:
+                msg += " (%d similar messages at DEBUG)"
+                args += (self.suppressed,)
+            self._last = now
+            self.suppressed = 0
+            self.logr.log(level, msg, *args)
+        else:
+            self.suppressed += 1
+            if self.logr.isEnabledFor(logging.DEBUG):
+                self.logr.debug(msg, *args)
+
+    def info(self, msg, *args):
+        self.log(logging.INFO, msg, *args)
+
+
 log = get_simple_logger(__name__)
+
+# Set PONG_ASYNC_LOG=1 to write the logs from a background thread
+if os.environ.get("PONG_ASYNC_LOG", "").lower() in ("1", "true", "yes", "on"):
+    enable_async(log)
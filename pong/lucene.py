@@ -0,0 +1,252 @@
+"""
+Answers the Lucene queries that pong uses from the local mirror (see mirror.py), without asking Polarion
+
+Only the subset of the syntax that our testcases_query, requirements_query and --query-testcase use is
+understood:
+
+- title:word, title:"a phrase", title:wild*card? (a word or phrase matches consecutive words of the title)
+- type:, id:, author.id: and project.id: (exact values, wildcards allowed)
+- AND, OR, (groups), field:(a OR b) and whitespace between terms (which is OR, as in Lucene)
+
+Anything else (NOT, +/-, ranges, boosts, fuzzy terms, other fields...) raises UnsupportedQuery, and the caller
+is expected to send the query to Polarion instead.
+
+Titles are tokenized roughly the way Polarion's analyzer does it: lowercased, and split on everything except
+letters, digits, "_" and "." (so that rhsm.cli.tests.RegisterTests.testRegister stays one word for wildcards
+like rhsm.*.tests*)
+"""
+
+import bisect
+import re
+
+from pong.index import WorkItemRef
+
+FIELDS = ("title", "type", "id", "author.id", "project.id")
+WORD_RE = re.compile(r"[\w.]+", re.UNICODE)
+OPERATORS = {"AND": "AND", "&&": "AND", "OR": "OR", "||": "OR"}
+SPECIAL = set('[]{}^~:+-!')
+
+
+class UnsupportedQuery(Exception):
+    pass
+
+
+def analyze(text):
+    """
+    :return: the list of (lowercased) words of a title or of a title query
+    """
+    return [word.strip(".") for word in WORD_RE.findall((text or u"").lower()) if word.strip(".")]
+
+
+def is_wild(value):
+    return "*" in value or "?" in value
+
+
+def wildcard_regex(pattern):
+    parts = [".*" if c == "*" else "." if c == "?" else re.escape(c) for c in pattern]
+    return re.compile("".join(parts) + r"\Z", re.UNICODE | re.DOTALL)
+
+
+def tokenize(query):
+    """
+    Splits a query into "(", ")", "AND", "OR", ("field", name), ("phrase", text) and ("word", text)
+    """
+    tokens = []
+    i, n = 0, len(query)
+    while i < n:
+        c = query[i]
+        if c.isspace():
+            i += 1
+        elif c in "()":
+            tokens.append(c)
+            i += 1
+        elif c == '"':
+            i += 1
+            chars = []
+            while i < n and query[i] != '"':
+                if query[i] == "\\" and i + 1 < n:
+                    i += 1
+                chars.append(query[i])
+                i += 1
+            if i >= n:
+                raise UnsupportedQuery("Unterminated phrase in {}".format(query))
+            i += 1
+            if i < n and not query[i].isspace() and query[i] != ")":
+                raise UnsupportedQuery("Unsupported suffix {} after a phrase".format(query[i]))
+            tokens.append(("phrase", u"".join(chars)))
+        elif c in SPECIAL:
+            raise UnsupportedQuery("Unsupported syntax {} in {}".format(c, query))
+        else:
+            chars = []
+            while i < n and not query[i].isspace() and query[i] not in '()":':
+                if query[i] == "\\" and i + 1 < n:
+                    i += 1
+                elif query[i] in "[]{}^~":
+                    raise UnsupportedQuery("Unsupported syntax {} in {}".format(query[i], query))
+                chars.append(query[i])
+                i += 1
+            word = u"".join(chars)
+            if i < n and query[i] == ":":
+                tokens.append(("field", word))
+                i += 1
+            elif word in OPERATORS:
+                tokens.append(OPERATORS[word])
+            elif word == "NOT":
+                raise UnsupportedQuery("NOT is not supported")
+            else:
+                tokens.append(("word", word))
+    return tokens
+
+
+class Parser(object):
+    """
+    Parses a query into nested tuples: ("or", [nodes]), ("and", [nodes]) and ("term", field, kind, value), where
+    kind is "word", "phrase" or "wild".  AND binds tighter than OR
+    """
+    def __init__(self, query):
+        self.query = query
+        self.tokens = tokenize(query)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise UnsupportedQuery("Empty query")
+        node = self.expr(None)
+        if self.peek() is not None:
+            raise UnsupportedQuery("Unexpected {} in {}".format(self.peek(), self.query))
+        return node
+
+    def expr(self, field):
+        nodes = [self.and_expr(field)]
+        while self.peek() not in (None, ")"):
+            if self.peek() == "OR":
+                self.next()
+            nodes.append(self.and_expr(field))
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def and_expr(self, field):
+        nodes = [self.unary(field)]
+        while self.peek() == "AND":
+            self.next()
+            nodes.append(self.unary(field))
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def unary(self, field):
+        token = self.next()
+        if token == "(":
+            node = self.expr(field)
+            if self.next() != ")":
+                raise UnsupportedQuery("Unbalanced parentheses in {}".format(self.query))
+            return node
+        if isinstance(token, tuple) and token[0] == "field":
+            if token[1] not in FIELDS:
+                raise UnsupportedQuery("Unsupported field {}".format(token[1]))
+            return self.unary(token[1])
+        if isinstance(token, tuple) and field is not None:
+            kind, value = token
+            if kind == "word" and is_wild(value):
+                kind = "wild"
+            return ("term", field, kind, value)
+        if isinstance(token, tuple):
+            raise UnsupportedQuery("{} has no field".format(token[1]))
+        raise UnsupportedQuery("Unexpected {} in {}".format(token, self.query))
+
+
+def parse(query):
+    return Parser(query).parse()
+
+
+class LuceneIndex(object):
+    """
+    An inverted index over the titles (word -> WorkItem id -> positions) and exact values of WorkItems
+    """
+    def __init__(self, project, rows):
+        """
+        :param project: the project id the WorkItems are from
+        :param rows: iterable of (work_item_id, type, title, uri, author)
+        """
+        self.project = project
+        self.refs = {}
+        self.fields = {"type": {}, "id": {}, "author.id": {}}
+        self.postings = {}
+        for work_item_id, wi_type, title, uri, author in rows:
+            self.refs[work_item_id] = WorkItemRef(title, work_item_id, uri)
+            for field, value in (("type", wi_type), ("id", work_item_id), ("author.id", author)):
+                self.fields[field].setdefault(value, set()).add(work_item_id)
+            for pos, word in enumerate(analyze(title)):
+                self.postings.setdefault(word, {}).setdefault(work_item_id, []).append(pos)
+        self.vocabulary = sorted(self.postings)
+
+    def search(self, query, wi_type=None):
+        """
+        :param query: a Lucene query string
+        :param wi_type: only return WorkItems of this type (eg mirror.TESTCASE)
+        :return: list of WorkItemRefs, sorted by id
+        """
+        ids = self.evaluate(parse(query))
+        if wi_type is not None:
+            ids &= self.fields["type"].get(wi_type, set())
+        return [self.refs[wid] for wid in sorted(ids)]
+
+    def evaluate(self, node):
+        if node[0] == "and":
+            results = [self.evaluate(n) for n in node[1]]
+            return set.intersection(*results)
+        if node[0] == "or":
+            return set().union(*[self.evaluate(n) for n in node[1]])
+        _, field, kind, value = node
+        if field == "title":
+            return self.match_title(kind, value)
+        if field == "project.id":
+            if self.match_value(kind, value, [self.project]):
+                return set(self.refs)
+            raise UnsupportedQuery("The mirror only has the WorkItems of {}".format(self.project))
+        values = self.fields[field]
+        return set().union(*[values[v] for v in self.match_value(kind, value, values)])
+
+    @staticmethod
+    def match_value(kind, value, values):
+        if kind == "wild":
+            regex = wildcard_regex(value)
+            return [v for v in values if v is not None and regex.match(v)]
+        return [value] if value in values else []
+
+    def match_title(self, kind, value):
+        if kind == "wild":
+            return self.match_wildcard(value.lower())
+        words = analyze(value)
+        if not words:
+            return set()
+        return self.match_phrase(words)
+
+    def match_wildcard(self, pattern):
+        # Only the words starting with the literal prefix of the pattern need to be looked at
+        prefix = re.split(r"[*?]", pattern, 1)[0]
+        regex = wildcard_regex(pattern)
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        ids = set()
+        for word in self.vocabulary[start:]:
+            if not word.startswith(prefix):
+                break
+            if regex.match(word):
+                ids.update(self.postings[word])
+        return ids
+
+    def match_phrase(self, words):
+        first = self.postings.get(words[0], {})
+        if len(words) == 1:
+            return set(first)
+        ids = set()
+        for wid, positions in first.items():
+            rest = [self.postings.get(word, {}).get(wid, ()) for word in words[1:]]
+            if any(all(pos + i in later for i, later in enumerate(rest, 1)) for pos in positions):
+                ids.add(wid)
+        return ids
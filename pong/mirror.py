@@ -0,0 +1,284 @@
+"""
+A local sqlite mirror of the TestCases and Requirements of a Polarion project
+
+Only what is needed to match and link WorkItems is kept (title, id, uri, author, linked items and the number of
+test steps).  The mirror is brought up to date with a query for the WorkItems updated since the last sync, so an
+export only downloads what changed since the previous one, and the title lookups of parsing.py and
+requirement.py can then be answered locally.
+
+Polarion can't be asked for deleted WorkItems, so every full_sync_days the whole project is fetched again, and
+whatever is not in it anymore is dropped.
+
+Queries in the subset of Lucene that lucene.py understands can be answered from the mirror (see Mirror.query).
+"""
+
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+from pong.cache import CACHE_DIR
+from pong.index import WorkItemRef, plain_str
+from pong.logger import log
+from pong.lucene import LuceneIndex, UnsupportedQuery
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS work_items (
+    work_item_id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    title TEXT,
+    uri TEXT,
+    author TEXT,
+    linked TEXT,
+    steps INTEGER,
+    updated TEXT
+);
+CREATE INDEX IF NOT EXISTS work_items_by_title ON work_items (type, title);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+TESTCASE = "testcase"
+REQUIREMENT = "requirement"
+
+MIRROR_FIELDS = ["work_item_id", "title", "author", "linked_work_items", "updated"]
+DEFAULT_FULL_SYNC_DAYS = 7
+DATE_FORMAT = "%Y%m%d"
+# Bumped when what is stored in the rows changes, so that mirrors made by an older pong are fully synced again
+ROW_FORMAT = "2"
+
+
+def day_before(day):
+    """
+    :param day: a DATE_FORMAT date
+    :return: the DATE_FORMAT date of the day before
+    """
+    return (datetime.datetime.strptime(day, DATE_FORMAT) - datetime.timedelta(days=1)).strftime(DATE_FORMAT)
+
+
+def work_item_row(wi_type, wi, steps=None):
+    linked = " ".join(sorted(plain_str(li.work_item_id) for li in getattr(wi, "linked_work_items", None) or []))
+    # pylarion gives the author as a User, and author.id: queries are about its user_id
+    author = getattr(wi, "author", None)
+    author = getattr(author, "user_id", author)
+    return (plain_str(wi.work_item_id), wi_type, plain_str(wi.title), plain_str(wi.uri),
+            plain_str(author), linked, steps, plain_str(getattr(wi, "updated", None)))
+
+
+def fetch_pages(wi_type, query, page_size=500):
+    """
+    The default way for Mirror.sync to get WorkItems from Polarion: the query results, a page at a time
+    """
+    from pong.utils import iter_test_cases, iter_requirements
+    if wi_type == TESTCASE:
+        return iter_test_cases(query, page_size=page_size, fields=MIRROR_FIELDS)
+    return iter_requirements(query, page_size=page_size, fields=MIRROR_FIELDS)
+
+
+class Mirror(object):
+    """
+    The sqlite connection is shared by all the threads of an export (the preload, the TestCase syncs...), so
+    every statement, reads included, is run with the lock held
+    """
+    def __init__(self, project, path=None):
+        """
+        :param project: the project id
+        :param path: the sqlite file (CACHE_DIR/mirror-<project>.sqlite by default)
+        """
+        self.project = project
+        if path is None:
+            if not os.path.exists(CACHE_DIR):
+                os.makedirs(CACHE_DIR, 0o700)
+            path = os.path.join(CACHE_DIR, "mirror-{}.sqlite".format(project))
+        self.path = path
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        # bumped by every write, so that the LuceneIndex is only rebuilt when the mirror changed
+        self.version = 0
+        self._lucene = None
+
+    def close(self):
+        self.conn.close()
+
+    def _select(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def get_meta(self, key, default=None):
+        rows = self._select("SELECT value FROM meta WHERE key = ?", (key,))
+        return default if not rows else rows[0][0]
+
+    def set_meta(self, key, value):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def upsert(self, wi_type, work_items):
+        """
+        Adds or replaces WorkItems
+
+        :param wi_type: TESTCASE or REQUIREMENT
+        :param work_items: pylarion WorkItems (with the MIRROR_FIELDS)
+        :return: the list of their ids
+        """
+        rows = [work_item_row(wi_type, wi) for wi in work_items]
+        with self._lock, self.conn:
+            # the step count is only known from our own exports (see record), so keep it
+            self.conn.executemany("INSERT OR REPLACE INTO work_items VALUES (?, ?, ?, ?, ?, ?, "
+                                  "(SELECT steps FROM work_items WHERE work_item_id = ?), ?)",
+                                  [row[:6] + (row[0], row[7]) for row in rows])
+            self.version += 1
+        return [row[0] for row in rows]
+
+    def record(self, wi_type, wi, steps=None):
+        """
+        Updates the mirror with a WorkItem that pong just created or updated itself
+        """
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO work_items VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              work_item_row(wi_type, wi, steps))
+            self.version += 1
+
+    def sync(self, full=False, full_sync_days=None, fetch=fetch_pages):
+        """
+        Fetches the WorkItems updated since the last sync.  Lucene date ranges in Polarion are by day, in the
+        server's timezone, while last_sync is the local date.  So the WorkItems of the day before the last sync
+        are fetched again too, which covers any timezone difference and is harmless since upserts are idempotent
+
+        :param full: fetch everything (also done if the last full sync is older than full_sync_days)
+        :param full_sync_days: how often to do a full sync (DEFAULT_FULL_SYNC_DAYS if None or "")
+        :param fetch: function (wi_type, query) -> iterable of pages of WorkItems
+        :return: how many WorkItems were fetched
+        """
+        if full_sync_days in (None, ""):
+            full_sync_days = DEFAULT_FULL_SYNC_DAYS
+        full_sync_days = float(full_sync_days)
+        today = time.strftime(DATE_FORMAT)
+        since = self.get_meta("last_sync")
+        last_full = self.get_meta("last_full_sync")
+        if since is None or last_full is None or self.get_meta("row_format") != ROW_FORMAT:
+            full = True
+        elif time.time() - time.mktime(time.strptime(last_full, DATE_FORMAT)) > full_sync_days * 86400:
+            full = True
+
+        fetched = 0
+        for wi_type in (TESTCASE, REQUIREMENT):
+            query = "project.id:{} AND type:{}".format(self.project, wi_type)
+            if not full:
+                query += " AND updated:[{} TO *]".format(day_before(since))
+            log.info("Syncing the {} mirror: {}".format(self.project, query))
+            seen = set()
+            for page in fetch(wi_type, query):
+                seen.update(self.upsert(wi_type, page))
+            fetched += len(seen)
+            if full:
+                self._drop_missing(wi_type, seen)
+
+        self.set_meta("last_sync", today)
+        if full:
+            self.set_meta("last_full_sync", today)
+            self.set_meta("row_format", ROW_FORMAT)
+        log.info("{} WorkItems of {} were {}synced".format(fetched, self.project, "fully " if full else ""))
+        return fetched
+
+    def _drop_missing(self, wi_type, seen):
+        with self._lock, self.conn:
+            known = [r[0] for r in self.conn.execute("SELECT work_item_id FROM work_items WHERE type = ?",
+                                                     (wi_type,))]
+            gone = [(wid,) for wid in known if wid not in seen]
+            self.conn.executemany("DELETE FROM work_items WHERE work_item_id = ?", gone)
+            self.version += 1
+        if gone:
+            log.info("Dropped {} {}s that are no longer in {}".format(len(gone), wi_type, self.project))
+
+    @staticmethod
+    def _refs(rows):
+        return [WorkItemRef(title, wid, uri) for wid, title, uri in rows]
+
+    def work_items(self, wi_type):
+        """
+        :return: WorkItemRefs of all the mirrored WorkItems of wi_type
+        """
+        return self._refs(self._select("SELECT work_item_id, title, uri FROM work_items WHERE type = ? "
+                                       "ORDER BY work_item_id", (wi_type,)))
+
+    def by_title(self, wi_type, title):
+        """
+        :return: WorkItemRefs of the WorkItems of wi_type with exactly this title
+        """
+        return self._refs(self._select("SELECT work_item_id, title, uri FROM work_items "
+                                       "WHERE type = ? AND title = ? ORDER BY work_item_id", (wi_type, title)))
+
+    def title_contains(self, wi_type, text):
+        """
+        :return: WorkItemRefs of the WorkItems of wi_type whose title contains text
+        """
+        return self._refs(self._select("SELECT work_item_id, title, uri FROM work_items "
+                                       "WHERE type = ? AND instr(title, ?) > 0 ORDER BY work_item_id",
+                                       (wi_type, text)))
+
+    def get(self, work_item_id):
+        """
+        :return: dict of the mirrored columns of a WorkItem, or None
+        """
+        with self._lock:
+            cursor = self.conn.execute("SELECT * FROM work_items WHERE work_item_id = ?", (work_item_id,))
+            row = cursor.fetchone()
+            columns = [c[0] for c in cursor.description]
+        if row is None:
+            return None
+        item = dict(zip(columns, row))
+        item["linked"] = item["linked"].split() if item["linked"] else []
+        return item
+
+    def lucene(self):
+        """
+        :return: a LuceneIndex of the mirror as it is now
+        """
+        with self._lock:
+            if self._lucene is None or self._lucene[0] != self.version:
+                rows = self.conn.execute("SELECT work_item_id, type, title, uri, author FROM work_items").fetchall()
+                self._lucene = (self.version, LuceneIndex(self.project, rows))
+            return self._lucene[1]
+
+    def search(self, query, wi_type=None):
+        """
+        :param query: a Lucene query (raises lucene.UnsupportedQuery if it is not in the supported subset)
+        :param wi_type: TESTCASE or REQUIREMENT, or None for both
+        :return: list of the matching WorkItemRefs
+        """
+        return self.lucene().search(query, wi_type=wi_type)
+
+    def query(self, wi_type, query, fallback):
+        """
+        Answers the query from the mirror if possible, and otherwise with fallback
+
+        :param fallback: function (query) -> list of WorkItems, eg utils.query_test_case
+        """
+        try:
+            found = self.search(query, wi_type=wi_type)
+        except UnsupportedQuery as ex:
+            log.info("Querying Polarion for {} ({})".format(query, ex))
+            return fallback(query)
+        log.info("{} {}s in the {} mirror match {}".format(len(found), wi_type, self.project, query))
+        return found
+
+    def __len__(self):
+        return self._select("SELECT COUNT(*) FROM work_items")[0][0]
+
+
+_mirrors = {}
+_mirrors_lock = threading.Lock()
+
+
+def get_mirror(project):
+    """
+    The Mirror of project, opened once per process
+    """
+    with _mirrors_lock:
+        if project not in _mirrors:
+            _mirrors[project] = Mirror(project)
+        return _mirrors[project]
@@ -2,18 +2,46 @@
 
 """
 
+import threading
 import xml.etree.ElementTree as ET
+from functools import partial
 #from urllib2 import urlopen
 from urllib3 import PoolManager
 from urlparse import urlparse
+from multiprocessing.pool import ThreadPool
 
 from pong.core import TestIterationResult, TestNGToPolarion
 from pong.decorators import fixme
-from pong.logger import log
+from pong.logger import log, RateLimitedLog
 from pong.utils import *
 
 import pong.requirement as preq
 from pong.decorators import profile
+from pong.fingerprint import ResultsHasher
+from pong.index import TitleIndex, plain_str
+from pong.mirror import get_mirror, TESTCASE, REQUIREMENT
+
+# One line per test method iteration floods the console on big results files, so only the file log gets all
+iteration_log = RateLimitedLog(log)
+
+
+# Titles per targeted query.  Each title is a phrase clause, and lucene refuses queries with too many clauses
+TARGETED_CHUNK_SIZE = 50
+
+
+def targeted_title_queries(titles, chunk_size=TARGETED_CHUNK_SIZE):
+    """
+    Makes title:("a" OR "b" ...) queries that together cover exactly the given titles
+
+    :param titles: list of TestCase titles
+    :param chunk_size: most titles per query
+    :return: list of str
+    """
+    def phrase(title):
+        return '"{}"'.format(title.replace("\\", "\\\\").replace('"', '\\"'))
+
+    return ["title:({})".format(" OR ".join(phrase(t) for t in titles[i:i + chunk_size]))
+            for i in range(0, len(titles), chunk_size)]
 
 
 def get_data_provider_elements(elem):
@@ -189,13 +217,126 @@ class Transformer(object):
         self.quick_query = quick_query
         self.testcases_query = [] if config.testcases_query is None else config.testcases_query
         self.config = config
+        self.results_hash = ResultsHasher()
+
+        self.existing_test_cases = TitleIndex(prefix=config.testcase_prefix)
+        self._preloader = None
+        self._results_root = None
+        self.mirror = get_mirror(self.project_id) if as_bool(config.get("mirror")) else None
+        self.preload()
+
+    def preload(self):
+        """
+        Runs all the testcases_query queries (and the Requirements query, if it will be needed) at the same time
+        in the background.  The TestCases go into the existing_test_cases index a page at a time (see
+        utils.iter_test_cases), so the results file can already be parsed and matched while the queries run
+
+        With the targeted_query config, the testcases_query is not used.  Instead, the titles of the tests in the
+        results file are queried for directly (see targeted_title_queries)
 
-        existing_test_cases = []
-        for base in self.testcases_query:
+        With the mirror config, the project's mirror (see mirror.py) is synced, and the queries are answered from
+        it.  Only the queries that lucene.py can't evaluate still go to Polarion
+
+        With the preload_full_fields config, the TestCases that the tests in the results file will match (see
+        TNGTestMethod.find_matching_polarion_tc) are registered in the identity map as they are, and all the
+        others are only kept as WorkItemRefs in the index
+        """
+        full = as_bool(self.config.preload_full_fields)
+        page_size = int(self.config.get("query_page_size") or 0)
+        index = self.existing_test_cases
+        wanted = set(index.key(title) for title in self.result_titles()) if full else set()
+
+        def register_matches(tcs):
+            for tc in tcs:
+                if index.key(plain_str(tc.title)) in wanted:
+                    WORK_ITEMS.register(tc)
+            return tcs
+
+        def tc_query(base, paged=True):
             log.info("Performing Polarion query of {}".format(base))
-            tcs = query_test_case(base)
-            existing_test_cases.extend(tcs)
-        self.existing_test_cases = existing_test_cases
+            if paged and page_size > 0:
+                pages = iter_test_cases(base, page_size=page_size, full=full)
+            else:
+                pages = [query_test_case(base, full=full)]
+            total = added = 0
+            for page in pages:
+                total += len(page)
+                added += index.extend(register_matches(page))
+            log.debug("{} of the {} TestCases from {} were new".format(added, total, base))
+
+        def req_query(query):
+            log.info("Performing Requirements query: {}".format(query))
+            if page_size > 0:
+                pages = iter_requirements(query, page_size=page_size)
+            else:
+                pages = [query_requirement(query)]
+            reqs = []
+            seen = set()
+            for page in pages:
+                new = [req for req in page if req.work_item_id not in seen]
+                seen.update(req.work_item_id for req in new)
+                reqs.extend(new)
+            self._existing_requirements = reqs
+
+        def mirror_sync(_):
+            self.mirror.sync(full_sync_days=self.config.get("mirror_full_sync_days"))
+            if as_bool(self.config.get("targeted_query")):
+                queries = targeted_title_queries(self.result_titles())
+            else:
+                queries = self.testcases_query
+            for base in queries:
+                index.extend(self.mirror.query(TESTCASE, base,
+                                               lambda q: register_matches(query_test_case(q, full=full))))
+            if self.quick_query and self._existing_requirements is None and self.config.requirements_query:
+                self._existing_requirements = self.mirror.query(REQUIREMENT, self.config.requirements_query,
+                                                                query_requirement)
+
+        if self.mirror is not None:
+            # The queries are answered by the local mirror of the project, which only needs to fetch what changed
+            jobs = [(mirror_sync, None)]
+        elif as_bool(self.config.get("targeted_query")):
+            # Only query for the TestCases of the tests that are actually in the results file
+            queries = targeted_title_queries(self.result_titles())
+            jobs = [(partial(tc_query, paged=False), q) for q in queries]
+        else:
+            jobs = [(tc_query, base) for base in self.testcases_query]
+        if self.mirror is None and self.quick_query and self._existing_requirements is None and \
+                self.config.requirements_query:
+            jobs.append((req_query, self.config.requirements_query))
+        if not jobs:
+            return
+
+        # The preload threads share pylarion's session with the parsing, which is only safe with the pooled
+        # transport.  Without it, the queries run one at a time, before the parsing
+        from pong.transport import is_installed, thread_safe_workers
+        background = is_installed()
+        workers = thread_safe_workers(min(len(jobs), MAX_QUERY_WORKERS), "the preload queries")
+
+        def run():
+            pool = ThreadPool(workers) if workers > 1 else None
+            try:
+                if pool is not None:
+                    pool.map(lambda job: job[0](job[1]), jobs)
+                else:
+                    for func, arg in jobs:
+                        func(arg)
+            except Exception as ex:
+                log.error("Preloading from Polarion failed: {}".format(ex))
+                index.finish_loading(error=ex)
+                return
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+            index.finish_loading()
+
+        index.start_loading()
+        if not background:
+            run()
+            return
+        self._preloader = threading.Thread(target=run, name="Preload")
+        self._preloader.daemon = True
+        self._preloader.start()
 
     def generate_base_testrun_id(self, suite_name):
         """
@@ -214,6 +355,8 @@ class Transformer(object):
 
     @property
     def existing_requirements(self):
+        if self._preloader is not None:
+            self.existing_test_cases.wait()
         if self._existing_requirements is None:
             log.info("Performing Requirements query: {}".format(self.config.requirements_query))
             self._existing_requirements = query_requirement(self.config.requirements_query)
@@ -233,6 +376,34 @@ class Transformer(object):
         root = tree.getroot()
         return root.iter(element)
 
+    def results_root(self):
+        """
+        The root Element of the results file, which is only downloaded and parsed once
+
+        :return: xml.etree.ElementTree.Element
+        """
+        if self._results_root is None:
+            result_path = self.result_path
+            if result_path.startswith("http"):
+                result_path = download_url(result_path)
+            self._results_root = ET.parse(result_path).getroot()
+        return self._results_root
+
+    def result_titles(self):
+        """
+        The distinct TestCase titles (prefix + class.method) of the test methods in the results file
+
+        :return: sorted list of str
+        """
+        prefix = self.config.testcase_prefix or ""
+        titles = set()
+        for klass in self.results_root().iter("class"):
+            for test_method in klass.iter("test-method"):
+                if test_method.attrib.get("is-config") == "true":
+                    continue
+                titles.add("{}{}.{}".format(prefix, klass.attrib["name"], test_method.attrib["name"]))
+        return sorted(titles)
+
     def parse_suite(self):
         """
         Gets all the <test> elements, and generates a Requirement if needed, then grabs all the <class> elements
@@ -243,11 +414,13 @@ class Transformer(object):
         :return:
         """
         log.info("Beginning parsing of {}...".format(self.result_path))
-        suites = self.parse_by_element(self.result_path, "suite")
+        suites = self.results_root().iter("suite")
 
         testng_suites = {}
+        self.results_hash = ResultsHasher()
         for suite in suites:
             suite_name = suite.attrib["name"]
+            self.results_hash.add_suite(suite_name)
             tests = self.parse_tests(suite)
             testng_suites[suite_name] = tests
 
@@ -279,9 +452,12 @@ class Transformer(object):
                 if self.quick_query:
                     req = preq.is_in_requirements(requirement_name, self.existing_requirements)
                 else:
-                    req = preq.is_requirement_exists(requirement_name)
+                    req = preq.is_requirement_exists(requirement_name, mirror=self.mirror)
                 if not req:
                     req = preq.create_requirement(self.project_id, requirement_name)
+                    # create_requirement returns the Requirement it created (fetched from Polarion), if any
+                    if req and self.mirror is not None:
+                        self.mirror.record(REQUIREMENT, req)
                 requirements_set.add(requirement_name)
 
             # CHANGED: We are no longer auto generating
@@ -342,6 +518,8 @@ class Transformer(object):
                 if "is-config" in test_method.attrib and test_method.attrib["is-config"] == "true":
                     continue
                 tm = TNGTestMethod(test_method, t_class, cached_query=cached_lookup, tc_prefix=tc_prefix)
+                params = None if tm.result is None else tm.result.params
+                self.results_hash.add_method(t_class.name, tm.attribs, params)
 
                 if last_test_method is None:
                     last_test_method = tm.method_name
@@ -351,8 +529,8 @@ class Transformer(object):
                 test_case_title = tm.full_name
                 if test_case_title not in titles:
                     iteration = 1
-                template = "\tIteration {}: parsing {} {}"
-                log.info(template.format(iteration, test_case_title, tm.attribs['started-at']))
+                iteration_log.info("\tIteration %s: parsing %s %s", iteration, test_case_title,
+                                   tm.attribs['started-at'])
                 iteration += 1
 
                 if test_case_title not in titles:
@@ -361,7 +539,7 @@ class Transformer(object):
                     tests.append(testng)
                 else:
                     # We only get multiple test_case_title if it was a data-provider test so append results
-                    testng.step_results.append(tm.result)
+                    testng.add_result(tm.result)
 
         return titles, tests
 
@@ -380,7 +558,12 @@ class TNGTestClass(object):
         else:
             # matches = cached_tc_query(self.name, existing_tests, multiple=multiple)
             query = self.name + "." + meth_name
-            matches = cached_tc_query(query, existing_tests, multiple=multiple)
+            if isinstance(existing_tests, TitleIndex):
+                matches = existing_tests.lookup(query)
+                if not multiple:
+                    matches = matches[0] if matches else False
+            else:
+                matches = cached_tc_query(query, existing_tests, multiple=multiple)
         return matches
 
 
@@ -393,7 +576,7 @@ class TNGTestMethod(object):
 
         :param tm_elem: The Element of the <test-method>
         :param test_class: The Element of the <class>
-        :param cached_query: a list of the already queried pylarion TestCase
+        :param cached_query: a TitleIndex (or a list) of the already queried pylarion TestCase
         :return:
         """
         self._p_testcase = None
@@ -431,13 +614,12 @@ class TNGTestMethod(object):
 
         ptc = None
         if self._p_testcase is None:
-            from pylarion.work_item import TestCase as PylTestCase
             for match in matches:
                 class_method = match.title.replace(self.tc_prefix, "")
 
                 if class_method == self.full_name:
                     log.info("Found existing TestCase in Polarion: {}".format(match.title))
-                    ptc = PylTestCase(uri=match.uri)
+                    ptc = fetch_test_case(match.uri)
                     break
         else:
             ptc = self._p_testcase
@@ -1,14 +1,24 @@
 from pong.utils import *
 from toolz import first
 from pong.logger import log
+from pong.mirror import REQUIREMENT
 
 
-def is_requirement_exists(title):
+def is_requirement_exists(title, mirror=None):
+    """
+    :param title: the title of the Requirement
+    :param mirror: a mirror.Mirror to look the title up in, instead of querying Polarion
+    :return: the first Requirement whose title contains title, or False
+    """
+    if mirror is not None:
+        reqs = mirror.title_contains(REQUIREMENT, title)
+        return reqs[0] if reqs else False
+
     q = title_query(title)
     reqs = query_requirement(q)
 
     def fltr(r):
-        print "Checking", unicode(r.title)
+        log.debug("Checking {}".format(unicode(r.title)))
         return title in unicode(r.title)
 
     try:
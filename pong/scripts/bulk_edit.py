@@ -0,0 +1,275 @@
+"""
+A bulk editor for Polarion WorkItems
+
+The edits are a declarative list of operations, for example (as json)::
+
+    [{"op": "unlink", "role": "verifies"},
+     {"op": "retitle", "title": "DeleteMe"},
+     {"op": "set", "field": "author", "value": "stoner", "only_if": "ci-user"}]
+
+Supported operations:
+
+- retitle: set the title to "title"
+- prefix: prepend "prefix" to the title (unless the title already starts with it)
+- suffix: append "suffix" to the title
+- unlink: remove the linked items as "role" (default verifies), optionally only the ids in "items"
+- set: set "field" to "value", optionally only if its current value is "only_if"
+
+The WorkItems are edited concurrently (--workers) with a cap on requests per second (--rate).  Every edited
+WorkItem id is written to a journal file, and items already in the journal are skipped, so an interrupted job
+can simply be run again.  With --dry-run, the changes are only printed.
+
+    python -m pong.scripts.bulk_edit -q "title:rhsm.*.tests*" --ops ops.json --journal /tmp/tc_delete.txt
+"""
+
+import argparse
+import json
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+from pong.logger import log
+from pong.decorators import retry
+from pong.throttle import TokenBucket
+
+
+class Change(object):
+    """
+    One planned change to a WorkItem.  Planning is kept apart from applying so that a dry run can describe
+    the changes without touching anything
+    """
+    def __init__(self, description, apply_fn):
+        self.description = description
+        self.apply = apply_fn
+
+    def __str__(self):
+        return self.description
+
+
+def plan_retitle(wi, title):
+    def apply_fn(w):
+        w.title = title
+    return [Change("title: {} -> {}".format(wi.title, title), apply_fn)]
+
+
+def plan_prefix(wi, prefix):
+    if wi.title.startswith(prefix):
+        return []
+    return plan_retitle(wi, prefix + wi.title)
+
+
+def plan_suffix(wi, suffix):
+    return plan_retitle(wi, wi.title + suffix)
+
+
+def plan_unlink(wi, role="verifies", items=None):
+    changes = []
+    for li in wi.linked_work_items:
+        if items is not None and li.work_item_id not in items:
+            continue
+
+        def apply_fn(w, linked=li.work_item_id):
+            w.remove_linked_item(linked, role)
+        changes.append(Change("unlink {} ({})".format(li.work_item_id, role), apply_fn))
+    return changes
+
+
+def plan_set(wi, field, value, only_if=None):
+    current = getattr(wi, field)
+    if current == value or (only_if is not None and current != only_if):
+        return []
+
+    def apply_fn(w):
+        setattr(w, field, value)
+    return [Change("{}: {} -> {}".format(field, current, value), apply_fn)]
+
+
+class Draft(object):
+    """
+    A working copy of a WorkItem to plan the changes against.  Each operation is planned against the result of
+    the ones before it (eg a prefix after a retitle prefixes the new title), the WorkItem itself is left alone
+    """
+    def __init__(self, wi):
+        self.__dict__["_wi"] = wi
+        self.__dict__["_values"] = {}
+
+    def __getattr__(self, name):
+        values = self.__dict__["_values"]
+        return values[name] if name in values else getattr(self.__dict__["_wi"], name)
+
+    def __setattr__(self, name, value):
+        self._values[name] = value
+
+    def remove_linked_item(self, work_item_id, role):
+        self.linked_work_items = [li for li in self.linked_work_items if li.work_item_id != work_item_id]
+
+
+OPERATIONS = {"retitle": plan_retitle,
+              "prefix": plan_prefix,
+              "suffix": plan_suffix,
+              "unlink": plan_unlink,
+              "set": plan_set}
+
+
+def validate_operations(operations):
+    for op in operations:
+        if op.get("op") not in OPERATIONS:
+            raise Exception("Unknown operation {}.  Must be one of {}".format(op, ", ".join(sorted(OPERATIONS))))
+    return operations
+
+
+class Journal(object):
+    """
+    The ids of the WorkItems that have been edited, one per line
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path, "r") as journal:
+                self.done = set(line.strip() for line in journal if line.strip())
+        self._fp = open(path, "a") if path else None
+
+    def __contains__(self, work_item_id):
+        return work_item_id in self.done
+
+    def record(self, work_item_id):
+        with self._lock:
+            self.done.add(work_item_id)
+            if self._fp:
+                self._fp.write(work_item_id + "\n")
+                self._fp.flush()
+
+    def close(self):
+        if self._fp:
+            self._fp.close()
+
+
+class BulkEditor(object):
+    def __init__(self, operations, loader, workers=4, rate=None, journal=None, dry_run=False):
+        """
+        :param operations: list of operation dicts (see the module docstring)
+        :param loader: function that takes a WorkItem (eg from a query) and returns the fully populated
+                       pylarion WorkItem to edit
+        :param workers: how many WorkItems to edit at the same time
+        :param rate: the most WorkItems to edit per second (None for no limit)
+        :param journal: path to the journal file (None to not keep one)
+        :param dry_run: if True, only log the changes
+        """
+        self.operations = validate_operations(operations)
+        self.loader = loader
+        self.workers = workers
+        self.bucket = TokenBucket(rate)
+        self.journal = Journal(None if dry_run else journal)
+        self.dry_run = dry_run
+        self.failed = []
+
+    def plan(self, wi):
+        """
+        :return: the Changes of all the operations, in order.  Applied to wi in that order, they compose
+        """
+        draft = Draft(wi)
+        changes = []
+        for op in self.operations:
+            kwargs = {k: v for k, v in op.items() if k != "op"}
+            for change in OPERATIONS[op["op"]](draft, **kwargs):
+                change.apply(draft)
+                changes.append(change)
+        return changes
+
+    @retry
+    def _update(self, wi):
+        wi.update()
+
+    def edit(self, item):
+        """
+        Plans and applies the operations to one WorkItem
+
+        :param item: a WorkItem (only its uri and work_item_id are needed)
+        :return: the list of Changes
+        """
+        if item.work_item_id in self.journal:
+            return []
+        self.bucket.acquire()
+        try:
+            wi = self.loader(item)
+            changes = self.plan(wi)
+            prefix = "[dry-run] " if self.dry_run else ""
+            for change in changes:
+                log.info("{}{}: {}".format(prefix, wi.work_item_id, change))
+            if not self.dry_run:
+                if changes:
+                    for change in changes:
+                        change.apply(wi)
+                    self._update(wi)
+                self.journal.record(wi.work_item_id)
+            return changes
+        except Exception as ex:
+            log.error("Failed to edit {}: {}".format(item.work_item_id, ex))
+            self.failed.append(item.work_item_id)
+            return []
+
+    def run(self, items):
+        """
+        Edits all the items
+
+        :param items: a list of WorkItems
+        :return: the number of WorkItems that were (or in a dry run, would be) changed
+        """
+        todo = [item for item in items if item.work_item_id not in self.journal]
+        log.info("Editing {} WorkItems ({} already done)".format(len(todo), len(items) - len(todo)))
+        pool = ThreadPool(max(1, self.workers))
+        try:
+            results = pool.map(self.edit, todo)
+        finally:
+            pool.close()
+            pool.join()
+            self.journal.close()
+        if self.failed:
+            log.error("{} WorkItems could not be edited: {}".format(len(self.failed), ", ".join(self.failed)))
+        return len([r for r in results if r])
+
+
+def main():
+    from pong.utils import query_test_case, query_requirement, fetch_test_case
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-q", "--query", required=True, help="lucene query of the WorkItems to edit")
+    parser.add_argument("-t", "--type", choices=["testcase", "requirement"], default="testcase")
+    parser.add_argument("--ops", help="path to a json file with the list of operations")
+    parser.add_argument("--op", action="append", default=[], help="an operation as a json object (repeatable)")
+    parser.add_argument("-w", "--workers", type=int, default=4)
+    parser.add_argument("-r", "--rate", type=float, help="most WorkItems to edit per second")
+    parser.add_argument("-j", "--journal", default="/tmp/bulk_edit.txt",
+                        help="file of the edited ids.  Ids already in it are skipped")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="only print what would change")
+    opts = parser.parse_args()
+
+    operations = []
+    if opts.ops:
+        with open(opts.ops, "r") as ops:
+            operations.extend(json.load(ops))
+    operations.extend(json.loads(op) for op in opts.op)
+    if not operations:
+        parser.error("No operations given.  Use --ops or --op")
+
+    from pong import transport
+    transport.install(maxsize=opts.workers)
+
+    if opts.type == "testcase":
+        items = query_test_case(opts.query)
+        loader = lambda item: fetch_test_case(item.uri)
+    else:
+        from pylarion.work_item import Requirement
+        items = query_requirement(opts.query)
+        loader = lambda item: Requirement(uri=item.uri)
+
+    editor = BulkEditor(operations, loader, workers=opts.workers, rate=opts.rate, journal=opts.journal,
+                        dry_run=opts.dry_run)
+    changed = editor.run(items)
+    log.info("{} WorkItems {}changed".format(changed, "would be " if opts.dry_run else ""))
+
+
+if __name__ == "__main__":
+    main()
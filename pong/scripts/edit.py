@@ -1,5 +1,6 @@
 from pylarion.work_item import TestCase, Requirement
 from pong.utils import query_test_case, query_requirement
+from pong.scripts.bulk_edit import BulkEditor
 import re
 
 
@@ -71,25 +72,23 @@ def fix_tc_title(tc):
         print "Failed to update {}".format(wi.title)
 
 
-def remove_linked_requirements_from_tests(test_cases):
+def remove_linked_requirements_from_tests(test_cases, dry_run=False):
     """
     Removes all linked Items from TestCase objects in test_Cases
 
+    The edits are done concurrently by the BulkEditor, and /tmp/tc_delete.txt is its journal, so running this
+    again picks up where an interrupted run left off
+
     :param test_cases:
+    :param dry_run: if True, only log what would be changed
     :return:
     """
-    with open("/tmp/tc_delete.txt", "w") as tcd:
-        for tc in test_cases:
-            tc = TestCase(uri=tc.uri)
-            linked_items  = tc.linked_work_items
-            for li in linked_items:
-                tc.remove_linked_item(li.work_item_id, "verifies")
-            tc.title = "DeleteMe"
-            if tc.author == "ci-user":
-                tc.author = "stoner"
-            tcd.write(tc.work_item_id + "\n")
-            tcd.flush()
-            tc.update()
+    operations = [{"op": "unlink", "role": "verifies"},
+                  {"op": "retitle", "title": "DeleteMe"},
+                  {"op": "set", "field": "author", "value": "stoner", "only_if": "ci-user"}]
+    editor = BulkEditor(operations, lambda tc: TestCase(uri=tc.uri), workers=8, rate=10,
+                        journal="/tmp/tc_delete.txt", dry_run=dry_run)
+    editor.run(test_cases)
 
 
 def edit_tc_title(tc_, prefix):
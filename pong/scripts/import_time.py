@@ -0,0 +1,86 @@
+"""
+Measures how long it takes to import the pong modules (and optionally to run a whole command), each in a fresh
+interpreter so nothing is already cached in sys.modules.  Exits with 1 if the median of any of them is over the
+threshold (1 second by default).
+
+    python -m pong.scripts.import_time
+    python -m pong.scripts.import_time -t 0.5
+    python -m pong.scripts.import_time -n 10 -m pong.exporter -c "-m pong.exporter --get-default-project-id True"
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULES = ["pong.logger", "pong.utils", "pong.configuration", "pong.exporter", "pong.parsing"]
+DEFAULT_THRESHOLD = 1.0
+
+TIMER = "import time; start = time.time(); import {}; print(time.time() - start)"
+
+
+def time_import(module):
+    """
+    Imports module in a new python process
+
+    :param module: the dotted name of the module
+    :return: seconds the import took
+    """
+    out = subprocess.check_output([sys.executable, "-c", TIMER.format(module)])
+    return float(out.strip().splitlines()[-1])
+
+
+def time_command(command):
+    """
+    Runs "python <command>" and measures the wall time, including interpreter startup
+
+    :param command: the args to python as a str
+    :return: seconds
+    """
+    start = time.time()
+    subprocess.call([sys.executable] + command.split())
+    return time.time() - start
+
+
+def median(times):
+    return sorted(times)[len(times) // 2]
+
+
+def summarize(name, times):
+    times = sorted(times)
+    return "{:<30} min={:.3f}s median={:.3f}s max={:.3f}s".format(name, times[0], median(times), times[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="How many times to measure each")
+    parser.add_argument("-m", "--module", action="append", help="Module to import (can be repeated)")
+    parser.add_argument("-c", "--command", help="Args to python to time end to end (eg '-m pong.exporter ...')")
+    parser.add_argument("-t", "--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Most seconds the median may take (default is 1)")
+    opts = parser.parse_args()
+
+    slow = []
+    for module in opts.module or DEFAULT_MODULES:
+        try:
+            times = [time_import(module) for _ in range(opts.repeat)]
+        except subprocess.CalledProcessError:
+            print "{:<30} could not be imported".format(module)
+            continue
+        print summarize(module, times)
+        if median(times) > opts.threshold:
+            slow.append(module)
+
+    if opts.command:
+        times = [time_command(opts.command) for _ in range(opts.repeat)]
+        print summarize(opts.command, times)
+        if median(times) > opts.threshold:
+            slow.append(opts.command)
+
+    if slow:
+        print "Slower than {}s: {}".format(opts.threshold, ", ".join(slow))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
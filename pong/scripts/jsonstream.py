@@ -0,0 +1,105 @@
+"""
+Helpers to read and write big json arrays one element at a time, so memory use stays proportional to a
+single element rather than the whole file
+"""
+
+import json
+
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_array(fp, chunk_size=CHUNK_SIZE):
+    """
+    Yields the elements of the top level json array in the file fp, reading it chunk_size bytes at a time
+
+    :param fp: a file like object opened for reading
+    :param chunk_size: how much to read at a time
+    :return: generator of the decoded elements
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    started = False
+    eof = False
+
+    while True:
+        buf = buf.lstrip()
+        if not started:
+            if not buf.startswith("["):
+                if buf or eof:
+                    raise ValueError("Expected a json array")
+            else:
+                buf = buf[1:]
+                started = True
+                continue
+        else:
+            if buf.startswith(","):
+                buf = buf[1:]
+                continue
+            if buf.startswith("]"):
+                return
+            if buf:
+                try:
+                    obj, end = decoder.raw_decode(buf)
+                except ValueError:
+                    # Not enough of the element has been read yet (unless there is nothing left to read)
+                    if eof:
+                        raise
+                else:
+                    # A number at the very end of the buffer might still continue in the next chunk
+                    if end < len(buf) or eof:
+                        buf = buf[end:]
+                        yield obj
+                        continue
+            elif eof:
+                raise ValueError("Unterminated json array")
+
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf += chunk
+
+
+class JsonArrayWriter(object):
+    """
+    Writes a json array one element at a time
+
+        with open(path, "w") as fp:
+            with JsonArrayWriter(fp) as writer:
+                for elem in elements:
+                    writer.write(elem)
+    """
+    def __init__(self, fp, **dump_kwargs):
+        self.fp = fp
+        self.dump_kwargs = dump_kwargs
+        self.count = 0
+
+    def __enter__(self):
+        self.fp.write("[")
+        return self
+
+    def write(self, obj):
+        self.fp.write(",\n" if self.count else "\n")
+        self.fp.write(json.dumps(obj, **self.dump_kwargs))
+        self.count += 1
+
+    def __exit__(self, *exc):
+        self.fp.write("\n]\n")
+        return False
+
+
+class JsonObjectWriter(JsonArrayWriter):
+    """
+    Like JsonArrayWriter, but writes a json object one key/value pair at a time
+    """
+    def __enter__(self):
+        self.fp.write("{")
+        return self
+
+    def write(self, key, obj):
+        self.fp.write(",\n" if self.count else "\n")
+        self.fp.write(json.dumps(key) + ":" + json.dumps(obj, **self.dump_kwargs))
+        self.count += 1
+
+    def __exit__(self, *exc):
+        self.fp.write("\n}\n")
+        return False
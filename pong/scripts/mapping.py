@@ -1,23 +1,28 @@
 """
-This is a script to create a JSON map of class.methodName to the Polarion TestCase and Requirements
+This is a script to create a map of class.methodName to the Polarion TestCase and Requirements
+
+The map is kept in an indexed sqlite store (see mapping_store.py), so looking up a class.method does not mean
+reloading a whole json file.  Each run only queries the TestCases that were updated since the previous run
+(unless --full is given).  map-file.json and reflected.json are still written for the tools that read them.
+
+    python -m pong.scripts.mapping -m reflected.json
+    python -m pong.scripts.mapping -m reflected.json --lookup rhsm.cli.tests.RegisterTests.testRegister
 """
 
 from pong.utils import *
 from pong.logger import log
+from pong.mirror import DATE_FORMAT, day_before
+from pong.scripts.mapping_store import MappingStore
 import re
 import argparse
 import json
-import toolz
+import time
 import sys
 import xml.etree.ElementTree as et
 
-parser = argparse.ArgumentParser()
-parser.add_argument("-m", "--mapping-file", help="Path to mapping json file")
-opts = parser.parse_args()
-
-if not os.path.exists(opts.mapping_file):
-    print "Could not find the mapping file to load"
-    sys.exit(1)
+TC_QUERY = "title:RHSM-TC AND type:testcase"
+TC_FIELDS = ["title", "work_item_id", "linked_work_items", "updated"]
+patt = re.compile(r"RHSM-TC : rhsm.(cli|gui)\.tests\.([a-zA-Z0-9_.\- ]+)")
 
 
 class ProjectDetails(object):
@@ -30,9 +35,6 @@ class Mapping(object):
     def __init__(self, method):
         self.method = method
 
-tcs = query_test_case("title:RHSM-TC AND type:testcase", fields=["title", "work_item_id", "linked_work_items"])
-patt = re.compile(r"RHSM-TC : rhsm.(cli|gui)\.tests\.([a-zA-Z0-9_.\- ]+)")
-
 
 def matcher(tc):
     m = patt.search(tc.title)
@@ -40,69 +42,93 @@ def matcher(tc):
         return m.groups(), tc
     return False
 
-matched = filter(lambda x: x, [matcher(tc_) for tc_ in tcs])
-reflected = None
-with open(opts.mapping_file, "r") as mapping:
-    reflected = toolz.groupby('className', json.load(mapping))
-
-# It seems that we get duplicates in the reflected, so let's remove them
-# Extra Credit:  do this functionally.  Though maybe we should keep the duplicates?
-if 0:
-    refl = {}
-    for clazz, items in reflected.items():
-        nameset = []
-        maps = []
-        qualset = set()
-        for m in items:
-            methname = m['methodName']
-            qual = "{}.{}".format(clazz, methname)
-            if qual not in qualset:
-                nameset.append(methname)
-                qualset.add(qual)
-                maps.append(m)
-            else:
-                log.warning("Found duplicate {} in {}.".format(qual, nameset))
-        refl[clazz] = maps
-    reflected = refl
-
-
-mapped = []
-for class_meth, tc in matched:
-    mapping = {}
-    class_prefix = "rhsm.{}.tests.".format(class_meth[0])
-    klass, meth = class_meth[1].split(".")
-    klass = class_prefix + klass
-    try:
-        class_group = reflected[klass]
-    except KeyError as ke:
-        log.warning(ke.message)
-        continue
-    found = list(filter(lambda m: m['methodName'] == meth, class_group))
-    if not found:
-        log.info("No Polarion test case was found for {}.{}".format(klass,meth))
-        continue
-    ptc = toolz.first(found)
-    fullname = "{}.{}".format(klass, meth)
-    log.info("Found matching test case for {}".format(fullname))
-
-    reqs = [req.work_item_id for req in tc.linked_work_items]
-    mapping[fullname] = {"testcase": tc.work_item_id, "requirements": reqs}
-    mapped.append(mapping)
-
-
-for clazz, maps in reflected.items():
-    for m in maps:
-        methname = m['methodName']
-        classname = m['className']
-        if methname not in mapping and m['enabled']:
-            log.warning("{}.{} is enabled, but there is no Polarion TestCase for it".format(classname, methname))
-
-s = sorted(mapped, key=lambda x: x.keys()[0])
-with open("map-file.json", "w") as mapper:
-    json.dump(s, mapper, sort_keys=True, indent=2, separators=(',', ':'))
-
-with open("reflected.json", "w") as refl:
-    json.dump(reflected, refl, sort_keys=True, indent=2, separators=(',', ':'))
+
+def qualified_name(class_meth):
+    """
+    :param class_meth: the groups matched by patt (eg ("cli", "RegisterTests.testRegister"))
+    :return: the full class.method name (eg rhsm.cli.tests.RegisterTests.testRegister)
+    """
+    return "rhsm.{}.tests.{}".format(*class_meth)
+
+
+def index_reflected(reflected):
+    """
+    Builds a className -> methodName -> reflected entry index of the JarHelper reflection output.  It seems
+    that we get duplicates in the reflected, so only the first of each class.method is kept
+
+    :param reflected: list of dicts with className and methodName
+    :return: dict
+    """
+    index = {}
+    for m in reflected:
+        methods = index.setdefault(m['className'], {})
+        if m['methodName'] in methods:
+            log.warning("Found duplicate {}.{}".format(m['className'], m['methodName']))
+            continue
+        methods[m['methodName']] = m
+    return index
+
+
+def refresh(store, full=False):
+    """
+    Updates the store with the TestCases that changed since the last refresh (or all of them if full)
+
+    Lucene date ranges in Polarion are by day, in the server's timezone, so the TestCases of the day before the
+    last refresh are fetched again too (see Mirror.sync).  That's harmless since upserts are idempotent
+
+    :param store: a MappingStore
+    :param full: if True, query all the TestCases
+    :return: list of the (class_meth groups, TestCase) that matched patt
+    """
+    query = TC_QUERY
+    since = None if full else store.get_meta("last_refresh")
+    if since:
+        query += " AND updated:[{} TO *]".format(day_before(since))
+    started = time.strftime(DATE_FORMAT)
+
+    log.info("Querying {}".format(query))
+    tcs = query_test_case(query, fields=TC_FIELDS)
+    matched = []
+    for tc in tcs:
+        m = matcher(tc)
+        if not m:
+            # The title no longer looks like a class.method, so it shouldn't be mapped anymore
+            store.remove(tc.work_item_id)
+            continue
+        reqs = [req.work_item_id for req in tc.linked_work_items]
+        store.upsert(qualified_name(m[0]), tc.work_item_id, reqs, str(tc.updated))
+        matched.append(m)
+
+    store.set_meta("last_refresh", started)
+    log.info("Refreshed {} TestCases".format(len(matched)))
+    return matched
+
+
+def write_maps(store, reflected_index):
+    """
+    Writes map-file.json (the mapping of the reflected methods that have a TestCase) and reflected.json
+    """
+    mapped = []
+    for entry in store.dump():
+        fullname = entry.keys()[0]
+        klass, meth = get_class_methodname(fullname)
+        if meth not in reflected_index.get(klass, {}):
+            log.info("No reflected method was found for Polarion test case {}".format(fullname))
+            continue
+        mapped.append(entry)
+
+    names = store.names()
+    for clazz, methods in reflected_index.items():
+        for methname, m in methods.items():
+            if "{}.{}".format(clazz, methname) not in names and m['enabled']:
+                log.warning("{}.{} is enabled, but there is no Polarion TestCase for it".format(clazz, methname))
+
+    with open("map-file.json", "w") as mapper:
+        json.dump(mapped, mapper, sort_keys=True, indent=2, separators=(',', ':'))
+
+    reflected = {clazz: [methods[name] for name in sorted(methods)] for clazz, methods in reflected_index.items()}
+    with open("reflected.json", "w") as refl:
+        json.dump(reflected, refl, sort_keys=True, indent=2, separators=(',', ':'))
 
 
 #####################################################################
@@ -263,11 +289,6 @@ class TC2Json(object):
         else:
             return []
 
-js = map(lambda x: TC2Json(x[1]), matched)
-
-with open("/tmp/tc2json.json", "w") as tc2:
-    json.dump(js, tc2, default=lambda x: x.__dict__, indent=2, sort_keys=True, separators=(",", ":"))
-
 
 class XMLTestCase(object):
     """
@@ -296,3 +317,38 @@ class XMLTestCase(object):
         rp = et.SubElement(rps, "response-property", attrib=attr)
         return rps
 
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--mapping-file", help="Path to the JarHelper reflected json file")
+    parser.add_argument("-s", "--store", default="map-file.sqlite", help="Path to the sqlite mapping store")
+    parser.add_argument("--full", action="store_true", help="Query all the TestCases, not just the updated ones")
+    parser.add_argument("--lookup", help="Print the TestCase and Requirements of a class.method and exit")
+    parser.add_argument("--tc2json", default="/tmp/tc2json.json",
+                        help="Where to write the TestCases refreshed by this run as json")
+    opts = parser.parse_args()
+
+    store = MappingStore(opts.store)
+    if opts.lookup:
+        print json.dumps(store.lookup(opts.lookup), indent=2)
+        return
+
+    if not opts.mapping_file or not os.path.exists(opts.mapping_file):
+        print "Could not find the mapping file to load"
+        sys.exit(1)
+
+    with open(opts.mapping_file, "r") as mapping:
+        reflected_index = index_reflected(json.load(mapping))
+
+    matched = refresh(store, full=opts.full)
+    write_maps(store, reflected_index)
+
+    if opts.tc2json:
+        js = map(lambda x: TC2Json(x[1]), matched)
+        with open(opts.tc2json, "w") as tc2:
+            json.dump(js, tc2, default=lambda x: x.__dict__, indent=2, sort_keys=True, separators=(",", ":"))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
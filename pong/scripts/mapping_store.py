@@ -0,0 +1,100 @@
+"""
+An indexed sqlite store of class.method -> Polarion TestCase id -> Requirement ids
+
+This replaces reloading (and linearly searching) whole json map files.  Each row also keeps the TestCase's
+updated timestamp, so the store can be refreshed incrementally with only the TestCases that changed since
+the last refresh.
+"""
+
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS testcases (
+    testcase_id TEXT PRIMARY KEY,
+    qualified_name TEXT NOT NULL,
+    updated TEXT
+);
+CREATE INDEX IF NOT EXISTS testcases_by_name ON testcases (qualified_name);
+CREATE TABLE IF NOT EXISTS requirements (
+    testcase_id TEXT NOT NULL,
+    requirement_id TEXT NOT NULL,
+    PRIMARY KEY (testcase_id, requirement_id)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class MappingStore(object):
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def upsert(self, qualified_name, testcase_id, requirements, updated=None):
+        """
+        Adds or replaces the mapping of a TestCase
+
+        :param qualified_name: the class.method name (eg rhsm.cli.tests.RegisterTests.testRegister)
+        :param testcase_id: the work_item_id of the TestCase
+        :param requirements: list of the work_item_id of the linked Requirements
+        :param updated: the updated timestamp of the TestCase (as a str)
+        :return:
+        """
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO testcases VALUES (?, ?, ?)",
+                              (testcase_id, qualified_name, updated))
+            self.conn.execute("DELETE FROM requirements WHERE testcase_id = ?", (testcase_id,))
+            self.conn.executemany("INSERT OR IGNORE INTO requirements VALUES (?, ?)",
+                                  [(testcase_id, req) for req in requirements])
+
+    def remove(self, testcase_id):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM testcases WHERE testcase_id = ?", (testcase_id,))
+            self.conn.execute("DELETE FROM requirements WHERE testcase_id = ?", (testcase_id,))
+
+    def requirements(self, testcase_id):
+        rows = self.conn.execute("SELECT requirement_id FROM requirements WHERE testcase_id = ? "
+                                 "ORDER BY requirement_id", (testcase_id,))
+        return [r[0] for r in rows]
+
+    def lookup(self, qualified_name):
+        """
+        :param qualified_name: the class.method name
+        :return: a list of {"testcase": id, "requirements": [ids]} (usually of length 0 or 1)
+        """
+        rows = self.conn.execute("SELECT testcase_id FROM testcases WHERE qualified_name = ? "
+                                 "ORDER BY testcase_id", (qualified_name,))
+        return [{"testcase": r[0], "requirements": self.requirements(r[0])} for r in rows.fetchall()]
+
+    def names(self):
+        """
+        :return: the set of all mapped class.method names
+        """
+        return set(r[0] for r in self.conn.execute("SELECT DISTINCT qualified_name FROM testcases"))
+
+    def dump(self):
+        """
+        Returns the whole store in the format of the old map-file.json: a list of
+        {class.method: {"testcase": id, "requirements": [ids]}} sorted by class.method
+
+        :return: list
+        """
+        rows = self.conn.execute("SELECT qualified_name, testcase_id FROM testcases "
+                                 "ORDER BY qualified_name, testcase_id").fetchall()
+        return [{name: {"testcase": tc, "requirements": self.requirements(tc)}} for name, tc in rows]
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, key, value):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
@@ -1,33 +1,29 @@
 """
 This script will merge the RHEL6 and RedHatEnterpriseLinux7 json files together
+
+The inputs are read one array element at a time (see jsonstream.py).  Only the index of the merged project
+maps (class.method -> merged entry) is kept in memory; the JarHelper reflection and annotation files are
+joined against it on the qualified method name as they stream by, and only the requested outputs are written.
 """
 import os
 import argparse
-import json
 import sys
-from toolz import itertoolz as it
 from toolz import dicttoolz as dt
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--rh6", help="path to RHEL6 mapping file")
-parser.add_argument("--rh7", help="path to RHEL7 mapping file")
-parser.add_argument("--testng", help="path to the JarHelper reflected json file for testng annotations")
-parser.add_argument("--ann", help="path to the json file with all the annotation metadata")
+from pong.scripts.jsonstream import iter_json_array, JsonObjectWriter
 
-opts = parser.parse_args()
+OUTPUTS = ["merged-projects", "testng-and-polarion", "testcases-by-meth", "fully-merged"]
+OUTPUT_FILES = {"merged-projects": "merged-projects.json",
+                "testng-and-polarion": "testng-and-polarion.json",
+                "testcases-by-meth": "testcases-by-meth.txt",
+                "fully-merged": "fully-merged.json"}
+DUMP_ARGS = {"sort_keys": True, "indent": 2, "separators": (',', ':')}
 
-paths = [opts.rh6, opts.rh7, opts.testng, opts.ann]
-names = ["rh6", "rh7", "testng", "ann"]
-zipped = zip(paths, names)
-for t in zipped:
-    if not os.path.exists(t[0]):
-        print "Could not find the mapping file for --{}".format(t[1])
-        sys.exit(1)
 
-json_dicts = {}
-for z in zipped:
-    with open(z[0], "r") as jsonf:
-        json_dicts[z[1]] = json.load(jsonf)
+def iter_file(path):
+    with open(path, "r") as jsonf:
+        for elem in iter_json_array(jsonf):
+            yield elem
 
 
 # Create a new dict.  The top level key will still be the function name, but the value will be another map whose
@@ -46,65 +42,115 @@ for z in zipped:
 #     }
 #   }
 # }
+def index_projects(rh6_path, rh7_path):
+    """
+    Builds the class.method -> {project: mapping, 'testcases': id or [ids]} index from the mapping files
+
+    :param rh6_path: path to the RHEL6 mapping file
+    :param rh7_path: path to the RHEL7 mapping file
+    :return: dict
+    """
+    index = {}
+    for d in iter_file(rh6_path):
+        for meth, v in d.items():
+            if meth not in index:
+                index[meth] = {"RHEL6": v, 'testcases': v['testcase']}
+
+    for d in iter_file(rh7_path):
+        for meth, v in d.items():
+            rh7_tc = v['testcase']
+            if meth not in index:
+                index[meth] = {"RedHatEnterpriseLinux7": v, 'testcases': rh7_tc}
+            elif "RedHatEnterpriseLinux7" not in index[meth]:
+                index[meth]["RedHatEnterpriseLinux7"] = v
+                index[meth]['testcases'] = [index[meth]['testcases'], rh7_tc]
+    return index
+
+
+def join_testng(index, testng_path):
+    """
+    Merges each JarHelper reflected method into its entry in the index (joined on className.methodName)
+    """
+    for v in iter_file(testng_path):
+        lookup = "{}.{}".format(v['className'], v['methodName'])
+        if lookup in index:
+            index[lookup] = dt.merge(index[lookup], v)
+
+
+def write_index(index, path):
+    with open(path, "w") as merged:
+        with JsonObjectWriter(merged, **DUMP_ARGS) as writer:
+            for k in sorted(index):
+                writer.write(k, index[k])
+
+
+def write_testcases_by_meth(index, path):
+    with open(path, "w") as tcs:
+        for k in sorted(index):
+            v = index[k]
+            if isinstance(v['testcases'], list):
+                ids = k + ": " + ", ".join(map(lambda x: '"{}"'.format(x), v['testcases'])) + "\n"
+            else:
+                ids = k + ": " + v['testcases'] + "\n"
+            tcs.write(ids)
+
+
+def write_fully_merged(index, ann_path, path):
+    """
+    Streams the annotation file, writing each annotated method that is in the index merged with its entry
+    """
+    seen = set()
+    with open(path, "w") as merged:
+        with JsonObjectWriter(merged, **DUMP_ARGS) as writer:
+            for v in iter_file(ann_path):
+                k = v['qualifiedName']
+                if k in index and k not in seen:
+                    seen.add(k)
+                    writer.write(k, dt.merge(v, index[k]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rh6", help="path to RHEL6 mapping file")
+    parser.add_argument("--rh7", help="path to RHEL7 mapping file")
+    parser.add_argument("--testng", help="path to the JarHelper reflected json file for testng annotations")
+    parser.add_argument("--ann", help="path to the json file with all the annotation metadata")
+    parser.add_argument("--outputs", default=",".join(OUTPUTS),
+                        help="comma separated outputs to write, out of: " + ", ".join(OUTPUTS))
+    parser.add_argument("--output-dir", default="/tmp", help="directory to write the outputs to")
+    opts = parser.parse_args()
+
+    outputs = [o.strip() for o in opts.outputs.split(",") if o.strip()]
+    unknown = [o for o in outputs if o not in OUTPUTS]
+    if unknown:
+        print "Unknown outputs: {}".format(", ".join(unknown))
+        sys.exit(1)
 
-rh6 = json_dicts["rh6"]
-rh7 = json_dicts["rh7"]
-ann = json_dicts["ann"]
-testng = json_dicts["testng"]
-
-newdict = {}
-for d in rh6:
-    meth = d.keys()[0]
-    v = d[meth]
-    rh6_tc = v['testcase']
-    if meth not in newdict:
-        newdict[meth] = {"RHEL6": v, 'testcases': rh6_tc}
-
-for d in rh7:
-    meth = d.keys()[0]
-    v = d[meth]
-    rh7_tc = v['testcase']
-    if meth not in newdict:
-        newdict[meth] = {"RedHatEnterpriseLinux7": v, 'testcases': rh7_tc}
-    else:
-        if "RedHatEnterpriseLinux7" not in newdict[meth]:
-            newdict[meth]["RedHatEnterpriseLinux7"] = v
-            tcs = [newdict[meth]['testcases'], rh7_tc]
-            newdict[meth]['testcases'] = tcs
-
-with open("/tmp/merged-projects.json", "w") as merged:
-    json.dump(newdict, merged, sort_keys=True, indent=2, separators=(',', ':'))
-
-grouped = it.groupby('methodName', testng)
-for k, v in grouped.items():
-    v = v[0]
-    className = v['className']
-    lookup = "{}.{}".format(className, k)
-    if lookup in newdict:
-        nd = dt.merge(newdict[lookup], v)
-        newdict[lookup] = nd
-
-with open("/tmp/testng-and-polarion.json", "w") as merged:
-    json.dump(newdict, merged, sort_keys=True, indent=2, separators=(',', ':'))
-
-with open("/tmp/testcases-by-meth.txt", "w") as tcs:
-    lines = []
-    for k, v in newdict.items():
-        if isinstance(v['testcases'], list):
-            ids = k + ": " + ", ".join(map(lambda x: '"{}"'.format(x), v['testcases'])) + "\n"
-        else:
-            ids = k + ": " + v['testcases'] + "\n"
-        print ids
-        tcs.write(ids)
-
-
-ann_dict = {}
-ann_grouped = it.groupby('qualifiedName', ann)
-for k, v in ann_grouped.items():
-    v = v[0]
-    if k in newdict:
-        nd = dt.merge(v, newdict[k])
-        ann_dict[k] = nd
-
-with open("/tmp/fully-merged.json", "w") as merged:
-    json.dump(ann_dict, merged, sort_keys=True, indent=2, separators=(',', ':'))
+    # Only check for (and read) the inputs that the requested outputs need
+    needed = [("rh6", opts.rh6), ("rh7", opts.rh7)]
+    if set(outputs) & {"testng-and-polarion", "fully-merged"}:
+        needed.append(("testng", opts.testng))
+    if "fully-merged" in outputs:
+        needed.append(("ann", opts.ann))
+    for name, path in needed:
+        if path is None or not os.path.exists(path):
+            print "Could not find the mapping file for --{}".format(name)
+            sys.exit(1)
+
+    out = lambda o: os.path.join(opts.output_dir, OUTPUT_FILES[o])
+    index = index_projects(opts.rh6, opts.rh7)
+    if "merged-projects" in outputs:
+        write_index(index, out("merged-projects"))
+
+    if set(outputs) & {"testng-and-polarion", "fully-merged"}:
+        join_testng(index, opts.testng)
+    if "testng-and-polarion" in outputs:
+        write_index(index, out("testng-and-polarion"))
+    if "testcases-by-meth" in outputs:
+        write_testcases_by_meth(index, out("testcases-by-meth"))
+    if "fully-merged" in outputs:
+        write_fully_merged(index, opts.ann, out("fully-merged"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Makes starting up a pylarion session cheaper.
+
+Before the first query, suds downloads and parses the WSDL (and the schemas it imports) of every Polarion web
+service, and pylarion logs in.  Both are done again by every run of the exporter.
+
+- install_wsdl_cache() gives every suds Client a suds ObjectCache in CACHE_DIR/wsdl, so the parsed WSDLs are
+  loaded from disk instead of downloaded and parsed again
+- install_session_cache() remembers the Polarion session id after logging in (in CACHE_DIR/sessions.json,
+  readable only by the user) and reuses it while it is still valid, instead of logging in again
+
+pylarion's session internals are not a public API, so everything here falls back to the normal behavior
+whenever the session does not look the way we expect.
+"""
+
+import os
+
+from pong.cache import CACHE_DIR, TTLStore
+from pong.logger import log
+from pong.transport import CLIENT_DEFAULTS, patch_client, drop_client_default
+
+WSDL_CACHE_DIR = os.path.join(CACHE_DIR, "wsdl")
+DEFAULT_WSDL_CACHE_DAYS = 7
+
+# Polarion drops sessions that are idle for a while, so a cached session id is only tried if it was used recently
+DEFAULT_SESSION_TTL = 10 * 60
+SESSIONS = TTLStore("sessions.json", DEFAULT_SESSION_TTL)
+
+
+def install_wsdl_cache(days=DEFAULT_WSDL_CACHE_DAYS, location=WSDL_CACHE_DIR):
+    """
+    Makes every suds Client created from now on keep its parsed WSDLs in location for days
+
+    :param days: how long a cached WSDL is used (0 or less to not cache)
+    :param location: the cache directory
+    """
+    from suds.cache import ObjectCache
+
+    if days <= 0:
+        drop_client_default("cache")
+        return
+    if not os.path.exists(location):
+        os.makedirs(location, 0o700)
+    patch_client()
+    CLIENT_DEFAULTS["cache"] = lambda: ObjectCache(location=location, days=days)
+    log.debug("WSDLs are cached in {} for {} days".format(location, days))
+
+
+def _session_key(session):
+    server = getattr(session, "_server", None)
+    return "{}|{}".format(getattr(server, "url", ""), getattr(server, "user", ""))
+
+
+def _clients(session):
+    """
+    The suds Clients of the pylarion session (one per web service)
+    """
+    for val in vars(session).values():
+        client = getattr(val, "client", None)
+        if client is not None and hasattr(client, "set_options"):
+            yield client
+
+
+def get_session_id(session):
+    """
+    :return: (session id, namespace) of a logged in pylarion session, or None
+    """
+    header = getattr(session, "_session_id_header", None)
+    if header is None:
+        return None
+    try:
+        return header.getText(), header.namespace()[1]
+    except (AttributeError, IndexError, TypeError):
+        return None
+
+
+def set_session_id(session, session_id, namespace):
+    """
+    Makes all the web service clients of a pylarion session send the given session id
+    """
+    from suds.sax.element import Element
+
+    header = Element("sessionID", ns=("ns1", namespace)).setText(session_id)
+    session._session_id_header = header
+    for client in _clients(session):
+        client.set_options(soapheaders=header)
+
+
+def is_logged_in(session):
+    try:
+        return bool(session._session_service.client.service.hasSubject())
+    except Exception as ex:
+        log.debug("Cached Polarion session is not usable: {}".format(ex))
+        return False
+
+
+def install_session_cache(store=SESSIONS, session_class=None):
+    """
+    Wraps pylarion's Session._login so that a recently used session id is reused instead of logging in.  A
+    cached id is checked with the (cheap) hasSubject call first, and a full login is done if it is not valid
+
+    :param store: a TTLStore (a ttl of 0 turns the cache off)
+    :param session_class: the class to patch (pylarion.session.Session by default)
+    """
+    if session_class is None:
+        from pylarion.session import Session as session_class
+
+    login = session_class.__dict__["_login"]
+    original = getattr(login, "original", login)
+    if store.ttl <= 0:
+        session_class._login = original
+        return
+
+    def _login(self):
+        key = _session_key(self)
+        cached = store.get(key)
+        if cached:
+            set_session_id(self, cached["id"], cached["ns"])
+            if is_logged_in(self):
+                log.debug("Reusing the Polarion session of {}".format(key))
+                store.set(key, cached)
+                return
+            store.pop(key)
+        original(self)
+        session_id = get_session_id(self)
+        if session_id is not None:
+            store.set(key, {"id": session_id[0], "ns": session_id[1]})
+    _login.original = original
+    session_class._login = _login
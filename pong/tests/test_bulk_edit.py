@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pong.scripts.bulk_edit import BulkEditor
+
+
+class FakeLink(object):
+    def __init__(self, work_item_id):
+        self.work_item_id = work_item_id
+
+
+class FakeWorkItem(object):
+    def __init__(self, work_item_id, title, author="ci-user"):
+        self.work_item_id = work_item_id
+        self.uri = "uri-" + work_item_id
+        self.title = title
+        self.author = author
+        self.linked_work_items = [FakeLink("RHEL6-1")]
+        self.updates = 0
+
+    def remove_linked_item(self, work_item_id, role):
+        self.linked_work_items = [li for li in self.linked_work_items if li.work_item_id != work_item_id]
+
+    def update(self):
+        self.updates += 1
+
+
+class TestBulkEditor(unittest.TestCase):
+    OPS = [{"op": "unlink", "role": "verifies"},
+           {"op": "prefix", "prefix": "RHSM-TC : "},
+           {"op": "set", "field": "author", "value": "stoner", "only_if": "ci-user"}]
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.journal = os.path.join(self.tmp, "journal.txt")
+        self.items = [FakeWorkItem("RHEL6-{}".format(i), "rhsm.cli.tests.T.test{}".format(i)) for i in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_dry_run(self):
+        editor = BulkEditor(self.OPS, lambda item: item, journal=self.journal, dry_run=True)
+        self.assertEqual(editor.run(self.items), 5)
+        self.assertTrue(all(wi.updates == 0 and wi.title.startswith("rhsm") for wi in self.items))
+        self.assertFalse(os.path.exists(self.journal))
+
+    def test_edit_and_resume(self):
+        editor = BulkEditor(self.OPS, lambda item: item, workers=3, rate=1000, journal=self.journal)
+        self.assertEqual(editor.run(self.items[:3]), 3)
+        for wi in self.items[:3]:
+            self.assertEqual((wi.title[:10], wi.author, wi.linked_work_items, wi.updates),
+                             ("RHSM-TC : ", "stoner", [], 1))
+
+        editor = BulkEditor(self.OPS, lambda item: item, journal=self.journal)
+        self.assertEqual(editor.run(self.items), 2)
+        self.assertEqual([wi.updates for wi in self.items], [1] * 5)
+
+    def test_operations_compose(self):
+        ops = [{"op": "retitle", "title": "DeleteMe"},
+               {"op": "prefix", "prefix": "RHSM-TC : "},
+               {"op": "prefix", "prefix": "RHSM-TC : "},
+               {"op": "suffix", "suffix": " (obsolete)"},
+               {"op": "unlink"},
+               {"op": "unlink"}]
+        editor = BulkEditor(ops, lambda item: item, journal=self.journal)
+        wi = self.items[0]
+        changes = editor.plan(wi)
+        self.assertEqual([str(c) for c in changes],
+                         ["title: rhsm.cli.tests.T.test0 -> DeleteMe",
+                          "title: DeleteMe -> RHSM-TC : DeleteMe",
+                          "title: RHSM-TC : DeleteMe -> RHSM-TC : DeleteMe (obsolete)",
+                          "unlink RHEL6-1 (verifies)"])
+        # planning leaves the WorkItem alone
+        self.assertEqual((wi.title, len(wi.linked_work_items)), ("rhsm.cli.tests.T.test0", 1))
+
+        self.assertEqual(editor.run([wi]), 1)
+        self.assertEqual((wi.title, wi.linked_work_items), ("RHSM-TC : DeleteMe (obsolete)", []))
@@ -0,0 +1,110 @@
+import shutil
+import tempfile
+import threading
+import unittest
+from pong.cache import IdentityMap, RunNumbers, TTLStore, run_number
+
+
+class FakeItem(object):
+    def __init__(self, uri):
+        self.uri = uri
+
+
+class TestIdentityMap(unittest.TestCase):
+    def test_fetch_once(self):
+        fetched = []
+
+        def factory(uri):
+            fetched.append(uri)
+            return FakeItem(uri)
+
+        imap = IdentityMap()
+        first = imap.get("uri-1", factory)
+        second = imap.get("uri-1", factory)
+        self.assertIs(first, second)
+        self.assertEqual(fetched, ["uri-1"])
+        self.assertEqual((imap.hits, imap.misses), (1, 1))
+
+    def test_register_keeps_first(self):
+        imap = IdentityMap()
+        orig = imap.register(FakeItem("uri-2"))
+        again = imap.register(FakeItem("uri-2"))
+        self.assertIs(orig, again)
+        self.assertIs(imap.get("uri-2", FakeItem), orig)
+
+
+    def test_concurrent_fetches(self):
+        imap = IdentityMap()
+        fetched = []
+        b_fetched = threading.Event()
+
+        def factory(uri):
+            fetched.append(uri)
+            if uri == "uri-a":
+                # only returns if uri-b can be fetched while uri-a is still being fetched
+                self.assertTrue(b_fetched.wait(5))
+            return FakeItem(uri)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(imap.get("uri-a", factory))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        imap.get("uri-b", factory)
+        b_fetched.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(sorted(fetched), ["uri-a", "uri-b"])
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(r is results[0] for r in results))
+
+    def test_failed_fetch_is_retried(self):
+        imap = IdentityMap()
+
+        def broken(uri):
+            raise IOError("connection reset")
+        self.assertRaises(IOError, imap.get, "uri-3", broken)
+        self.assertEqual(imap.get("uri-3", FakeItem).uri, "uri-3")
+
+
+class TestRunNumbers(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_run_number(self):
+        self.assertEqual(run_number("RHSM Server x86_64 Run 12"), 12)
+        self.assertEqual(run_number("RHSM Server x86_64"), 0)
+
+    def test_next_is_monotonic(self):
+        numbers = RunNumbers(cache_dir=self.tmp)
+        self.assertEqual(numbers.next("RHEL6:RHSM", server_number=4), 5)
+        # The server index has not caught up with run 5 yet
+        self.assertEqual(numbers.next("RHEL6:RHSM", server_number=4), 6)
+        self.assertEqual(numbers.next("RHEL6:RHSM", server_number=10), 11)
+
+    def test_persisted(self):
+        RunNumbers(cache_dir=self.tmp).next("RHEL6:RHSM", server_number=1)
+        self.assertEqual(RunNumbers(cache_dir=self.tmp).next("RHEL6:RHSM"), 3)
+
+
+class TestTTLStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_expiry(self):
+        store = TTLStore("templates.json", 60, cache_dir=self.tmp)
+        store.set("RHEL6:template", {"plannedin": "RHEL_6_8"})
+        self.assertEqual(TTLStore("templates.json", 60, cache_dir=self.tmp).get("RHEL6:template"),
+                         {"plannedin": "RHEL_6_8"})
+        store.data["RHEL6:template"]["stored"] -= 120
+        self.assertIsNone(store.get("RHEL6:template"))
+
+    def test_disabled(self):
+        store = TTLStore("templates.json", 0, cache_dir=self.tmp)
+        store.set("RHEL6:template", {"plannedin": "RHEL_6_8"})
+        self.assertIsNone(store.get("RHEL6:template"))
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import unittest
+from pong.core import CommentBuilder, TestIterationResult
+
+
+def step(status, message=None, stack_trace=""):
+    exception = None if message is None else {"message": message, "stack_trace": stack_trace}
+    return TestIterationResult({"status": status, "duration-ms": "10", "started-at": "2016-02-01T10:00:00Z"},
+                               exception=exception)
+
+
+class TestCommentBuilder(unittest.TestCase):
+    def test_plain(self):
+        builder = CommentBuilder()
+        builder.add(0, step("PASS"))
+        builder.add(1, step("FAIL", "boom", "at Foo.bar"))
+        self.assertEqual(builder.build(), u"0 PASS\t<br>1 FAIL\t<br>boom<br>at Foo.bar<br>")
+
+    def test_repeated_exceptions(self):
+        builder = CommentBuilder()
+        for i in range(100):
+            builder.add(i, step("FAIL", "Can't register", "at Tests.register\n" * 50))
+        comment = builder.build()
+        self.assertEqual(comment.count("at Tests.register"), 50)
+        self.assertEqual(comment.count("same exception as iteration 0"), 99)
+        self.assertTrue(comment.endswith(u"The exception of iteration 0 happened 100 times"))
+
+    def test_limit(self):
+        builder = CommentBuilder(limit=200)
+        for i in range(1000):
+            builder.add(i, step("FAIL" if i % 2 else "PASS", u"błąd {}".format(i)))
+        comment = builder.build()
+        self.assertLessEqual(len(comment), 200)
+        self.assertIn(u"błąd 1", comment)
+        self.assertTrue(comment.endswith(u"(all iterations: FAIL: 500, PASS: 500)"))
+
+    def test_summary_is_limited(self):
+        builder = CommentBuilder(limit=20000)
+        for i in range(5000):
+            builder.add(i, step("FAIL", u"failure {}".format(i % 2500), "at Tests.test"))
+        comment = builder.build()
+        self.assertLessEqual(len(comment), 20000)
+        self.assertTrue(comment.endswith(u"more exceptions happened more than once"))
+        # the summary only cites iterations whose exception is in the comment
+        shown = comment.split(u"<br>... ")[0]
+        for line in comment.split(u"<br>"):
+            if line.startswith(u"The exception of iteration"):
+                self.assertIn(u"failure {}<br>".format(line.split()[4]), shown)
+
+    def test_tags_are_not_cut(self):
+        for limit in range(60, 80):
+            builder = CommentBuilder(limit=limit)
+            for i in range(3):
+                builder.add(i, step("FAIL", u"x" * 20, u"y" * 5))
+            body = builder.build().split(u"<br>... ")[0]
+            self.assertFalse(body.endswith(u"<") or body.endswith(u"<b") or body.endswith(u"<br"), body)
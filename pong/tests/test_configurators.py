@@ -1,3 +1,7 @@
+import os
+import shutil
+import tempfile
+
 import pong.configuration as cfg
 import pyrsistent as pyr
 
@@ -14,3 +18,25 @@ class TestCLIConfigurator(unittest.TestCase):
 
         start_map = pyr.m()
         end_map = self.cfg(start_map)
+
+
+class TestYAMLConfigurator(unittest.TestCase):
+    def test_write_rate_per_project(self):
+        from pong.exporter import write_throttle
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, "exporter.yml")
+            with open(path, "w") as yml:
+                yml.write("project_id: RHEL6\n"
+                          "testrun:\n"
+                          "  prefix: RHSM\n"
+                          "write_rate:\n"
+                          "  RHEL6: 2\n"
+                          "  RHEL7: 0.5\n")
+            record = cfg.YAMLConfigurator(cfg_path=path).record
+            self.assertEqual(record.write_rate, {"RHEL6": 2, "RHEL7": 0.5})
+            self.assertEqual(write_throttle(record, "RHEL7").bucket.rate, 0.5)
+            self.assertIsNone(write_throttle(record, "RHEL8").bucket.rate)
+        finally:
+            shutil.rmtree(tmpdir)
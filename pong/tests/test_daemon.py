@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from pong.cache import WORK_ITEMS
+from pong.daemon import Daemon, SessionMismatch, check_session, request, restored, submit
+
+
+class FakeSuite(object):
+    def __init__(self, created_runs):
+        self.created_runs = created_runs
+
+
+class FakeExport(object):
+    """
+    Stands in for Exporter.export: "-r results.xml" creates a TestRun named after the results file
+    """
+    def __init__(self):
+        self.calls = []
+        self.work_items_seen = []
+
+    def __call__(self, args):
+        self.calls.append(args)
+        self.work_items_seen.append(len(WORK_ITEMS._items))
+        WORK_ITEMS.get("uri-of-a-testcase", lambda uri: object())
+        if "--bad" in args:
+            raise SystemExit(2)
+        if "--boom" in args:
+            raise ValueError("boom")
+        return FakeSuite({"suite": "run-of-" + args[args.index("-r") + 1]})
+
+
+class FakeConfig(dict):
+    def __getattr__(self, name):
+        return self[name]
+
+
+PYLARION = """[webservice]
+url = https://{}/polarion
+user = stoner
+default_project = RHEL6
+"""
+
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def pylarion(self, name, server="polarion.example.com"):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "w") as pylarion:
+            pylarion.write(PYLARION.format(server))
+        return path
+
+    def test_other_sessions_are_rejected(self):
+        session = {}
+        path = self.pylarion(".pylarion")
+        config = FakeConfig(pylarion_path=path, pylarion_user="stoner", project_id="RHEL6")
+        key = check_session(config, session=session)
+        self.assertEqual(key, (path, "https://polarion.example.com/polarion", "stoner", "RHEL6"))
+        self.assertEqual(check_session(FakeConfig(config), session=session), key)
+
+        other_server = self.pylarion(".pylarion-staging", server="staging.example.com")
+        for config in [FakeConfig(pylarion_path=path, pylarion_user="jenkins", project_id="RHEL6"),
+                       FakeConfig(pylarion_path=other_server, pylarion_user="stoner", project_id="RHEL6"),
+                       FakeConfig(pylarion_path=path, pylarion_user="stoner", project_id="RHEL7")]:
+            self.assertRaises(SessionMismatch, check_session, config, session=session)
+
+    def test_pylarion_is_restored(self):
+        path = self.pylarion(".pylarion")
+        with self.assertRaises(ValueError):
+            with restored(path):
+                with open(path, "w") as pylarion:
+                    pylarion.write("[webservice]\ndefault_project = RHEL7\n")
+                raise ValueError("export failed")
+        with open(path) as pylarion:
+            self.assertEqual(pylarion.read(), PYLARION.format("polarion.example.com"))
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.export = FakeExport()
+
+    def test_jobs(self):
+        daemon = Daemon(socket_path=None, export=self.export)
+        try:
+            job = daemon.handle({"cmd": "export", "args": [u"-p", u"RHEL6"], "result_path": u"results.xml"})
+            self.assertEqual(job["status"], "done")
+            self.assertEqual(job["test_runs"], {"suite": "run-of-results.xml"})
+            self.assertEqual(self.export.calls, [["-p", "RHEL6", "-r", "results.xml"]])
+
+            self.assertEqual(daemon.handle({"cmd": "export", "args": ["--bad"]})["error"], "exited with 2")
+            self.assertEqual(daemon.handle({"cmd": "export", "args": ["--boom"]})["error"], "ValueError: boom")
+            # every job starts with an empty identity map
+            self.assertEqual(self.export.work_items_seen, [0, 0, 0])
+
+            self.assertEqual(daemon.handle({"cmd": "status", "id": 1})["status"], "done")
+            self.assertEqual([j["status"] for j in daemon.handle({"cmd": "status"})["jobs"]],
+                             ["done", "failed", "failed"])
+            self.assertTrue("error" in daemon.handle({"cmd": "status", "id": 10}))
+            self.assertTrue("error" in daemon.handle({"cmd": "restart"}))
+        finally:
+            daemon.runner.stop()
+
+    def test_socket(self):
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, "exporter.sock")
+        daemon = Daemon(socket_path=path, export=self.export)
+        daemon.bind()
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        server = threading.Thread(target=daemon.serve_forever)
+        server.start()
+        try:
+            job = submit(["-p", "RHEL6"], result_path="a.xml", socket_path=path)
+            self.assertEqual(job["test_runs"], {"suite": "run-of-a.xml"})
+            self.assertEqual(request({"cmd": "status", "id": job["id"]}, socket_path=path)["status"], "done")
+            # only one daemon per socket
+            self.assertRaises(Exception, Daemon(socket_path=path, export=self.export).bind)
+        finally:
+            request({"cmd": "stop"}, socket_path=path)
+            server.join(10)
+            shutil.rmtree(tmpdir)
+        self.assertFalse(server.is_alive())
+        self.assertFalse(os.path.exists(path))
@@ -0,0 +1,79 @@
+import shutil
+import tempfile
+import unittest
+from pong.fingerprint import FingerprintStore, ExportLedger, ResultsHasher, method_fingerprint
+
+
+class FakeResult(object):
+    def __init__(self, params):
+        self.params = params
+
+
+class FakeTestCase(object):
+    work_item_id = "RHEL6-1234"
+
+
+class FakeTest(object):
+    def __init__(self, status="PASS", params=None):
+        self.class_method = "rhsm.cli.tests.RegisterTests.testRegister"
+        self.status = status
+        self.step_results = [FakeResult(p) for p in (params or [])]
+        self.params = []
+        self.requirement = "RHEL6-1"
+        self.polarion_tc = FakeTestCase()
+
+
+class TestFingerprintStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_params_change_fingerprint(self):
+        one = method_fingerprint(FakeTest(params=[["a"], ["b"]]))
+        self.assertEqual(one, method_fingerprint(FakeTest(params=[["a"], ["b"]])))
+        self.assertNotEqual(one, method_fingerprint(FakeTest(params=[["a"], ["c"]])))
+
+    def test_unchanged(self):
+        store = FingerprintStore(cache_dir=self.tmp)
+        store.record("RHEL6", "Tier1", FakeTest())
+        self.assertFalse(store.unchanged("RHEL6", "Tier1", FakeTest()))
+        store.commit()
+
+        store = FingerprintStore(cache_dir=self.tmp)
+        self.assertTrue(store.unchanged("RHEL6", "Tier1", FakeTest()))
+        self.assertFalse(store.unchanged("RHEL6", "Tier1", FakeTest(status="FAIL")))
+        self.assertFalse(store.unchanged("RHEL6", "Tier2", FakeTest()))
+
+
+class TestExportLedger(unittest.TestCase):
+    ATTRS = {"name": "testRegister", "status": "PASS", "started-at": "2016-02-16T20:13:50Z",
+             "duration-ms": "120"}
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def hash_results(self, **changes):
+        attrs = dict(self.ATTRS, **changes)
+        hasher = ResultsHasher()
+        hasher.add_suite("Tier1")
+        hasher.add_method("rhsm.cli.tests.RegisterTests", attrs, ["a", "b"])
+        return hasher.hexdigest()
+
+    def test_results_hash(self):
+        self.assertEqual(self.hash_results(), self.hash_results(**{"duration-ms": "300"}))
+        self.assertNotEqual(self.hash_results(), self.hash_results(status="FAIL"))
+        self.assertNotEqual(self.hash_results(), self.hash_results(**{"started-at": "2016-02-17T20:13:50Z"}))
+
+    def test_runs(self):
+        key = ExportLedger.export_key(self.hash_results(), "RHEL6", "RHSM")
+        self.assertNotEqual(key, ExportLedger.export_key(self.hash_results(), "RedHatEnterpriseLinux7", "RHSM"))
+
+        ExportLedger(cache_dir=self.tmp).add_run(key, "Tier1", "RHSM Tier1 Run 3")
+        ledger = ExportLedger(cache_dir=self.tmp)
+        self.assertEqual(ledger.runs(key), {"Tier1": "RHSM Tier1 Run 3"})
+        self.assertEqual(ledger.runs("unknown"), {})
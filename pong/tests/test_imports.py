@@ -0,0 +1,40 @@
+import subprocess
+import sys
+import unittest
+
+import pong.exporter
+from pong.scripts.import_time import time_import, median, DEFAULT_THRESHOLD
+
+LOADED = "import sys, {}; print(' '.join(sorted(sys.modules)))"
+
+
+class TestImports(unittest.TestCase):
+    def test_exporter_defers_configuration(self):
+        out = subprocess.check_output([sys.executable, "-c", LOADED.format("pong.exporter")])
+        loaded = set(out.split())
+        for module in ["pong.configuration", "pyrsistent", "pong.parsing", "yaml", "pylarion"]:
+            self.assertFalse(module in loaded, "{} was imported".format(module))
+
+    def test_exporter_import_time(self):
+        self.assertLess(median([time_import("pong.exporter") for _ in range(3)]), DEFAULT_THRESHOLD)
+
+
+class TestQueryOnly(unittest.TestCase):
+    def setUp(self):
+        self.ran = []
+        self.saved = pong.exporter.run_query_actions, pong.exporter.install_session_caches
+        pong.exporter.run_query_actions = lambda args, config=None: self.ran.append(args) or True
+        pong.exporter.install_session_caches = lambda config: None
+
+    def tearDown(self):
+        pong.exporter.run_query_actions, pong.exporter.install_session_caches = self.saved
+
+    def test_query_only(self):
+        self.assertTrue(pong.exporter.query_only(["--query-testcase", "title:RHSM-TC"]))
+        self.assertEqual(self.ran[0].query_testcase, "title:RHSM-TC")
+
+    def test_needs_the_pipeline(self):
+        self.assertFalse(pong.exporter.query_only([]))
+        self.assertFalse(pong.exporter.query_only(["-r", "testng-results.xml", "--query-testcase", "x"]))
+        self.assertFalse(pong.exporter.query_only(["-h"]))
+        self.assertEqual(self.ran, [])
@@ -0,0 +1,37 @@
+import unittest
+from pong.index import TitleIndex, WorkItemRef
+
+
+class FakeWorkItem(object):
+    def __init__(self, work_item_id, title):
+        self.work_item_id = work_item_id
+        self.uri = "subterra:data-service:objects:/default/RHEL6${WorkItem}" + work_item_id
+        self.title = title
+
+
+class TestTitleIndex(unittest.TestCase):
+    def test_dedup_and_lookup(self):
+        index = TitleIndex(prefix="RHSM-TC : ")
+        first = [FakeWorkItem("RHEL6-1", u"RHSM-TC : rhsm.cli.tests.RegisterTests.testRegister"),
+                 FakeWorkItem("RHEL6-2", u"RHSM-TC : rhsm.cli.tests.RegisterTests.testUnregister")]
+        second = [FakeWorkItem("RHEL6-2", u"RHSM-TC : rhsm.cli.tests.RegisterTests.testUnregister"),
+                  FakeWorkItem("RHEL6-3", u"rhsm.cli.tests.RegisterTests.testRegister")]
+        self.assertEqual(index.extend(first), 2)
+        self.assertEqual(index.extend(second), 1)
+        self.assertEqual(len(index), 3)
+
+        matches = index.lookup("rhsm.cli.tests.RegisterTests.testRegister")
+        self.assertEqual([m.work_item_id for m in matches], ["RHEL6-1", "RHEL6-3"])
+        self.assertEqual(index.lookup("rhsm.cli.tests.RegisterTests.testRegister2"), [])
+        self.assertTrue("RHEL6-2" in index)
+        self.assertEqual([wi.work_item_id for wi in index], ["RHEL6-1", "RHEL6-2", "RHEL6-3"])
+
+    def test_only_refs_are_kept(self):
+        index = TitleIndex()
+        wi = FakeWorkItem("RHEL6-1", u"rhsm.cli.tests.RegisterTests.testRegister")
+        wi.description = u"x" * 10000
+        index.add(wi)
+        ref = index.lookup("rhsm.cli.tests.RegisterTests.testRegister")[0]
+        self.assertIsInstance(ref, WorkItemRef)
+        self.assertEqual((ref.work_item_id, ref.uri), (wi.work_item_id, wi.uri))
+        self.assertFalse(hasattr(ref, "__dict__"))
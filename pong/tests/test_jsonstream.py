@@ -0,0 +1,35 @@
+import json
+import unittest
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+from pong.scripts.jsonstream import iter_json_array, JsonArrayWriter, JsonObjectWriter
+
+
+class TestJsonStream(unittest.TestCase):
+    ITEMS = [{"className": "rhsm.cli.tests.RegisterTests", "methodName": "testRegister", "enabled": True},
+             12345, "a string with ] and , in it", [1, [2, 3]], None]
+
+    def test_iter_small_chunks(self):
+        text = json.dumps(self.ITEMS, indent=2)
+        for chunk_size in [1, 2, 7, 1024]:
+            self.assertEqual(list(iter_json_array(StringIO(text), chunk_size=chunk_size)), self.ITEMS)
+
+    def test_empty_and_invalid(self):
+        self.assertEqual(list(iter_json_array(StringIO(" [ ] "))), [])
+        self.assertRaises(ValueError, list, iter_json_array(StringIO('{"a": 1}')))
+        self.assertRaises(ValueError, list, iter_json_array(StringIO('[1, 2')))
+
+    def test_writers(self):
+        out = StringIO()
+        with JsonArrayWriter(out) as writer:
+            for item in self.ITEMS:
+                writer.write(item)
+        self.assertEqual(json.loads(out.getvalue()), self.ITEMS)
+
+        out = StringIO()
+        with JsonObjectWriter(out, sort_keys=True) as writer:
+            writer.write("a", {"b": 1})
+            writer.write("c", [2])
+        self.assertEqual(json.loads(out.getvalue()), {"a": {"b": 1}, "c": [2]})
@@ -0,0 +1,65 @@
+import logging
+import unittest
+from pong.logger import enable_async, disable_async, RateLimitedLog
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, self.format(record)))
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAsyncLog(unittest.TestCase):
+    def setUp(self):
+        self.handler = ListHandler()
+        self.logr = logging.getLogger("pong.tests.async")
+        self.logr.setLevel(logging.DEBUG)
+        self.logr.propagate = False
+        self.logr.addHandler(self.handler)
+
+    def tearDown(self):
+        disable_async(self.logr)
+        self.logr.removeHandler(self.handler)
+
+    def test_records_are_written_in_order(self):
+        enable_async(self.logr)
+        for i in range(100):
+            self.logr.info("line %d", i)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            self.logr.exception("failed")
+        disable_async(self.logr)
+
+        self.assertEqual([msg for _, msg in self.handler.records[:100]], ["line {}".format(i) for i in range(100)])
+        self.assertIn("ValueError: boom", self.handler.records[100][1])
+        self.assertEqual(self.logr.handlers, [self.handler])
+
+    def test_args_are_rendered_when_logged(self):
+        enable_async(self.logr)
+        state = {"status": "running"}
+        self.logr.info("state is %s", state)
+        state["status"] = "finished"
+        disable_async(self.logr)
+        self.assertEqual(self.handler.records[0][1], "state is {'status': 'running'}")
+
+    def test_rate_limited(self):
+        clock = FakeClock()
+        limited = RateLimitedLog(self.logr, interval=1.0, clock=clock)
+        for i in range(5):
+            limited.info("iteration %d", i)
+            clock.now += 0.3
+        levels = [lvl for lvl, _ in self.handler.records]
+        self.assertEqual(levels, [logging.INFO, logging.DEBUG, logging.DEBUG, logging.DEBUG, logging.INFO])
+        self.assertEqual(self.handler.records[-1][1], "iteration 4 (3 similar messages at DEBUG)")
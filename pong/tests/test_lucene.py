@@ -0,0 +1,52 @@
+import unittest
+
+from pong.lucene import LuceneIndex, UnsupportedQuery, parse, analyze
+
+URI = "subterra:data-service:objects:/default/RHEL6${WorkItem}"
+ROWS = [("RHEL6-1", "testcase", u"RHSM-TC : rhsm.cli.tests.RegisterTests.testRegister", URI + "RHEL6-1", u"ci-user"),
+        ("RHEL6-2", "testcase", u"RHSM-TC : rhsm.gui.tests.RegisterTests.testUnregister", URI + "RHEL6-2", u"stoner"),
+        ("RHEL6-3", "testcase", u"rhsm.cli.tests.FactsTests.testFacts", URI + "RHEL6-3", u"stoner"),
+        ("RHEL6-8", "requirement", u"RHSM-REQ : rhsm.cli.tests.RegisterTests", URI + "RHEL6-8", u"ci-user"),
+        ("RHEL6-9", "requirement", u"RHSM-REQ : rhsm.cli.tests.FactsTests", URI + "RHEL6-9", u"jdoe")]
+
+
+class TestLucene(unittest.TestCase):
+    def setUp(self):
+        self.index = LuceneIndex("RHEL6", ROWS)
+
+    def ids(self, query, wi_type=None):
+        return [ref.work_item_id for ref in self.index.search(query, wi_type=wi_type)]
+
+    def test_analyze(self):
+        self.assertEqual(analyze(u"RHSM-TC : rhsm.cli.tests.RegisterTests.testRegister"),
+                         [u"rhsm", u"tc", u"rhsm.cli.tests.registertests.testregister"])
+
+    def test_readme_queries(self):
+        self.assertEqual(self.ids("title:RHSM-TC AND title:rhsm.*.tests*"), ["RHEL6-1", "RHEL6-2"])
+        self.assertEqual(self.ids("title:RHSM-REQ AND (author.id:ci\\-user OR author.id:stoner)"), ["RHEL6-8"])
+        self.assertEqual(self.ids("title:RHSM-TC AND type:testcase"), ["RHEL6-1", "RHEL6-2"])
+
+    def test_phrases_and_groups(self):
+        query = 'title:("RHSM-TC : rhsm.cli.tests.RegisterTests.testRegister" OR ' \
+                '"rhsm.cli.tests.FactsTests.testFacts")'
+        self.assertEqual(self.ids(query), ["RHEL6-1", "RHEL6-3"])
+        # the words of a phrase have to be next to each other
+        self.assertEqual(self.ids('title:"tc rhsm"'), [])
+        self.assertEqual(self.ids('title:"rhsm tc"'), ["RHEL6-1", "RHEL6-2"])
+        self.assertEqual(self.ids("id:(RHEL6-1 RHEL6-9)"), ["RHEL6-1", "RHEL6-9"])
+
+    def test_wildcards_and_types(self):
+        self.assertEqual(self.ids("title:rhsm.cli.tests.*Test?"), ["RHEL6-8", "RHEL6-9"])
+        self.assertEqual(self.ids("title:rhsm.cli.tests*", wi_type="testcase"), ["RHEL6-1", "RHEL6-3"])
+        self.assertEqual(self.ids("author.id:sto* AND project.id:RHEL6"), ["RHEL6-2", "RHEL6-3"])
+        self.assertEqual(self.ids("type:requirement OR id:RHEL6-3"), ["RHEL6-3", "RHEL6-8", "RHEL6-9"])
+
+    def test_unsupported(self):
+        for query in ["NOT title:foo", "-title:foo", "title:foo^2", "updated:[20160101 TO *]", "foo",
+                      'title:"RHSM : RCT Tool"*', "status:draft", "title:(foo", "project.id:OTHER"]:
+            self.assertRaises(UnsupportedQuery, self.index.search, query)
+
+    def test_and_binds_tighter(self):
+        self.assertEqual(parse("type:a OR type:b AND type:c"),
+                         ("or", [("term", "type", "word", "a"),
+                                 ("and", [("term", "type", "word", "b"), ("term", "type", "word", "c")])]))
@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import pong.scripts.mapping as mapping
+from pong.scripts.mapping_store import MappingStore
+
+
+class TestMappingStore(unittest.TestCase):
+    NAME = "rhsm.cli.tests.RegisterTests.testRegister"
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = MappingStore(os.path.join(self.tmp, "map.sqlite"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp)
+
+    def test_upsert_and_lookup(self):
+        self.store.upsert(self.NAME, "RHEL6-100", ["RHEL6-2", "RHEL6-1"], "2016-02-16")
+        self.assertEqual(self.store.lookup(self.NAME),
+                         [{"testcase": "RHEL6-100", "requirements": ["RHEL6-1", "RHEL6-2"]}])
+
+        # An update replaces the linked requirements
+        self.store.upsert(self.NAME, "RHEL6-100", ["RHEL6-3"], "2016-02-17")
+        self.assertEqual(self.store.dump(), [{self.NAME: {"testcase": "RHEL6-100", "requirements": ["RHEL6-3"]}}])
+
+        self.store.remove("RHEL6-100")
+        self.assertEqual(self.store.lookup(self.NAME), [])
+
+    def test_meta(self):
+        self.assertIsNone(self.store.get_meta("last_refresh"))
+        self.store.set_meta("last_refresh", "20160216")
+        self.assertEqual(self.store.get_meta("last_refresh"), "20160216")
+
+
+class FakeTestCase(object):
+    def __init__(self, work_item_id, title):
+        self.work_item_id = work_item_id
+        self.title = title
+        self.linked_work_items = []
+        self.updated = "2016-03-01"
+
+
+class TestMapping(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = MappingStore(os.path.join(self.tmp, "map.sqlite"))
+        self.query_test_case = mapping.query_test_case
+        self.queries = []
+        tcs = [FakeTestCase("RHEL6-100", "RHSM-TC : rhsm.cli.tests.RegisterTests.testRegister")]
+        mapping.query_test_case = lambda query, fields=None: self.queries.append(query) or tcs
+
+    def tearDown(self):
+        mapping.query_test_case = self.query_test_case
+        self.store.close()
+        shutil.rmtree(self.tmp)
+
+    def test_refresh_refetches_the_day_before(self):
+        self.store.set_meta("last_refresh", "20160301")
+        mapping.refresh(self.store)
+        self.assertEqual(self.queries, [mapping.TC_QUERY + " AND updated:[20160229 TO *]"])
+        self.assertEqual(self.store.lookup(TestMappingStore.NAME)[0]["testcase"], "RHEL6-100")
+
+    def test_reflected_is_sorted(self):
+        names = ["testUnregister", "testRegister", "testAutosubscribe"]
+        reflected = [{"className": "rhsm.cli.tests.RegisterTests", "methodName": name, "enabled": False}
+                     for name in names]
+        cwd = os.getcwd()
+        os.chdir(self.tmp)
+        try:
+            mapping.write_maps(self.store, mapping.index_reflected(reflected))
+            with open("reflected.json") as refl:
+                written = json.load(refl)
+        finally:
+            os.chdir(cwd)
+        self.assertEqual([m["methodName"] for m in written["rhsm.cli.tests.RegisterTests"]], sorted(names))
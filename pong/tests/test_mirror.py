@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from pong.mirror import Mirror, TESTCASE, REQUIREMENT, DATE_FORMAT, day_before
+
+
+class FakeLink(object):
+    def __init__(self, work_item_id):
+        self.work_item_id = work_item_id
+
+
+class FakeUser(object):
+    """
+    What pylarion gives as the author of a WorkItem
+    """
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.name = "CI User"
+
+
+class FakeWorkItem(object):
+    def __init__(self, work_item_id, title, linked=()):
+        self.work_item_id = work_item_id
+        self.uri = "subterra:data-service:objects:/default/RHEL6${WorkItem}" + work_item_id
+        self.title = title
+        self.author = FakeUser(u"ci-user")
+        self.linked_work_items = [FakeLink(li) for li in linked]
+
+
+class FakePolarion(object):
+    """
+    Answers the mirror's queries from a dict of type -> WorkItems, and remembers the queries
+    """
+    def __init__(self, items):
+        self.items = items
+        self.queries = []
+
+    def __call__(self, wi_type, query):
+        self.queries.append(query)
+        items = self.items.get(wi_type, [])
+        return [items[:1], items[1:]]
+
+
+class TestMirror(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.mirror = Mirror("RHEL6", path=os.path.join(self.tmpdir, "mirror.sqlite"))
+        self.polarion = FakePolarion({
+            TESTCASE: [FakeWorkItem("RHEL6-1", u"RHSM-TC : rhsm.cli.tests.RegisterTests.testRegister", ["RHEL6-9"]),
+                       FakeWorkItem("RHEL6-2", u"RHSM-TC : rhsm.cli.tests.RegisterTests.testUnregister")],
+            REQUIREMENT: [FakeWorkItem("RHEL6-9", u"RHSM-REQ : rhsm.cli.tests.RegisterTests")]})
+
+    def tearDown(self):
+        self.mirror.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_first_sync_is_full(self):
+        self.assertEqual(self.mirror.sync(fetch=self.polarion), 3)
+        self.assertEqual(self.polarion.queries, ["project.id:RHEL6 AND type:testcase",
+                                                 "project.id:RHEL6 AND type:requirement"])
+        self.assertEqual(len(self.mirror), 3)
+        self.assertEqual(self.mirror.get("RHEL6-1")["linked"], ["RHEL6-9"])
+        self.assertEqual([wi.work_item_id for wi in self.mirror.work_items(TESTCASE)], ["RHEL6-1", "RHEL6-2"])
+
+    def test_delta_sync_keeps_steps(self):
+        self.mirror.sync(fetch=self.polarion)
+        self.mirror.record(TESTCASE, self.polarion.items[TESTCASE][0], steps=1)
+
+        changed = FakeWorkItem("RHEL6-1", u"RHSM-TC : rhsm.cli.tests.RegisterTests.testRegisterAgain")
+        delta = FakePolarion({TESTCASE: [changed]})
+        self.assertEqual(self.mirror.sync(fetch=delta), 1)
+        # the server may already be a day ahead of us, so the day before the last sync is fetched again too
+        yesterday = time.strftime(DATE_FORMAT, time.localtime(time.time() - 86400))
+        self.assertEqual(delta.queries[0],
+                         "project.id:RHEL6 AND type:testcase AND updated:[{} TO *]".format(yesterday))
+
+        item = self.mirror.get("RHEL6-1")
+        self.assertEqual(item["title"], changed.title)
+        self.assertEqual(item["steps"], 1)
+        # nothing is dropped by a delta sync
+        self.assertEqual(len(self.mirror), 3)
+
+    def test_full_sync_drops_deleted(self):
+        self.mirror.sync(fetch=self.polarion)
+        del self.polarion.items[TESTCASE][1]
+        self.mirror.sync(full=True, fetch=self.polarion)
+        self.assertIsNone(self.mirror.get("RHEL6-2"))
+        self.assertEqual(len(self.mirror), 2)
+
+    def test_old_full_sync_is_redone(self):
+        self.mirror.sync(fetch=self.polarion)
+        self.mirror.set_meta("last_full_sync", "20000101")
+        self.mirror.sync(fetch=self.polarion)
+        self.assertFalse(any("updated:" in q for q in self.polarion.queries))
+
+    def test_day_before(self):
+        self.assertEqual(day_before("20160301"), "20160229")
+
+    def test_concurrent_reads_and_writes(self):
+        self.mirror.sync(fetch=self.polarion)
+        errors = []
+
+        def write():
+            for i in range(200):
+                self.mirror.record(TESTCASE, FakeWorkItem("RHEL6-1{}".format(i), u"RHSM-TC : t{}".format(i)))
+
+        def read():
+            try:
+                for i in range(200):
+                    self.mirror.work_items(TESTCASE)
+                    self.mirror.get("RHEL6-1")
+                    len(self.mirror)
+            except Exception as ex:
+                errors.append(ex)
+        threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.mirror), 203)
+
+    def test_author_is_the_user_id(self):
+        self.mirror.sync(fetch=self.polarion)
+        self.assertEqual(self.mirror.get("RHEL6-1")["author"], "ci-user")
+        found = self.mirror.search("author.id:ci\\-user", wi_type=TESTCASE)
+        self.assertEqual([wi.work_item_id for wi in found], ["RHEL6-1", "RHEL6-2"])
+
+    def test_old_rows_are_fully_synced(self):
+        self.mirror.sync(fetch=self.polarion)
+        self.mirror.set_meta("row_format", "1")
+        self.mirror.sync(fetch=self.polarion)
+        self.assertFalse(any("updated:" in q for q in self.polarion.queries))
+
+    def test_title_lookups(self):
+        self.mirror.sync(fetch=self.polarion)
+        by_title = self.mirror.by_title(TESTCASE, u"RHSM-TC : rhsm.cli.tests.RegisterTests.testRegister")
+        self.assertEqual([wi.work_item_id for wi in by_title], ["RHEL6-1"])
+        contains = self.mirror.title_contains(TESTCASE, u"RegisterTests.test")
+        self.assertEqual([wi.work_item_id for wi in contains], ["RHEL6-1", "RHEL6-2"])
+        self.assertEqual(self.mirror.title_contains(REQUIREMENT, u"UnregisterTests"), [])
+
+    def test_query_falls_back_to_polarion(self):
+        self.mirror.sync(fetch=self.polarion)
+        asked = []
+        fallback = lambda q: asked.append(q) or []
+        found = self.mirror.query(TESTCASE, "title:RHSM-TC AND title:rhsm.*.tests*", fallback)
+        self.assertEqual([wi.work_item_id for wi in found], ["RHEL6-1", "RHEL6-2"])
+        self.assertEqual(asked, [])
+        self.mirror.query(TESTCASE, "title:RHSM-TC AND NOT status:draft", fallback)
+        self.assertEqual(asked, ["title:RHSM-TC AND NOT status:draft"])
+
+        # the index follows the writes to the mirror
+        self.mirror.record(TESTCASE, FakeWorkItem("RHEL6-4", u"RHSM-TC : rhsm.cli.tests.FactsTests.testFacts"))
+        found = self.mirror.search("title:rhsm.cli.tests.facts*", wi_type=TESTCASE)
+        self.assertEqual([wi.work_item_id for wi in found], ["RHEL6-4"])
@@ -0,0 +1,90 @@
+import threading
+import unittest
+from pong.utils import iter_pages, work_item_id_from_uri, query_work_item_uris
+from pong.index import TitleIndex
+
+
+class FakeWorkItem(object):
+    def __init__(self, work_item_id):
+        self.work_item_id = work_item_id
+        self.uri = "subterra:data-service:objects:/default/RHEL6${WorkItem}" + work_item_id
+        self.title = "rhsm.cli.tests.T.test" + work_item_id
+
+
+class FakeService(object):
+    def __init__(self):
+        self.queries = []
+
+    def queryWorkItemUris(self, query, sort, limit):
+        self.queries.append(query)
+        return []
+
+
+class FakeTestCase(object):
+    """
+    Just what query_work_item_uris needs of a pylarion WorkItem class
+    """
+    default_project = "RHEL6"
+    _wi_type = "testcase"
+
+    class session(object):
+        class tracker_client(object):
+            service = FakeService()
+
+
+class TestIterPages(unittest.TestCase):
+    IDS = ["RHEL6-{}".format(i) for i in range(23)]
+
+    def test_pages(self):
+        for prefetch in (True, False):
+            fetched = []
+
+            def fetch(chunk):
+                fetched.append(len(chunk))
+                return [FakeWorkItem(i) for i in chunk]
+            pages = list(iter_pages(self.IDS, fetch, page_size=10, prefetch=prefetch))
+            self.assertEqual([len(p) for p in pages], [10, 10, 3])
+            self.assertEqual(fetched, [10, 10, 3])
+
+    def test_error_is_raised(self):
+        def fetch(chunk):
+            if chunk[0] == "RHEL6-10":
+                raise ValueError("bad page")
+            return chunk
+        pages = iter_pages(self.IDS, fetch, page_size=10)
+        self.assertEqual(next(pages), self.IDS[:10])
+        self.assertRaises(ValueError, next, pages)
+
+    def test_stop_early(self):
+        pages = iter_pages(self.IDS, lambda chunk: chunk, page_size=5)
+        self.assertEqual(next(pages), self.IDS[:5])
+        pages.close()
+        self.assertEqual([t for t in threading.enumerate() if t.name == "PagePrefetch"], [])
+
+    def test_uri_query_is_scoped(self):
+        query_work_item_uris("title:foo OR title:bar", wi_class=FakeTestCase)
+        self.assertEqual(FakeTestCase.session.tracker_client.service.queries,
+                         ["(title:foo OR title:bar) AND project.id:RHEL6 AND type:testcase"])
+
+    def test_id_from_uri(self):
+        uri = "subterra:data-service:objects:/default/RHEL6${WorkItem}RHEL6-1234"
+        self.assertEqual(work_item_id_from_uri(uri), "RHEL6-1234")
+
+
+class TestLoadingIndex(unittest.TestCase):
+    def test_lookup_waits_for_loading(self):
+        index = TitleIndex()
+        index.start_loading()
+        index.add(FakeWorkItem("RHEL6-1"))
+        self.assertEqual(len(index.lookup("rhsm.cli.tests.T.testRHEL6-1")), 1)
+
+        loader = threading.Timer(0.2, lambda: (index.add(FakeWorkItem("RHEL6-2")), index.finish_loading()))
+        loader.start()
+        self.assertEqual(len(index.lookup("rhsm.cli.tests.T.testRHEL6-2")), 1)
+        self.assertEqual(index.lookup("rhsm.cli.tests.T.testMissing"), [])
+
+    def test_loading_error(self):
+        index = TitleIndex()
+        index.start_loading()
+        index.finish_loading(error=IOError("query failed"))
+        self.assertRaises(IOError, index.lookup, "anything")
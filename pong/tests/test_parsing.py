@@ -0,0 +1,164 @@
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+import pong.parsing
+from pong.cache import WORK_ITEMS
+from pong.index import TitleIndex
+from pong.mirror import Mirror, REQUIREMENT
+from pong.parsing import Transformer, targeted_title_queries
+
+RESULTS = """<?xml version="1.0" encoding="UTF-8"?>
+<testng-results>
+  <suite name="Tier1">
+    <test name="Register">
+      <class name="rhsm.cli.tests.RegisterTests">
+        <test-method status="PASS" name="setup" is-config="true"/>
+        <test-method status="PASS" name="testRegister"/>
+        <test-method status="FAIL" name="testRegister"/>
+        <test-method status="PASS" name="testUnregister"/>
+      </class>
+    </test>
+  </suite>
+</testng-results>
+"""
+
+
+class FakeConfig(dict):
+    def __getattr__(self, name):
+        return self[name]
+
+
+class FakeWorkItem(object):
+    def __init__(self, work_item_id, title):
+        self.work_item_id = work_item_id
+        self.title = title
+        self.uri = "subterra:data-service:objects:/default/RHEL6${WorkItem}" + work_item_id
+
+
+def write_results(tmp):
+    path = os.path.join(tmp, "testng-results.xml")
+    with open(path, "w") as results:
+        results.write(RESULTS)
+    return path
+
+
+class TestTargetedQueries(unittest.TestCase):
+    def test_chunks(self):
+        titles = ["RHSM-TC : t{}".format(i) for i in range(5)] + ['odd "title"']
+        queries = targeted_title_queries(titles, chunk_size=4)
+        self.assertEqual(queries, ['title:("RHSM-TC : t0" OR "RHSM-TC : t1" OR "RHSM-TC : t2" OR "RHSM-TC : t3")',
+                                   'title:("RHSM-TC : t4" OR "odd \\"title\\"")'])
+
+    def test_result_titles(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            transformer = Transformer.__new__(Transformer)
+            transformer.config = FakeConfig(testcase_prefix="RHSM-TC : ")
+            transformer.result_path = write_results(tmp)
+            transformer._results_root = None
+            self.assertEqual(transformer.result_titles(),
+                             ["RHSM-TC : rhsm.cli.tests.RegisterTests.testRegister",
+                              "RHSM-TC : rhsm.cli.tests.RegisterTests.testUnregister"])
+        finally:
+            shutil.rmtree(tmp)
+
+
+class TestPreload(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.patched = {"iter_test_cases": pong.parsing.iter_test_cases,
+                        "iter_requirements": pong.parsing.iter_requirements}
+        self.tcs = [FakeWorkItem("RHEL6-1", "RHSM-TC : rhsm.cli.tests.RegisterTests.testRegister"),
+                    FakeWorkItem("RHEL6-2", "RHSM-TC : rhsm.cli.tests.OtherTests.testOther"),
+                    FakeWorkItem("RHEL6-3", "RHSM-TC : rhsm.cli.tests.RegisterTests.testUnregister")]
+        self.reqs = [FakeWorkItem("RHEL6-10", "Register"), FakeWorkItem("RHEL6-11", "Other"),
+                     FakeWorkItem("RHEL6-10", "Register")]
+        pages = lambda items, page_size: [items[i:i + page_size] for i in range(0, len(items), page_size)]
+        pong.parsing.iter_test_cases = lambda query, page_size, full: pages(self.tcs, page_size)
+        pong.parsing.iter_requirements = lambda query, page_size: pages(self.reqs, page_size)
+        WORK_ITEMS.clear()
+
+    def tearDown(self):
+        for name, func in self.patched.items():
+            setattr(pong.parsing, name, func)
+        WORK_ITEMS.clear()
+        shutil.rmtree(self.tmp)
+
+    def transformer(self, full):
+        transformer = Transformer.__new__(Transformer)
+        transformer.config = FakeConfig(testcase_prefix="RHSM-TC : ", preload_full_fields=full, query_page_size=2,
+                                        targeted_query=False, requirements_query="type:requirement")
+        transformer.result_path = write_results(self.tmp)
+        transformer._results_root = None
+        transformer._preloader = None
+        transformer._existing_requirements = None
+        transformer.quick_query = True
+        transformer.mirror = None
+        transformer.testcases_query = ["title:rhsm*"]
+        transformer.existing_test_cases = TitleIndex(prefix="RHSM-TC : ")
+        transformer.preload()
+        transformer.existing_test_cases.wait()
+        return transformer
+
+    def test_only_matches_are_registered(self):
+        transformer = self.transformer(full=True)
+        self.assertEqual(len(transformer.existing_test_cases), 3)
+        self.assertEqual(sorted(tc.uri for tc in self.tcs if tc.uri in WORK_ITEMS),
+                         [self.tcs[0].uri, self.tcs[2].uri])
+
+    def test_nothing_is_registered_without_full_fields(self):
+        self.transformer(full=False)
+        self.assertEqual(len(WORK_ITEMS), 0)
+
+    def test_requirements_are_paged(self):
+        transformer = self.transformer(full=False)
+        self.assertEqual([req.work_item_id for req in transformer.existing_requirements], ["RHEL6-10", "RHEL6-11"])
+
+
+REQUIREMENTS = """<?xml version="1.0" encoding="UTF-8"?>
+<testng-results>
+  <suite name="Tier1">
+    <test name="Register"/>
+    <test name="Facts"/>
+  </suite>
+</testng-results>
+"""
+
+
+class TestParseRequirements(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.create_requirement = pong.parsing.preq.create_requirement
+        self.mirror = Mirror("RHEL6", path=os.path.join(self.tmp, "mirror.sqlite"))
+        self.mirror.record(REQUIREMENT, FakeWorkItem("RHEL6-10", "RHSM-REQ : Register"))
+        self.transformer = Transformer.__new__(Transformer)
+        self.transformer.config = FakeConfig(requirement_prefix="RHSM-REQ : ", testcase_prefix="RHSM-TC : ")
+        self.transformer.project_id = "RHEL6"
+        self.transformer.quick_query = False
+        self.transformer.mirror = self.mirror
+        self.transformer.existing_test_cases = TitleIndex(prefix="RHSM-TC : ")
+        self.suite = ET.fromstring(REQUIREMENTS).find("suite")
+
+    def tearDown(self):
+        pong.parsing.preq.create_requirement = self.create_requirement
+        self.mirror.close()
+        shutil.rmtree(self.tmp)
+
+    def test_no_requirement_created(self):
+        self.assertEqual(self.transformer.parse_requirements(self.suite), [])
+        self.assertEqual([r.work_item_id for r in self.mirror.work_items(REQUIREMENT)], ["RHEL6-10"])
+
+    def test_created_requirement_is_mirrored(self):
+        created = []
+
+        def create_requirement(project_id, title):
+            created.append(title)
+            return FakeWorkItem("RHEL6-11", title)
+        pong.parsing.preq.create_requirement = create_requirement
+        self.transformer.parse_requirements(self.suite)
+        self.assertEqual(created, ["RHSM-REQ : Facts"])
+        self.assertEqual([r.work_item_id for r in self.mirror.by_title(REQUIREMENT, "RHSM-REQ : Facts")],
+                         ["RHEL6-11"])
@@ -0,0 +1,163 @@
+import threading
+import unittest
+
+from pong.exporter import Exporter, TemplateInfo
+
+
+class FakeTestNG(object):
+    def __init__(self, title, error=None):
+        self.title = title
+        self.error = error
+        self.failed = threading.Event()
+        self.recorded = False
+
+    def create_test_record(self, test_run, run_by=None, comment_limit=None, throttle=None):
+        if self.error is not None:
+            self.failed.set()
+            raise self.error
+        self.recorded = True
+
+
+class FakeExporter(Exporter):
+    """
+    Just the parts of the pipelined export that decide what happens on errors
+    """
+    comment_limit = None
+    throttle = None
+
+    def __init__(self, tests, sync_error=None):
+        self.tests = {"suite": tests}
+        self.sync_error = sync_error
+        self.finished = []
+
+    def parse(self):
+        return self.tests
+
+    def not_skipped(self, tests):
+        return tests
+
+    def get_runner(self, runner):
+        return "stoner"
+
+    def get_template_info(self, temp_id):
+        return TemplateInfo("uri", "plannedin", "stoner")
+
+    def allocate_test_run_ids(self, suite_names, test_run_base=None):
+        return {s: "run-of-" + s for s in suite_names}
+
+    def start_test_run(self, template_id, tr_temp, new_id):
+        return object()
+
+    def record_run(self, suite_name, test_run_id):
+        pass
+
+    def for_each_suite(self, fn, suite_names):
+        return [fn(s) for s in suite_names]
+
+    def sync_test_cases(self, tests, on_synced=None, suite_name=None):
+        for test in tests:
+            on_synced(test)
+            # let the submitter get to the failing TestRecord before the next TestCase is done
+            test.failed.wait(0.5 if test.error else 0)
+        if self.sync_error is not None:
+            raise self.sync_error
+        return tests
+
+    def finish_test_run(self, test_run, new_id):
+        self.finished.append(new_id)
+
+
+class TestPipelineErrors(unittest.TestCase):
+    def test_submitter_error_stops_the_sync(self):
+        tests = [FakeTestNG("a"), FakeTestNG("b", error=ValueError("no record")), FakeTestNG("c")]
+        exporter = FakeExporter(tests)
+        self.assertRaises(ValueError, exporter.create_test_run_pipelined, "template")
+        self.assertEqual([t.recorded for t in tests], [True, False, False])
+        self.assertEqual(exporter.finished, ["run-of-suite"])
+
+    def test_sync_error_wins(self):
+        tests = [FakeTestNG("a", error=ValueError("no record"))]
+        exporter = FakeExporter(tests, sync_error=RuntimeError("sync failed"))
+        self.assertRaises(RuntimeError, exporter.create_test_run_pipelined, "template")
+        self.assertEqual(exporter.finished, ["run-of-suite"])
+
+    def test_no_errors(self):
+        tests = [FakeTestNG("a"), FakeTestNG("b")]
+        exporter = FakeExporter(tests)
+        exporter.create_test_run_pipelined("template")
+        self.assertTrue(all(t.recorded for t in tests))
+        self.assertEqual(exporter.finished, ["run-of-suite"])
+
+
+class FakeTransformer(object):
+    project_id = "RHEL6"
+    config = {}
+
+
+class NewTestCase(object):
+    """
+    A TestNGToPolarion whose test method had no TestCase in Polarion when the results were parsed
+    """
+    created = []
+    lock = threading.Lock()
+
+    def __init__(self, title):
+        self.title = title
+        self.polarion_tc = None
+
+    def create_polarion_tc(self, throttle=None):
+        if self.polarion_tc is None:
+            with self.lock:
+                self.created.append(self.title)
+            return object()
+        return self.polarion_tc
+
+
+class TestSyncTestCase(unittest.TestCase):
+    def test_one_testcase_per_title(self):
+        exporter = Exporter(FakeTransformer(), collect=False)
+        tests = [NewTestCase("RHSM-TC : rhsm.cli.tests.RegisterTests.testRegister") for _ in range(8)]
+        tests.append(NewTestCase("RHSM-TC : rhsm.cli.tests.FactsTests.testFacts"))
+        threads = [threading.Thread(target=exporter.sync_test_case, args=(test,)) for test in tests]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(sorted(NewTestCase.created), ["RHSM-TC : rhsm.cli.tests.FactsTests.testFacts",
+                                                       "RHSM-TC : rhsm.cli.tests.RegisterTests.testRegister"])
+        self.assertEqual(len(set(id(t.polarion_tc) for t in tests[:-1])), 1)
+
+
+class RerunExporter(Exporter):
+    """
+    Just the parts of a rerun that decide which TestRuns are updated and which are created
+    """
+    def __init__(self, tests):
+        self.tests = tests
+        self.updated = []
+        self.created = []
+
+    @staticmethod
+    def get_test_run(test_run_id):
+        return test_run_id
+
+    def update_test_run(self, test_run, runner="stoner", suite_names=None):
+        self.updated.append((test_run, suite_names))
+
+    def create_test_run(self, template_id, test_run_base=None, runner=None, suite_names=None):
+        self.created.append((template_id, suite_names))
+
+
+class TestRerun(unittest.TestCase):
+    def test_missing_suites_get_a_test_run(self):
+        exporter = RerunExporter({"Tier1": [FakeTestNG("a")], "Tier2": [FakeTestNG("b")],
+                                  "Tier3": [FakeTestNG("c")], "Empty": []})
+        # the earlier export failed after creating the TestRun of Tier1
+        exporter.update_previous_runs("template", {"Tier1": "Tier1 Run 1"})
+        self.assertEqual(exporter.updated, [("Tier1 Run 1", ["Tier1"])])
+        self.assertEqual(exporter.created, [("template", ["Tier2", "Tier3"])])
+
+    def test_nothing_missing(self):
+        exporter = RerunExporter({"Tier1": [FakeTestNG("a")]})
+        exporter.update_previous_runs("template", {"Tier1": "Tier1 Run 1"})
+        self.assertEqual(exporter.created, [])
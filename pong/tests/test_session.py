@@ -0,0 +1,161 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from suds.sax.element import Element
+from pong.cache import TTLStore
+from pong.session import install_session_cache, install_wsdl_cache, get_session_id
+from pong.transport import CLIENT_DEFAULTS, install, uninstall
+
+
+class FakeService(object):
+    def __init__(self, server):
+        self.server = server
+
+    def hasSubject(self):
+        return self.server.valid
+
+
+class FakeClient(object):
+    def __init__(self, server):
+        self.service = FakeService(server)
+        self.headers = None
+
+    def set_options(self, soapheaders=None):
+        self.headers = soapheaders
+
+
+class FakeServer(object):
+    url = "https://polarion.example.com/polarion"
+    user = "stoner"
+    valid = True
+
+
+class FakeWrapper(object):
+    def __init__(self, server):
+        self.client = FakeClient(server)
+
+
+class FakeSession(object):
+    logins = 0
+
+    def __init__(self):
+        self._server = FakeServer()
+        self._session_service = FakeWrapper(self._server)
+        self._tracker_client = FakeWrapper(self._server)
+
+    def _login(self):
+        fake_login(self)
+
+
+def fake_login(session):
+    FakeSession.logins += 1
+    header = Element("sessionID", ns=("ns1", "http://ws.polarion.com/session"))
+    session._session_id_header = header.setText("session-{}".format(FakeSession.logins))
+    for wrapper in (getattr(session, "_session_service", None), session._tracker_client):
+        if wrapper is not None:
+            wrapper.client.set_options(soapheaders=session._session_id_header)
+
+
+class HeaderlessSession(FakeSession):
+    """
+    A pylarion that keeps the session id somewhere else
+    """
+    def _login(self):
+        fake_login(self)
+        del self._session_id_header
+
+
+class ServicelessSession(FakeSession):
+    """
+    A pylarion without a _session_service to check the session with
+    """
+    def __init__(self):
+        FakeSession.__init__(self)
+        del self._session_service
+
+    def _login(self):
+        fake_login(self)
+
+
+class TestSessionCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = TTLStore("sessions.json", 600, cache_dir=self.tmp)
+        FakeSession.logins = 0
+        install_session_cache(self.store, session_class=FakeSession)
+
+    def tearDown(self):
+        off = TTLStore("sessions.json", 0, cache_dir=self.tmp)
+        for session_class in (FakeSession, HeaderlessSession, ServicelessSession):
+            install_session_cache(off, session_class=session_class)
+        shutil.rmtree(self.tmp)
+
+    def test_session_is_reused(self):
+        FakeSession()._login()
+        session = FakeSession()
+        session._login()
+        self.assertEqual(FakeSession.logins, 1)
+        self.assertEqual(get_session_id(session), ("session-1", "http://ws.polarion.com/session"))
+        self.assertEqual(session._tracker_client.client.headers.getText(), "session-1")
+        mode = stat.S_IMODE(os.stat(self.store.path).st_mode)
+        self.assertEqual(mode, 0o600)
+
+    def test_invalid_session_logs_in(self):
+        FakeSession()._login()
+        FakeServer.valid = False
+        try:
+            session = FakeSession()
+            session._login()
+        finally:
+            FakeServer.valid = True
+        self.assertEqual(FakeSession.logins, 2)
+        self.assertEqual(self.store.get(FakeServer.url + "|stoner")["id"], "session-2")
+
+    def test_missing_session_id_header_logs_in(self):
+        install_session_cache(self.store, session_class=HeaderlessSession)
+        HeaderlessSession()._login()
+        HeaderlessSession()._login()
+        self.assertEqual(FakeSession.logins, 2)
+        self.assertIsNone(self.store.get(FakeServer.url + "|stoner"))
+
+    def test_missing_session_service_logs_in(self):
+        FakeSession()._login()
+        install_session_cache(self.store, session_class=ServicelessSession)
+        session = ServicelessSession()
+        session._login()
+        self.assertEqual(FakeSession.logins, 2)
+        self.assertEqual(get_session_id(session), ("session-2", "http://ws.polarion.com/session"))
+
+
+class TestWsdlCache(unittest.TestCase):
+    def test_cache_default(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            install_wsdl_cache(days=1, location=os.path.join(tmp, "wsdl"))
+            cache = CLIENT_DEFAULTS["cache"]()
+            self.assertEqual(cache.location, os.path.join(tmp, "wsdl"))
+            install_wsdl_cache(days=0)
+            self.assertNotIn("cache", CLIENT_DEFAULTS)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_client_is_unpatched(self):
+        from suds.client import Client
+
+        original = vars(Client)["__init__"]
+        tmp = tempfile.mkdtemp()
+        try:
+            install_wsdl_cache(days=1, location=os.path.join(tmp, "wsdl"))
+            install(maxsize=1)
+            self.assertTrue(getattr(Client.__init__, "patched", False))
+            install_wsdl_cache(days=0)
+            self.assertTrue(getattr(Client.__init__, "patched", False))
+            uninstall()
+            self.assertIs(vars(Client)["__init__"], original)
+        finally:
+            install_wsdl_cache(days=0)
+            uninstall()
+            shutil.rmtree(tmp)
@@ -0,0 +1,133 @@
+import unittest
+import ssl
+import threading
+from pong.decorators import retry, RETRY_LISTENERS, add_retry_listener, remove_retry_listener
+from pong.throttle import TokenBucket, AdaptiveLimiter, WriteThrottle, project_bucket, throttled
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.now += secs
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(2, capacity=2, clock=clock, sleep=clock.sleep)
+        waits = [bucket.acquire() for _ in range(6)]
+        # The first 2 are a burst, then one every half second
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(clock.now, 2.0)
+
+    def test_unlimited(self):
+        bucket = TokenBucket(0)
+        self.assertEqual(bucket.acquire(), 0.0)
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    def test_additive_increase(self):
+        clock = FakeClock()
+        limiter = AdaptiveLimiter(initial=1, maximum=4, latency_target=1.0, clock=clock)
+        for _ in range(20):
+            with limiter.slot():
+                clock.now += 0.1
+        self.assertEqual(int(limiter.limit), 4)
+
+    def test_multiplicative_decrease(self):
+        clock = FakeClock()
+        limiter = AdaptiveLimiter(initial=8, maximum=8, latency_target=1.0, cooldown=1.0, clock=clock)
+        with limiter.slot():
+            clock.now += 5.0
+        self.assertEqual(limiter.limit, 4)
+        # a second overload within the cooldown does not cut again
+        limiter.on_retry(None, ssl.SSLError("The read operation timed out"))
+        self.assertEqual(limiter.limit, 4)
+        clock.now += 2.0
+        limiter.on_retry(None, ssl.SSLError("The read operation timed out"))
+        self.assertEqual(limiter.limit, 2)
+        limiter.on_retry(None, ValueError("not an overload"))
+        self.assertEqual(limiter.limit, 2)
+
+        with self.assertRaises(IOError):
+            with limiter.slot():
+                clock.now += 2.0
+                raise IOError("failed")
+        self.assertEqual((limiter.limit, limiter.active), (1, 0))
+
+    def test_concurrency_is_capped(self):
+        limiter = AdaptiveLimiter(initial=2, maximum=2, latency_target=None)
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def work():
+            with limiter.slot():
+                with lock:
+                    running[0] += 1
+                    running[1] = max(running)
+                threading.Event().wait(0.01)
+                with lock:
+                    running[0] -= 1
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(running[1], 2)
+
+    def test_retry_listener(self):
+        seen = []
+        listener = lambda fn, ex: seen.append(type(ex))
+        add_retry_listener(listener)
+        calls = []
+
+        @retry
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise ssl.SSLError("timed out")
+            return "ok"
+        try:
+            self.assertEqual(flaky(), "ok")
+        finally:
+            remove_retry_listener(listener)
+        self.assertEqual(seen, [ssl.SSLError, ssl.SSLError])
+        self.assertNotIn(listener, RETRY_LISTENERS)
+
+    def test_project_bucket(self):
+        self.assertIs(project_bucket("RHEL6", 5), project_bucket("RHEL6"))
+        self.assertEqual(project_bucket("RHEL6", 10).rate, 10)
+
+
+class TestWriteThrottle(unittest.TestCase):
+    def test_test_runs_have_their_own_slots(self):
+        throttle = WriteThrottle(test_case_workers=1, test_run_workers=1)
+        recorded = threading.Event()
+
+        def record():
+            with throttled(throttle, test_run=True):
+                recorded.set()
+        with throttled(throttle):
+            thread = threading.Thread(target=record)
+            thread.start()
+            # a TestRecord doesn't wait for the TestCase write that is running
+            self.assertTrue(recorded.wait(5))
+        thread.join()
+
+    def test_exports_are_independent(self):
+        first = WriteThrottle("RHEL6", test_case_workers=4)
+        second = WriteThrottle("RHEL6", test_case_workers=1)
+        with first:
+            first.on_retry(None, ssl.SSLError("The read operation timed out"))
+        self.assertEqual(second.test_cases.maximum, 1)
+        self.assertNotIn(first.on_retry, RETRY_LISTENERS)
+        self.assertIs(first.bucket, second.bucket)
+
+    def test_no_throttle(self):
+        with throttled(None):
+            pass
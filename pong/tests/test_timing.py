@@ -0,0 +1,40 @@
+import datetime
+import unittest
+from pong.core import TestNGToPolarion, TestIterationResult
+from pong.utils import parse_timestamp
+
+
+def result(status, started, duration_ms="2000"):
+    return TestIterationResult({"status": status, "duration-ms": duration_ms, "started-at": started})
+
+
+class TestParseTimestamp(unittest.TestCase):
+    def test_fixed_format(self):
+        self.assertEqual(parse_timestamp("2016-02-01T10:20:30Z"), datetime.datetime(2016, 2, 1, 10, 20, 30))
+
+    def test_fallback(self):
+        self.assertRaises(ValueError, parse_timestamp, "2016-02-01 10:20:30")
+        now = datetime.datetime.now()
+        self.assertIs(parse_timestamp(now), now)
+
+
+class TestIterationAggregation(unittest.TestCase):
+    ATTRS = {"status": "PASS", "duration-ms": "5", "started-at": "2016-02-01T10:00:00Z", "data-provider": "dp"}
+
+    def make(self, first=None):
+        return TestNGToPolarion(dict(self.ATTRS), "rhsm.cli.tests.T.testFoo", result=first, project="RHEL6")
+
+    def test_no_iterations(self):
+        testng = self.make()
+        self.assertEqual(testng.status, "PASS")
+        self.assertEqual(testng.timing(), (datetime.datetime(2016, 2, 1, 10, 0, 0), 5.0))
+
+    def test_iterations(self):
+        testng = self.make(result("PASS", "2016-02-01T10:00:00Z"))
+        testng.add_result(None)
+        testng.add_result(result("SKIP", "2016-02-01T10:00:10Z"))
+        self.assertEqual(testng.status, "PASS")
+        testng.add_result(result("FAIL", "2016-02-01T10:01:00Z", "1500"))
+        self.assertEqual(testng.status, "FAIL")
+        self.assertEqual(len(testng.step_results), 3)
+        self.assertEqual(testng.timing(), (datetime.datetime(2016, 2, 1, 10, 0, 0), 61.5))
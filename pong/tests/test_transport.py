@@ -0,0 +1,97 @@
+import threading
+import unittest
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+from suds.transport import Request, TransportError
+from pong.transport import PooledTransport, make_pool_manager, stats, install, uninstall, thread_safe_workers
+
+
+class SoapHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        status = 500 if body == "fault" else 200
+        reply = "<reply>{}</reply>".format(self.headers.get("Cookie", "")).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(reply)))
+        self.send_header("Set-Cookie", "ROUTE=node1; Path=/")
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestPooledTransport(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), SoapHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = "http://127.0.0.1:{}/polarion/ws/services/TrackerWebService".format(self.server.server_port)
+        self.manager = make_pool_manager(maxsize=2)
+
+    def tearDown(self):
+        self.manager.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused(self):
+        transport = PooledTransport(self.manager)
+        replies = [transport.send(Request(self.url, "<soap/>")) for _ in range(5)]
+        self.assertEqual(replies[0].message, "<reply></reply>")
+        self.assertEqual(replies[-1].message, "<reply>ROUTE=node1</reply>")
+
+        counts = list(stats(self.manager).values())[0]
+        self.assertEqual(counts, {"opened": 1, "requests": 5, "reused": 4})
+
+    def test_concurrent_requests_reuse_connections(self):
+        # more threads than pooled connections: the extra threads wait for a connection instead of opening one
+        transport = PooledTransport(self.manager)
+        errors = []
+
+        def work():
+            try:
+                for _ in range(10):
+                    transport.send(Request(self.url, "<soap/>"))
+            except Exception as ex:
+                errors.append(ex)
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+
+        self.assertEqual(errors, [])
+        counts = list(stats(self.manager).values())[0]
+        self.assertEqual(counts["requests"], 80)
+        self.assertLessEqual(counts["opened"], 2)
+
+    def test_fault(self):
+        transport = PooledTransport(self.manager)
+        with self.assertRaises(TransportError) as ctx:
+            transport.send(Request(self.url, "fault"))
+        self.assertEqual(ctx.exception.httpcode, 500)
+        self.assertEqual(ctx.exception.fp.read(), "<reply></reply>")
+
+
+class TestThreadSafeWorkers(unittest.TestCase):
+    def test_only_pooled_transport_is_shared(self):
+        uninstall()
+        self.assertEqual(thread_safe_workers(4, "the suites"), 1)
+        install(maxsize=4)
+        try:
+            self.assertEqual(thread_safe_workers(4, "the suites"), 4)
+        finally:
+            uninstall()
@@ -0,0 +1,249 @@
+"""
+Helpers to keep the load pong puts on the Polarion server in check
+"""
+
+import socket
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from pong.decorators import add_retry_listener, remove_retry_listener
+from pong.logger import log
+
+# Seconds a Polarion write may take before it is taken as a sign that the server is struggling
+DEFAULT_LATENCY_TARGET = 10.0
+
+
+class TokenBucket(object):
+    """
+    A thread safe token bucket rate limiter: acquire() blocks until a token is available.  Tokens are added
+    at rate per second, up to capacity (which allows short bursts)
+    """
+    def __init__(self, rate, capacity=None, clock=time.time, sleep=time.sleep):
+        """
+        :param rate: tokens per second.  None or <= 0 means unlimited
+        :param capacity: the most tokens that can be saved up (defaults to max(1, rate))
+        :param clock: function returning the current time in seconds
+        :param sleep: function that sleeps for a number of seconds
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate or 0)
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    @property
+    def unlimited(self):
+        return self.rate is None or self.rate <= 0
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, tokens=1):
+        """
+        Takes tokens from the bucket, waiting until there are enough
+
+        :param tokens: how many tokens to take
+        :return: how long we waited, in seconds
+        """
+        if self.unlimited:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait = (tokens - self._tokens) / float(self.rate)
+            self._sleep(wait)
+            waited += wait
+
+
+def is_overload_error(ex):
+    """
+    Whether an exception looks like the server (or the network to it) is overloaded: SSL errors and timeouts
+    """
+    if isinstance(ex, (ssl.SSLError, socket.timeout)):
+        return True
+    return "Timeout" in type(ex).__name__ or "timed out" in str(ex).lower()
+
+
+class AdaptiveLimiter(object):
+    """
+    Limits how many calls run at the same time, and adapts that limit AIMD style (like TCP congestion control):
+
+    - every call that succeeds within latency_target raises the limit by about 1 per limit calls
+    - a call that fails or is slower than latency_target, or an overload error seen by decorators.retry (see
+      on_retry), cuts the limit by the decrease factor.  Cuts are at most one per cooldown seconds, so that a
+      burst of errors from the calls already running only counts once
+    """
+    def __init__(self, initial=1, minimum=1, maximum=8, latency_target=DEFAULT_LATENCY_TARGET, decrease=0.5,
+                 cooldown=1.0, clock=time.time):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_target = latency_target
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self._clock = clock
+        self._active = 0
+        self._last_cut = None
+        self._cond = threading.Condition()
+
+    @property
+    def active(self):
+        return self._active
+
+    def configure(self, maximum=None, latency_target=None):
+        with self._cond:
+            if maximum is not None:
+                self.maximum = max(self.minimum, int(maximum))
+                self.limit = min(self.limit, self.maximum)
+            if latency_target is not None:
+                self.latency_target = latency_target
+            self._cond.notify_all()
+
+    def acquire(self):
+        """
+        Waits for a free slot
+
+        :return: the start time, to give to release()
+        """
+        with self._cond:
+            while self._active >= int(self.limit):
+                self._cond.wait()
+            self._active += 1
+        return self._clock()
+
+    def release(self, started, ok=True):
+        """
+        :param started: what acquire() returned
+        :param ok: whether the call succeeded
+        """
+        latency = self._clock() - started
+        with self._cond:
+            self._active -= 1
+            if ok and (self.latency_target is None or latency <= self.latency_target):
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            else:
+                self._cut()
+            self._cond.notify_all()
+
+    def _cut(self):
+        now = self._clock()
+        if self._last_cut is not None and now - self._last_cut < self.cooldown:
+            return
+        self._last_cut = now
+        self.limit = max(self.minimum, self.limit * self.decrease)
+
+    def backoff(self):
+        with self._cond:
+            self._cut()
+
+    def on_retry(self, fn, ex):
+        """
+        A decorators.retry listener that backs off on overload errors
+        """
+        if is_overload_error(ex):
+            log.debug("Backing off after {} in {}: write concurrency is now {}".format(
+                type(ex).__name__, getattr(fn, "__name__", fn), int(self.limit)))
+            self.backoff()
+
+    @contextmanager
+    def slot(self):
+        started = self.acquire()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.release(started, ok)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def project_bucket(project, rate=None):
+    """
+    The TokenBucket shared by everything writing to project.  Giving a rate (re)sets the cap of that project
+
+    :param project: the project id
+    :param rate: writes per second (None keeps the current rate, <= 0 is unlimited)
+    :return: TokenBucket
+    """
+    with _buckets_lock:
+        bucket = _buckets.get(project)
+        if bucket is None or (rate is not None and rate != bucket.rate):
+            bucket = _buckets[project] = TokenBucket(rate)
+        return bucket
+
+
+class WriteThrottle(object):
+    """
+    The rate cap and the limiters of the Polarion writes of one export (see exporter.write_throttle).  The
+    TestCase writes and the TestRun writes (TestRecords and TestRun updates) each have their own
+    AdaptiveLimiter, so that the TestRecords of a pipelined export don't wait for the TestCases being synced
+
+    Only the write calls themselves should be run in a slot (see throttled), so that the reads around them
+    neither hold a slot nor count against the latency target
+    """
+    def __init__(self, project=None, test_case_workers=1, test_run_workers=1, rate=None, latency_target=None):
+        """
+        :param project: the project being written to (its rate cap is shared, see project_bucket)
+        :param test_case_workers: the most TestCase writes to run at the same time
+        :param test_run_workers: the most TestRecord and TestRun writes to run at the same time
+        :param rate: the most writes per second for the project (None or <= 0 for no cap)
+        :param latency_target: seconds a write may take before it counts as a sign of overload
+        """
+        if latency_target is None:
+            latency_target = DEFAULT_LATENCY_TARGET
+        self.test_cases = AdaptiveLimiter(maximum=test_case_workers, latency_target=latency_target)
+        self.test_runs = AdaptiveLimiter(maximum=test_run_workers, latency_target=latency_target)
+        self.bucket = project_bucket(project, rate) if project is not None else TokenBucket(rate)
+
+    @contextmanager
+    def write(self, test_run=False):
+        """
+        Waits for the project's rate cap and for a slot to run one write in
+
+        :param test_run: whether it is a TestRecord or TestRun write (rather than a TestCase one)
+        """
+        self.bucket.acquire()
+        with (self.test_runs if test_run else self.test_cases).slot():
+            yield
+
+    def on_retry(self, fn, ex):
+        """
+        A decorators.retry listener that backs off both limiters on overload errors
+        """
+        self.test_cases.on_retry(fn, ex)
+        self.test_runs.on_retry(fn, ex)
+
+    def __enter__(self):
+        add_retry_listener(self.on_retry)
+        return self
+
+    def __exit__(self, *exc_info):
+        remove_retry_listener(self.on_retry)
+
+
+@contextmanager
+def unthrottled():
+    yield
+
+
+def throttled(throttle, test_run=False):
+    """
+    :param throttle: a WriteThrottle, or None to not throttle
+    :param test_run: see WriteThrottle.write
+    :return: a context manager to run one Polarion write in
+    """
+    return throttle.write(test_run=test_run) if throttle is not None else unthrottled()
@@ -0,0 +1,242 @@
+"""
+A keep-alive, pooled HTTP(S) transport for the suds clients that pylarion creates.
+
+suds' default transport goes through urllib2, which closes the connection after every request, so every SOAP
+call pays for a new TCP connection and TLS handshake.  The PooledTransport here sends the requests through a
+urllib3 PoolManager instead, which keeps the connections to the Polarion server open and hands them out to
+whichever thread needs one.  The handshake is then done once per pooled connection instead of once per call.
+
+pylarion creates its suds Clients itself, so install() wraps suds.client.Client.__init__ (see patch_client)
+to hand every new Client a PooledTransport (all of them sharing one PoolManager).  It has to be called before
+pylarion creates its session.
+"""
+
+import io
+import threading
+
+import urllib3
+from suds.transport import Transport, Reply, TransportError
+
+from pong.logger import log
+
+_manager = None
+_manager_args = None
+_lock = threading.Lock()
+
+
+class PooledTransport(Transport):
+    """
+    A suds Transport that sends everything through a shared urllib3 PoolManager.  Without a manager, the one
+    from install() is used, so that resizing the pool also applies to the Clients that already exist
+    """
+    def __init__(self, manager=None):
+        Transport.__init__(self)
+        self._manager = manager
+        self.cookies = {}
+        self._cookie_lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        # suds deep copies the Client options (which hold the transport) when a Client is cloned.  The copy has
+        # to keep using the same pool, and locks and sockets can't be copied anyway
+        return PooledTransport(self._manager)
+
+    @property
+    def manager(self):
+        if self._manager is not None:
+            return self._manager
+        return _manager or install()
+
+    def _timeout(self, request):
+        timeout = getattr(request, "timeout", None) or getattr(self.options, "timeout", None)
+        return urllib3.Timeout(total=timeout) if timeout else urllib3.Timeout.DEFAULT_TIMEOUT
+
+    def _headers(self, request):
+        headers = dict(request.headers or {})
+        with self._cookie_lock:
+            if self.cookies:
+                headers["Cookie"] = "; ".join("{}={}".format(k, v) for k, v in sorted(self.cookies.items()))
+        return headers
+
+    def _remember_cookies(self, response):
+        # Only the name=value part matters to us (eg a load balancer's sticky session cookie)
+        set_cookies = response.headers.getlist("Set-Cookie") if hasattr(response.headers, "getlist") else \
+            [response.headers.get("Set-Cookie")]
+        with self._cookie_lock:
+            for cookie in filter(None, set_cookies):
+                name, _, value = cookie.split(";", 1)[0].partition("=")
+                self.cookies[name.strip()] = value.strip()
+
+    def _urlopen(self, method, request, body=None):
+        response = self.manager.urlopen(method, request.url, body=body, headers=self._headers(request),
+                                        timeout=self._timeout(request), retries=False, redirect=method == "GET",
+                                        preload_content=True)
+        self._remember_cookies(response)
+        return response
+
+    def open(self, request):
+        response = self._urlopen("GET", request)
+        if response.status >= 300:
+            raise TransportError(response.reason, response.status, io.BytesIO(response.data))
+        return io.BytesIO(response.data)
+
+    def send(self, request):
+        response = self._urlopen("POST", request, body=request.message)
+        if response.status in (202, 204):
+            return None
+        if response.status >= 300:
+            # suds reads the SOAP fault out of the body of a 500
+            raise TransportError(response.reason, response.status, io.BytesIO(response.data))
+        return Reply(response.status, dict(response.headers), response.data)
+
+
+def make_pool_manager(maxsize=1, ca_certs=None):
+    """
+    The pool blocks: a thread that finds all maxsize connections in use waits for one to be returned, instead
+    of opening an extra connection that would be thrown away after its request (and a new TLS handshake with it)
+
+    :param maxsize: how many connections to keep open per host (should be the number of threads that talk to
+                    Polarion at once, see exporter.connection_pool_size)
+    :param ca_certs: path to a CA bundle to verify the server with.  Without one, certificates are not verified
+                     (the same as the rest of pong, see decorators.py)
+    :return: urllib3.PoolManager
+    """
+    kwargs = {"maxsize": max(1, int(maxsize)), "block": True}
+    if ca_certs:
+        kwargs.update(cert_reqs="CERT_REQUIRED", ca_certs=ca_certs)
+    else:
+        kwargs["cert_reqs"] = "CERT_NONE"
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    return urllib3.PoolManager(**kwargs)
+
+
+# keyword argument -> function making its default value, for every suds Client created while patched
+CLIENT_DEFAULTS = {}
+
+
+def patch_client():
+    """
+    Wraps suds.client.Client.__init__ (once) so that the keyword arguments in CLIENT_DEFAULTS are given to
+    every new Client that was not passed them explicitly
+    """
+    from suds.client import Client
+
+    if getattr(Client.__init__, "patched", False):
+        return
+    original = vars(Client)["__init__"]
+
+    def __init__(self, url, **kwargs):
+        for name, factory in list(CLIENT_DEFAULTS.items()):
+            if name not in kwargs:
+                kwargs[name] = factory()
+        original(self, url, **kwargs)
+    __init__.patched = True
+    __init__.original = original
+    Client.__init__ = __init__
+
+
+def unpatch_client():
+    """
+    Puts back the original suds.client.Client.__init__
+    """
+    from suds.client import Client
+
+    patched = vars(Client)["__init__"]
+    if getattr(patched, "patched", False):
+        Client.__init__ = patched.original
+
+
+def drop_client_default(name):
+    """
+    Stops giving new suds Clients the name keyword argument.  Once there are no defaults left, Client is unpatched
+    """
+    CLIENT_DEFAULTS.pop(name, None)
+    if not CLIENT_DEFAULTS:
+        unpatch_client()
+
+
+def install(maxsize=1, ca_certs=None):
+    """
+    Makes every suds Client created from now on use a PooledTransport, unless it was given a transport
+
+    Calling it again with other arguments resizes the pool (the open connections of the old pool are closed).
+    With the same arguments, the pool and its open connections are kept (see daemon.py)
+
+    :param maxsize: connections to keep open per host
+    :param ca_certs: path to a CA bundle (optional)
+    :return: the shared urllib3.PoolManager
+    """
+    global _manager, _manager_args
+
+    with _lock:
+        patch_client()
+        CLIENT_DEFAULTS["transport"] = PooledTransport
+        if _manager is not None and _manager_args == (maxsize, ca_certs):
+            return _manager
+        if _manager is not None:
+            _manager.clear()
+        _manager = make_pool_manager(maxsize=maxsize, ca_certs=ca_certs)
+        _manager_args = (maxsize, ca_certs)
+        log.debug("suds Clients will use a connection pool of size {}".format(maxsize))
+        return _manager
+
+
+def is_installed():
+    """
+    :return: True if new suds Clients get a PooledTransport (which, unlike the default one, is thread safe)
+    """
+    return CLIENT_DEFAULTS.get("transport") is PooledTransport
+
+
+def thread_safe_workers(workers, what):
+    """
+    How many threads may share pylarion's session: its suds Clients share their transport, and the default
+    urllib2 one is not safe to share between threads
+
+    :param workers: how many threads were asked for
+    :param what: what the threads are for (eg "the suites"), for the warning
+    :return: workers, or 1 if the PooledTransport is not installed
+    """
+    if workers > 1 and not is_installed():
+        log.warning("Not running {} concurrently, since the pooled_transport is off".format(what))
+        return 1
+    return workers
+
+
+def uninstall():
+    """
+    Goes back to the default suds transport for new Clients
+    """
+    global _manager, _manager_args
+
+    with _lock:
+        drop_client_default("transport")
+        if _manager is not None:
+            _manager.clear()
+            _manager = None
+            _manager_args = None
+
+
+def stats(manager=None):
+    """
+    How many connections each pool opened, and how many requests reused an already open one
+
+    :param manager: a PoolManager (the installed one by default)
+    :return: dict of "scheme://host:port" -> {"opened": int, "requests": int, "reused": int}
+    """
+    manager = _manager if manager is None else manager
+    result = {}
+    if manager is None:
+        return result
+    for key in manager.pools.keys():
+        pool = manager.pools.get(key)
+        if pool is None:
+            continue
+        name = "{}://{}:{}".format(pool.scheme, pool.host, pool.port)
+        result[name] = {"opened": pool.num_connections, "requests": pool.num_requests,
+                        "reused": max(0, pool.num_requests - pool.num_connections)}
+    return result
+
+
+def log_stats(manager=None):
+    for name, counts in sorted(stats(manager).items()):
+        log.info("{}: {requests} requests over {opened} connections ({reused} reused)".format(name, **counts))
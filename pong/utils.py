@@ -1,16 +1,25 @@
+import datetime
 import shutil
 
 import re
 import os
+import threading
 import ConfigParser
 from functools import partial
 from itertools import repeat
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 
 from toolz import itertoolz as itz
 from toolz import functoolz as ftz
 
 from pong.decorators import retry, profile
+from pong.logger import log
+from pong.cache import WORK_ITEMS, RUN_NUMBERS, run_number
 
 PYLARION_CONFIG = [os.path.join(os.environ['HOME'], ".pylarion")]
 PASS = "PASS"
@@ -28,6 +37,23 @@ TC_KEYS = {"caseimportance": "high",
            "subtype1": "reliability",
            "caseautomation": "automated"}
 
+# The fields of a TestCase that TestNGToPolarion.create_polarion_tc needs.  Querying with these up front means
+# the query results can be used as is, instead of being fetched again by uri
+TC_FIELDS = ["work_item_id", "title"]
+TC_FULL_FIELDS = TC_FIELDS + ["description", "author", "linked_work_items"] + sorted(TC_KEYS.keys())
+
+
+def as_bool(val):
+    """
+    Config values may come from the CLI, env vars or yaml, so a flag may be a bool or a string like "True"
+
+    :param val: a bool, None or a string
+    :return: bool
+    """
+    if isinstance(val, basestring):
+        return val.strip().lower() in ["true", "yes", "1", "on"]
+    return bool(val)
+
 
 def get_class_methodname(s):
     """
@@ -44,21 +70,176 @@ def get_class_methodname(s):
 
 @profile
 @retry
-def query_test_case(query, fields=None, **kwargs):
+def query_test_case(query, fields=None, full=False, **kwargs):
     """
     Returns a list of pylarion TestCase objects
 
     :param query:
     :param fields: an optional list of fields to populate in the returned TestCase objects
                    (by default only work_item_id and title will be populated)
+    :param full: if True, query for TC_FULL_FIELDS, so that the results can be registered in the session identity
+                 map and fetch_test_case() will not fetch them again
     :return:
     """
-    if fields is None:
-        fields = ["work_item_id", "title"]
+    if full:
+        fields = TC_FULL_FIELDS
+    elif fields is None:
+        fields = TC_FIELDS
     from pylarion.work_item import TestCase as PylTestCase
     return PylTestCase.query(query, fields=fields, **kwargs)
 
 
+DEFAULT_PAGE_SIZE = 500
+# Most queries run at the same time by the preload (see parsing.Transformer.preload)
+MAX_QUERY_WORKERS = 8
+
+
+def work_item_id_from_uri(uri):
+    """
+    :param uri: a WorkItem uri (eg subterra:data-service:objects:/default/RHEL6${WorkItem}RHEL6-1234)
+    :return: the work_item_id (eg RHEL6-1234)
+    """
+    return uri.rsplit("}", 1)[-1]
+
+
+def scoped_query(query, wi_class):
+    """
+    Limits query to the default project and to the WorkItem type of wi_class, the way pylarion's query does
+
+    :param query: a Lucene query
+    :param wi_class: a pylarion WorkItem class (eg TestCase)
+    :return: str
+    """
+    scoped = "({}) AND project.id:{}".format(query, wi_class.default_project)
+    wi_type = getattr(wi_class, "_wi_type", None)
+    if wi_type:
+        scoped += " AND type:{}".format(wi_type)
+    return scoped
+
+
+@retry
+def query_work_item_uris(query, sort="id", wi_class=None):
+    """
+    Returns just the uris of the WorkItems matching query, which is a lot less to transfer and hold on to than
+    the WorkItems themselves.  The web service is called directly, so the query is scoped here (see scoped_query)
+
+    :param wi_class: the pylarion WorkItem class to query (TestCase by default)
+    """
+    if wi_class is None:
+        from pylarion.work_item import TestCase as wi_class
+    return wi_class.session.tracker_client.service.queryWorkItemUris(scoped_query(query, wi_class), sort, -1)
+
+
+def iter_pages(ids, fetch_page, page_size=DEFAULT_PAGE_SIZE, prefetch=True):
+    """
+    Generator of the pages of WorkItems for a list of ids.  With prefetch, the next page is already being
+    fetched in a background thread while the caller works on the current one
+
+    :param ids: list of work_item_ids
+    :param fetch_page: function taking a list of ids and returning the list of their WorkItems
+    :param page_size: how many ids per page
+    :param prefetch: whether to fetch the next page in the background
+    :return: generator of lists
+    """
+    chunks = [ids[i:i + page_size] for i in range(0, len(ids), max(1, page_size))]
+    if not prefetch:
+        for chunk in chunks:
+            yield fetch_page(chunk)
+        return
+
+    pages = queue.Queue(maxsize=1)
+    done = object()
+    stop = threading.Event()
+
+    def producer():
+        try:
+            for chunk in chunks:
+                if stop.is_set():
+                    return
+                pages.put((fetch_page(chunk), None))
+        except Exception as ex:
+            pages.put((None, ex))
+        pages.put((done, None))
+
+    worker = threading.Thread(target=producer, name="PagePrefetch")
+    worker.daemon = True
+    worker.start()
+    try:
+        while True:
+            page, error = pages.get()
+            if error is not None:
+                raise error
+            if page is done:
+                break
+            yield page
+    finally:
+        # If the caller stops early, let the producer finish its current page and quit
+        stop.set()
+        while worker.is_alive():
+            try:
+                pages.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def id_query(ids):
+    return "id:({})".format(" ".join(ids))
+
+
+def iter_test_cases(query, page_size=DEFAULT_PAGE_SIZE, fields=None, full=False, prefetch=True):
+    """
+    Like query_test_case, but the TestCases come a page at a time, so that they don't all have to be in memory
+    at once, and the first ones can be used before the last ones have arrived.  The matching uris are queried
+    first, and then the TestCases are queried page_size ids at a time
+
+    :return: generator of lists of pylarion TestCase
+    """
+    from pong.transport import is_installed
+
+    ids = [work_item_id_from_uri(uri) for uri in query_work_item_uris(query)]
+    log.debug("{} TestCases match {}".format(len(ids), query))
+    fetch = lambda chunk: query_test_case(id_query(chunk), fields=fields, full=full)
+    # The prefetch thread shares pylarion's session, which is only thread safe with the pooled transport
+    return iter_pages(ids, fetch, page_size=page_size, prefetch=prefetch and is_installed())
+
+
+def iter_requirements(query, page_size=DEFAULT_PAGE_SIZE, fields=None, prefetch=True):
+    """
+    Like query_requirement, a page at a time (see iter_test_cases)
+
+    :return: generator of lists of pylarion Requirement
+    """
+    from pong.transport import is_installed
+
+    from pylarion.work_item import Requirement
+
+    ids = [work_item_id_from_uri(uri) for uri in query_work_item_uris(query, wi_class=Requirement)]
+    fetch = lambda chunk: query_requirement(id_query(chunk), fields=fields)
+    return iter_pages(ids, fetch, page_size=page_size, prefetch=prefetch and is_installed())
+
+
+def fetch_test_case(uri):
+    """
+    Returns a fully populated pylarion TestCase for uri, fetching it from Polarion at most once per session
+
+    :param uri: the uri of the TestCase
+    :return: pylarion TestCase
+    """
+    from pylarion.work_item import TestCase as PylTestCase
+    return WORK_ITEMS.get(uri, lambda u: PylTestCase(uri=u))
+
+
+def fetch_test_run(uri):
+    """
+    Returns a fully populated pylarion TestRun for uri, fetching it from Polarion at most once per session
+
+    :param uri: the uri of the TestRun
+    :return: pylarion TestRun
+    """
+    from pylarion.test_run import TestRun
+    return WORK_ITEMS.get(uri, lambda u: TestRun(uri=u))
+
+
 def cached_tc_query(query, test_cases, multiple=False):
     def title_match(tc):
         #klass, method_name = get_class_methodname(str(tc.title))
@@ -121,14 +302,44 @@ def title_query(q, wild=True, no_quote=False):
     return query
 
 
+_CONFIG_FILES = {}
+_CONFIG_LOCK = threading.Lock()
+
+
+def read_config(path=PYLARION_CONFIG):
+    """
+    Reads an ini style config file (like ~/.pylarion) with a ConfigParser.
+
+    The result is memoized until the file changes, since the same file gets read over and over (eg by every
+    Configurator and every TestNGToPolarion).  The returned ConfigParser is shared, so don't modify it
+
+    :param path: a path or list of paths (like ConfigParser.read takes)
+    :return: ConfigParser
+    """
+    paths = [path] if isinstance(path, basestring) else list(path)
+
+    def stamp(p):
+        try:
+            st = os.stat(p)
+            return p, st.st_mtime, st.st_size
+        except OSError:
+            return p, None, None
+
+    key = tuple(stamp(p) for p in paths)
+    with _CONFIG_LOCK:
+        if key not in _CONFIG_FILES:
+            config = ConfigParser.ConfigParser()
+            config.read(paths)
+            _CONFIG_FILES[key] = config
+        return _CONFIG_FILES[key]
+
+
 def get_default_project(pylarion_path=PYLARION_CONFIG):
     """
     Reads in the ~/.pylarion config file to get default project
     :return: the default project
     """
-    config = ConfigParser.ConfigParser()
-    config.read(PYLARION_CONFIG)
-    return config.get("webservice", "default_project")
+    return read_config(pylarion_path).get("webservice", "default_project")
 
 
 def sanitize(text_obj):
@@ -152,6 +363,22 @@ def sanitize(text_obj):
     return final
 
 
+def search_latest_test_run(test_run_name):
+    """
+    Asks Polarion for only the newest TestRun whose id matches test_run_name (sorted by created, descending,
+    limited to 1), so the cost does not grow with the number of historical runs
+
+    :param test_run_name: test run id string without the trailing integer
+    :return: a partially populated TestRun (test_run_id, created, status) or None
+    """
+    from pylarion.test_run import TestRun
+    s = TestRun.search('"{}"'.format(test_run_name),
+                       fields=["test_run_id", "created", "status"],
+                       sort="~created",
+                       limit=1)
+    return itz.first(s) if s else None
+
+
 def get_latest_test_run(test_run_name):
     """
     Gets the most recent TestRun based on the test_run_name
@@ -163,17 +390,33 @@ def get_latest_test_run(test_run_name):
     :param test_run_name: test run id string
     :return: TestRun
     """
-    from pylarion.test_run import TestRun
-    s = TestRun.search('"{}"'.format(test_run_name),
-                       fields=["test_run_id", "created", "status"],
-                       sort="created")
+    latest = search_latest_test_run(test_run_name)
     current = None
-    if s:
-        latest = itz.last(s)
-        current = TestRun(uri=latest.uri)
+    if latest:
+        current = fetch_test_run(latest.uri)
     return current
 
 
+def next_test_run_id(base_name, project_id=None, run_numbers=RUN_NUMBERS):
+    """
+    Generates the id for a new TestRun: "<base_name> Run <N>"
+
+    N is one more than the larger of the newest run on the server and the last number handed out locally
+    for this base name, so two TestRuns created back to back (before Polarion indexes the first) never get
+    the same id.
+
+    :param base_name: a str to look up most recent TestRuns (eg "Jenkins Run" or "Jenkins")
+    :param project_id: the project the TestRun is created in (run numbers are remembered per project)
+    :param run_numbers: a RunNumbers store
+    :return: str
+    """
+    latest = search_latest_test_run(base_name)
+    server_number = run_number(latest.test_run_id) if latest else 0
+    base_name = remove_run(base_name)
+    key = "{}:{}".format(project_id, base_name)
+    return "{} Run {}".format(base_name, run_numbers.next(key, server_number))
+
+
 def get_test_run(project_id, test_run_id):
     """
     Given a Polarion project_id and a test run id (not title) return a fully formed
@@ -226,6 +469,29 @@ def convert_status(testng_result):
     return convert[testng_result]
 
 
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def parse_timestamp(ts):
+    """
+    Parses a testng-results.xml timestamp (eg 2016-02-01T10:00:00Z).  The fields are sliced out directly, which
+    is much faster than datetime.strptime, and anything that doesn't look like that format goes to strptime
+
+    :param ts: str (or an already parsed datetime, which is returned as is)
+    :return: datetime.datetime
+    """
+    if isinstance(ts, datetime.datetime):
+        return ts
+    if len(ts) == 20 and ts[4] == "-" and ts[7] == "-" and ts[10] == "T" and ts[13] == ":" and ts[16] == ":" \
+            and ts[19] == "Z":
+        try:
+            return datetime.datetime(int(ts[0:4]), int(ts[5:7]), int(ts[8:10]),
+                                     int(ts[11:13]), int(ts[14:16]), int(ts[17:19]))
+        except ValueError:
+            pass
+    return datetime.datetime.strptime(ts, TIMESTAMP_FORMAT)
+
+
 def check_test_case_in_test_run(test_run, test_case_id):
     """
     Creates a copy of a test_run obj and checks to see if a test case id